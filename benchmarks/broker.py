@@ -0,0 +1,248 @@
+"""
+Throughput and latency benchmark for the controller <-> broker path.
+
+Starts a realnet-style driver controller and several sibling-style echo
+controllers as separate processes. The driver pushes synthetic messages of a
+configurable size and rate round-robin to the siblings, which send every
+message straight back. Round-trip latencies are measured in the driver.
+
+The shared-memory broker is used by default, so the benchmark runs without a
+NATS server or network access.
+
+Usage:
+    python -m benchmarks.broker [--backend shm|nats] [--codec json|msgpack]
+        [--siblings 2] [--size 256] [--rate 0] [--count 20000] [--output results.json]
+"""
+from argparse import ArgumentParser, Namespace
+import asyncio
+import json
+import logging
+from logging import Logger
+from multiprocessing import Queue
+import os
+from queue import Empty
+import shutil
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import yaml
+
+from config.settings import Settings
+from config.shm import ShmSettings
+from controllers.controller import Controller
+
+
+DRIVER: str = "bench_realnet"
+
+
+def sibling_name(index: int) -> str:
+    return f"bench_sibling_{index}"
+
+
+def percentile(values: List[float], quantile: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(quantile * len(values)))]
+
+
+class EchoController(Controller):
+    """
+    Sibling-style controller that sends every benchmark message back to the driver.
+    """
+
+    def __init__(self, logger: Logger, config: Settings, sibling: str):
+        self._name = sibling
+        super().__init__(logger, config, dict())
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @name.setter
+    def name(self, name: str):
+        self._name = name
+
+    def channels(self) -> List[str]:
+        return [self.name, DRIVER]
+
+    async def async_run(self):
+        assert self.broker
+        subscription, _ = await self.broker.subscribe(self.name)
+        async for message in subscription:
+            data = message.value()
+            if data.get("type") == "bench stop":
+                break
+            await self.broker.publish(DRIVER, data)
+        await self.broker.close()
+
+
+class DriverController(Controller):
+    """
+    Realnet-style controller that generates the load and measures round trips.
+    """
+
+    def __init__(self, logger: Logger, config: Settings, arguments: Namespace, results: Queue):
+        self.arguments: Namespace = arguments
+        self.results: Queue = results
+        super().__init__(logger, config, dict())
+
+    @property
+    def name(self) -> str:
+        return DRIVER
+
+    @name.setter
+    def name(self, name: str):
+        self._name = name
+
+    def channels(self) -> List[str]:
+        return [DRIVER, *(sibling_name(index) for index in range(self.arguments.siblings))]
+
+    async def async_run(self):
+        assert self.broker
+        arguments = self.arguments
+        siblings = [sibling_name(index) for index in range(arguments.siblings)]
+        subscription, _ = await self.broker.subscribe(DRIVER)
+
+        # Wait until every sibling answers, messages sent before a sibling subscribed are lost
+        ready: set = set()
+        while len(ready) < len(siblings):
+            for sibling in siblings:
+                if sibling not in ready:
+                    await self.broker.publish(sibling, {"type": "bench warmup", "sibling": sibling})
+            deadline = time.monotonic() + 0.2
+            while (remaining := deadline - time.monotonic()) > 0:
+                message = await subscription.get(remaining)
+                if message is not None and message.value().get("type") == "bench warmup":
+                    ready.add(message.value()["sibling"])
+
+        latencies: List[float] = list()
+        inflight = asyncio.Semaphore(arguments.inflight)
+        padding = "x" * arguments.size
+
+        async def receive():
+            while len(latencies) < arguments.count:
+                message = await subscription.get(arguments.timeout)
+                if message is None:
+                    self.logger.error(f"Timeout after {len(latencies)} of {arguments.count} round trips")
+                    # Unblock the sender
+                    for _ in range(arguments.inflight):
+                        inflight.release()
+                    return
+                data = message.value()
+                if data.get("type") != "bench":
+                    continue
+                latencies.append((time.perf_counter_ns() - data["sent"]) / 1000)
+                inflight.release()
+
+        receiver = asyncio.get_running_loop().create_task(receive())
+        interval = 1 / arguments.rate if arguments.rate > 0 else 0
+        started = time.perf_counter()
+        for sequence in range(arguments.count):
+            if interval:
+                delay = started + sequence * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await inflight.acquire()
+            if receiver.done():
+                break
+            await self.broker.publish(
+                siblings[sequence % len(siblings)],
+                {"type": "bench", "sequence": sequence, "sent": time.perf_counter_ns(), "padding": padding},
+            )
+        await receiver
+        duration = time.perf_counter() - started
+
+        for sibling in siblings:
+            await self.broker.publish(sibling, {"type": "bench stop"})
+        await self.broker.close()
+
+        latencies.sort()
+        self.results.put(
+            {
+                "backend": arguments.backend,
+                "codec": arguments.codec,
+                "siblings": arguments.siblings,
+                "size": arguments.size,
+                "rate": arguments.rate,
+                "inflight": arguments.inflight,
+                "count": arguments.count,
+                "received": len(latencies),
+                "duration_s": duration,
+                "throughput_msgs_s": len(latencies) / duration if duration else 0.0,
+                "throughput_bytes_s": len(latencies) * arguments.size / duration if duration else 0.0,
+                "latency_us": {
+                    "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+                    "p50": percentile(latencies, 0.50),
+                    "p99": percentile(latencies, 0.99),
+                    "p99.9": percentile(latencies, 0.999),
+                    "max": latencies[-1] if latencies else 0.0,
+                },
+            }
+        )
+
+
+def benchmark_config(arguments: Namespace) -> Settings:
+    """_Load the settings and select the broker backend under test_"""
+    with open(arguments.config) as file:
+        config = Settings(**yaml.safe_load(file))
+    if arguments.backend == "shm":
+        path = os.path.join(tempfile.gettempdir() if not os.path.isdir("/dev/shm") else "/dev/shm", f"digsinet-bench-{os.getpid()}")
+        return config.model_copy(update={"nats": None, "shm": ShmSettings(path=path, codec=arguments.codec)})
+    if config.nats is None:
+        raise ValueError("the nats backend requires nats settings in the configuration file")
+    return config.model_copy(update={"shm": None, "nats": config.nats.model_copy(update={"codec": arguments.codec})})
+
+
+def main():
+    parser: ArgumentParser = ArgumentParser(description="EventBroker throughput and latency benchmark")
+    parser.add_argument("--config", help="Configuration file to take broker settings from", type=str, default="digsinet.yml")
+    parser.add_argument("--backend", help="Broker backend", choices=["shm", "nats"], default="shm")
+    parser.add_argument("--codec", help="Payload codec", choices=["json", "msgpack"], default="json")
+    parser.add_argument("--siblings", help="Number of sibling-style echo controllers", type=int, default=2)
+    parser.add_argument("--size", help="Padding bytes per message", type=int, default=256)
+    parser.add_argument("--rate", help="Messages per second, 0 for as fast as possible", type=float, default=0)
+    parser.add_argument("--count", help="Number of round trips", type=int, default=20000)
+    parser.add_argument("--inflight", help="Maximum number of outstanding round trips", type=int, default=64)
+    parser.add_argument("--timeout", help="Seconds to wait for a round trip before giving up", type=float, default=10)
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout", type=str)
+    arguments: Namespace = parser.parse_args()
+
+    logger: Logger = logging.getLogger("digsinet-v2-benchmark")
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.WARNING)
+
+    config: Settings = benchmark_config(arguments)
+    results: Queue = Queue()
+    siblings: List[Controller] = [
+        EchoController(logger, config, sibling_name(index)) for index in range(arguments.siblings)
+    ]
+    driver = DriverController(logger, config, arguments, results)
+    try:
+        while True:
+            try:
+                result: Dict[str, Any] = results.get(timeout=1)
+                break
+            except Empty:
+                if not driver.process.is_alive():
+                    logger.error("Benchmark driver terminated without results")
+                    for sibling in siblings:
+                        sibling.process.terminate()
+                    return
+        driver.join()
+        for sibling in siblings:
+            sibling.join()
+    finally:
+        if config.shm is not None:
+            shutil.rmtree(config.shm.path, ignore_errors=True)
+
+    output = json.dumps(result, indent=2)
+    if arguments.output:
+        with open(arguments.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
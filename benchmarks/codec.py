@@ -0,0 +1,151 @@
+"""
+Microbenchmark for EventBroker payload codecs.
+
+Compares encode/decode cost and payload size of the available codecs on a
+topology build response and a gNMI telemetry update.
+
+Usage:
+    python -m benchmarks.codec [--nodes 50] [--iterations 2000] [--json]
+"""
+from argparse import ArgumentParser, Namespace
+import json
+import time
+from typing import Any, Callable, Dict, List
+
+from eventbroker.codec import CODECS, Codec, CodecError, get_codec
+
+
+def topology_build_response(nodes: int) -> Dict[str, Any]:
+    """_A topology build response as sent by a sibling controller_"""
+    node_names: List[str] = [f"ceos{index}" for index in range(1, nodes + 1)]
+    topology_nodes: Dict[str, Any] = {
+        name: {"kind": "ceos", "image": "ceos:latest"} for name in node_names
+    }
+    links: List[Dict[str, Any]] = [
+        {"endpoints": [f"{node_names[index]}:eth1", f"{node_names[index + 1]}:eth2"]}
+        for index in range(nodes - 1)
+    ]
+    return {
+        "type": "topology build response",
+        "source": "continuous_integration",
+        "sibling": "continuous_integration",
+        "topology": {"name": "continuous_integration", "topology": {"nodes": topology_nodes, "links": links}},
+        "nodes": {
+            name: {
+                "name": f"clab-continuous_integration-{name}",
+                "kind": "ceos",
+                "image": "ceos:latest",
+                "state": "running",
+                "ipv4_address": f"172.20.20.{index + 2}/24",
+                "ipv6_address": f"3fff:172:20:20::{index + 2}/64",
+            }
+            for index, name in enumerate(node_names)
+        },
+        "interfaces": {
+            "gnmi": {
+                "nodes": "ceos(.*)",
+                "datatype": "config",
+                "paths": ["openconfig:interfaces/interface[name=Ethernet1]"],
+                "strip": ["openconfig:interfaces/interface[name=Management0]"],
+            }
+        },
+        "running": True,
+    }
+
+
+def telemetry_update() -> Dict[str, Any]:
+    """_A gNMI update for a single interface as published by the realnet controller_"""
+    return {
+        "type": "telemetry",
+        "source": "realnet",
+        "node": "ceos1",
+        "timestamp": 1760000000123456789,
+        "path": "openconfig:interfaces/interface[name=Ethernet1]",
+        "updates": [
+            {
+                "path": "openconfig:interfaces/interface[name=Ethernet1]",
+                "val": {
+                    "openconfig-interfaces:config": {
+                        "name": "Ethernet1",
+                        "type": "iana-if-type:ethernetCsmacd",
+                        "mtu": 1500,
+                        "description": "uplink to ceos2",
+                        "enabled": True,
+                    },
+                    "openconfig-interfaces:state": {
+                        "oper-status": "UP",
+                        "admin-status": "UP",
+                        "counters": {
+                            "in-octets": 98234712,
+                            "out-octets": 87123411,
+                            "in-pkts": 712340,
+                            "out-pkts": 698123,
+                            "in-errors": 0,
+                            "out-errors": 0,
+                        },
+                    },
+                },
+            }
+        ],
+    }
+
+
+def measure(function: Callable[[], Any], iterations: int) -> float:
+    """_Best of three runs, in microseconds per call_"""
+    best = float("inf")
+    for _ in range(3):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            function()
+        best = min(best, time.perf_counter() - started)
+    return best / iterations * 1e6
+
+
+def run(nodes: int, iterations: int) -> List[Dict[str, Any]]:
+    messages: Dict[str, Any] = {
+        "topology build response": topology_build_response(nodes),
+        "telemetry": telemetry_update(),
+    }
+    results: List[Dict[str, Any]] = list()
+    for codec_name in CODECS:
+        try:
+            codec: Codec = get_codec(codec_name)
+        except CodecError as e:
+            print(f"Skipping codec {codec_name}: {e}")
+            continue
+        for message_name, message in messages.items():
+            payload: bytes = codec.encode(message)
+            assert codec.decode(payload) == message
+            results.append(
+                {
+                    "codec": codec_name,
+                    "message": message_name,
+                    "size": len(payload),
+                    "encode_us": measure(lambda: codec.encode(message), iterations),
+                    "decode_us": measure(lambda: codec.decode(payload), iterations),
+                }
+            )
+    return results
+
+
+def main():
+    parser: ArgumentParser = ArgumentParser(description="EventBroker codec microbenchmark")
+    parser.add_argument("--nodes", help="Number of nodes in the topology build response", type=int, default=50)
+    parser.add_argument("--iterations", help="Iterations per measurement", type=int, default=2000)
+    parser.add_argument("--json", help="Print results as JSON", action="store_true")
+    arguments: Namespace = parser.parse_args()
+
+    results = run(arguments.nodes, arguments.iterations)
+    if arguments.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'codec':<10}{'message':<26}{'size (B)':>10}{'encode (us)':>14}{'decode (us)':>14}")
+    for result in results:
+        print(
+            f"{result['codec']:<10}{result['message']:<26}{result['size']:>10}"
+            f"{result['encode_us']:>14.2f}{result['decode_us']:>14.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
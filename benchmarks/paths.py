@@ -0,0 +1,114 @@
+"""
+Microbenchmark for matching update paths against the interface path settings.
+
+Compares the compiled path trie with naive string-prefix scans over every
+configured path and strip prefix, for a growing number of configured paths.
+
+Usage:
+    python -m benchmarks.paths [--paths 10 100 1000 5000] [--updates 20000] [--json]
+"""
+from argparse import ArgumentParser, Namespace
+import json
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from interfaces.paths import PathFilter, parse_path
+
+
+CONTAINERS: List[str] = ["config", "state", "subinterfaces/subinterface[index=0]/config", "ethernet/state/counters"]
+LEAVES: List[str] = ["mtu", "description", "enabled", "in-octets", "out-octets"]
+
+
+def configured_paths(count: int) -> Tuple[List[str], List[str]]:
+    """_Watched paths and strip prefixes as they grow with the number of interfaces_"""
+    paths: List[str] = [f"openconfig:interfaces/interface[name=Ethernet{index}]" for index in range(count)]
+    strip: List[str] = [
+        f"openconfig:interfaces/interface[name=Ethernet{index}]/{CONTAINERS[index % len(CONTAINERS)]}"
+        for index in range(0, count, 2)
+    ]
+    return paths, strip
+
+
+def update_paths(count: int, interfaces: int, seed: int = 0) -> List[str]:
+    """_Update paths, three quarters below a watched interface_"""
+    generator = random.Random(seed)
+    updates: List[str] = list()
+    for _ in range(count):
+        index = generator.randrange(interfaces * 4 // 3 + 1)
+        container = generator.choice(CONTAINERS)
+        leaf = generator.choice(LEAVES)
+        updates.append(f"openconfig:interfaces/interface[name=Ethernet{index}]/{container}/{leaf}")
+    return updates
+
+
+def naive_apply(path: str, paths: List[str], strip: List[str]) -> Optional[str]:
+    """_The stripped path of an update by scanning every configured string prefix_"""
+    if not any(path == prefix or path.startswith(prefix + "/") for prefix in paths):
+        return None
+    longest = ""
+    for prefix in strip:
+        if (path == prefix or path.startswith(prefix + "/")) and len(prefix) > len(longest):
+            longest = prefix
+    return path[len(longest):].lstrip("/") if longest else path
+
+
+def measure(function, updates: List[str]) -> float:
+    """_Mean nanoseconds per update_"""
+    started = time.perf_counter_ns()
+    for update in updates:
+        function(update)
+    return (time.perf_counter_ns() - started) / len(updates)
+
+
+def run(arguments: Namespace) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = list()
+    for count in arguments.paths:
+        paths, strip = configured_paths(count)
+        updates = update_paths(arguments.updates, count)
+
+        started = time.perf_counter()
+        path_filter = PathFilter(paths, strip)
+        compile_s = time.perf_counter() - started
+
+        # Both sides have to agree before timing them
+        for update in updates[:1000]:
+            expected = naive_apply(update, paths, strip)
+            assert path_filter.apply(update) == expected, update
+
+        # Warm the parse cache, update paths repeat in practice
+        for update in updates:
+            parse_path(update)
+        results.append(
+            {
+                "paths": count,
+                "strip": len(strip),
+                "compile_ms": compile_s * 1000,
+                "trie_ns": measure(path_filter.apply, updates),
+                "naive_ns": measure(lambda update: naive_apply(update, paths, strip), updates),
+            }
+        )
+    return results
+
+
+def main():
+    parser: ArgumentParser = ArgumentParser(description="gNMI path matching microbenchmark")
+    parser.add_argument("--paths", help="Numbers of configured paths", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--updates", help="Number of update paths to match", type=int, default=20000)
+    parser.add_argument("--json", help="Print the results as JSON", action="store_true")
+    arguments: Namespace = parser.parse_args()
+
+    results = run(arguments)
+    if arguments.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'paths':>8} {'strip':>8} {'compile ms':>12} {'trie ns':>10} {'naive ns':>12} {'speedup':>8}")
+    for result in results:
+        print(
+            f"{result['paths']:>8} {result['strip']:>8} {result['compile_ms']:>12.2f} "
+            f"{result['trie_ns']:>10.0f} {result['naive_ns']:>12.0f} {result['naive_ns'] / result['trie_ns']:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Microbenchmark for deriving sibling topologies from the realnet topology.
+
+Compares the indexed topology overlays with deep-copying the containerlab
+definition per sibling and applying the adjustments by scanning the link list.
+
+Usage:
+    python -m benchmarks.topology [--nodes 100 1000 5000] [--siblings 10] [--json]
+"""
+from argparse import ArgumentParser, Namespace
+import copy
+import json
+import re
+import time
+from typing import Any, Dict, List
+
+from builders.topology import Topology
+
+
+def realnet_definition(nodes: int) -> Dict[str, Any]:
+    """_A ring of nodes with additional chords, two links per node_"""
+    return {
+        "name": "realnet",
+        "topology": {
+            "nodes": {f"ceos{index}": {"kind": "ceos", "image": "ceos:latest"} for index in range(nodes)},
+            "links": [
+                {"endpoints": [f"ceos{index}:eth1", f"ceos{(index + 1) % nodes}:eth2"]} for index in range(nodes)
+            ] + [
+                {"endpoints": [f"ceos{index}:eth3", f"ceos{(index * 7 + 3) % nodes}:eth4"]} for index in range(nodes)
+            ],
+        },
+    }
+
+
+def naive_sibling(definition: Dict[str, Any], sibling: str, pattern: str) -> Dict[str, Any]:
+    """_Deep copy the definition and apply the adjustments by scanning the link list_"""
+    derived = copy.deepcopy(definition)
+    derived["name"] = sibling
+    topology = derived["topology"]
+    compiled = re.compile(pattern)
+    for name in [name for name in topology["nodes"] if compiled.fullmatch(name)]:
+        del topology["nodes"][name]
+        topology["links"] = [
+            link for link in topology["links"]
+            if all(endpoint.split(":", 1)[0] != name for endpoint in link["endpoints"])
+        ]
+    topology["nodes"]["afl"] = {"kind": "linux", "image": "alpine:latest"}
+    topology["links"].append({"endpoints": ["ceos0:eth9", "afl:eth1"]})
+    return derived
+
+
+def indexed_sibling(base: Topology, sibling: str, pattern: str) -> Dict[str, Any]:
+    derived = base.derive(sibling)
+    derived.remove_nodes(pattern)
+    derived.add_node("afl", {"kind": "linux", "image": "alpine:latest"})
+    derived.add_link({"endpoints": ["ceos0:eth9", "afl:eth1"]})
+    return derived.to_definition()
+
+
+def run(arguments: Namespace) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = list()
+    # Removes about one in ten nodes
+    pattern = r"ceos\d*7"
+    for nodes in arguments.nodes:
+        definition = realnet_definition(nodes)
+
+        started = time.perf_counter()
+        base = Topology.from_definition(definition)
+        parse_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for index in range(arguments.siblings):
+            indexed = indexed_sibling(base, f"sibling{index}", pattern)
+        indexed_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for index in range(arguments.siblings):
+            naive = naive_sibling(definition, f"sibling{index}", pattern)
+        naive_s = time.perf_counter() - started
+
+        assert indexed["topology"]["nodes"].keys() == naive["topology"]["nodes"].keys()
+        assert len(indexed["topology"]["links"]) == len(naive["topology"]["links"])
+        results.append(
+            {
+                "nodes": nodes,
+                "links": len(definition["topology"]["links"]),
+                "siblings": arguments.siblings,
+                "parse_ms": parse_s * 1000,
+                "indexed_ms": indexed_s * 1000,
+                "naive_ms": naive_s * 1000,
+            }
+        )
+    return results
+
+
+def main():
+    parser: ArgumentParser = ArgumentParser(description="Sibling topology derivation microbenchmark")
+    parser.add_argument("--nodes", help="Numbers of realnet nodes", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--siblings", help="Number of siblings to derive", type=int, default=10)
+    parser.add_argument("--json", help="Print the results as JSON", action="store_true")
+    arguments: Namespace = parser.parse_args()
+
+    results = run(arguments)
+    if arguments.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'nodes':>8} {'links':>8} {'siblings':>9} {'parse ms':>10} {'indexed ms':>11} {'naive ms':>10} {'speedup':>8}")
+    for result in results:
+        print(
+            f"{result['nodes']:>8} {result['links']:>8} {result['siblings']:>9} {result['parse_ms']:>10.1f} "
+            f"{result['indexed_ms']:>11.1f} {result['naive_ms']:>10.1f} {result['naive_ms'] / result['indexed_ms']:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""Content-addressed cache of deployed containerlab topologies"""
+from dataclasses import dataclass, field
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any, Dict, List, Optional, Set
+
+from builders.topology import PSEUDO_NODES, endpoint_key, endpoint_node
+
+
+CACHE_SUFFIX: str = ".digest.json"
+
+
+def cache_file(topology_file: str) -> str:
+    """_Path of the digest cache kept next to a containerlab topology definition_"""
+    return topology_file + CACHE_SUFFIX
+
+
+def content_hash(value: Any) -> str:
+    """_sha256 of the canonical JSON encoding of a value, independent of key order_"""
+    return hashlib.sha256(
+        json.dumps(value, sort_keys=True, separators=(",", ":"), default=str).encode()
+    ).hexdigest()
+
+
+def container_name(definition: Dict[str, Any], node: str) -> str:
+    """_Name of the container containerlab creates for a node_"""
+    prefix = definition.get("prefix", "clab")
+    if prefix == "":
+        return node
+    return f"{prefix}-{definition.get('name', '')}-{node}"
+
+
+@dataclass
+class TopologyDigest:
+    """
+    Content hashes of a containerlab topology definition.
+
+    Attributes:
+        digest (str): hash of the whole definition
+        settings (str): hash of everything besides nodes and links, e.g. name, kinds and defaults
+        nodes (Dict[str, str]): hash of every node definition by node name
+        links (Dict[str, List[str]]): endpoints of every link by hash of the link definition
+        definition (Dict[str, Any]): the definition, needed to remove nodes of an outdated deployment
+    """
+
+    digest: str
+    settings: str
+    nodes: Dict[str, str]
+    links: Dict[str, List[str]]
+    definition: Dict[str, Any]
+
+    @classmethod
+    def of(cls, definition: Dict[str, Any]) -> "TopologyDigest":
+        section: Dict[str, Any] = definition.get("topology") or dict()
+        links: Dict[str, List[str]] = dict()
+        for link in section.get("links") or list():
+            endpoints = [endpoint_key(endpoint) for endpoint in link.get("endpoints") or ()]
+            # The order of the endpoints does not change the link
+            links[content_hash({**link, "endpoints": sorted(endpoints)})] = endpoints
+        return cls(
+            digest=content_hash(definition),
+            settings=content_hash(
+                {
+                    **{key: value for key, value in definition.items() if key != "topology"},
+                    "topology": {key: value for key, value in section.items() if key not in ("nodes", "links")},
+                }
+            ),
+            nodes={name: content_hash(node) for name, node in (section.get("nodes") or dict()).items()},
+            links=links,
+            definition=definition,
+        )
+
+    @classmethod
+    def load(cls, path: str) -> Optional["TopologyDigest"]:
+        """_Load a cached digest, None if there is none or it is unreadable_"""
+        try:
+            with open(path) as file:
+                return cls(**json.load(file))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def save(self, path: str):
+        """_Write the digest atomically, a crash never leaves a partial cache behind_"""
+        directory = os.path.dirname(os.path.abspath(path))
+        descriptor, temporary = tempfile.mkstemp(dir=directory, prefix=".digest-")
+        try:
+            with os.fdopen(descriptor, "w") as file:
+                json.dump(
+                    {
+                        "digest": self.digest,
+                        "settings": self.settings,
+                        "nodes": self.nodes,
+                        "links": self.links,
+                        "definition": self.definition,
+                    },
+                    file,
+                )
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+
+@dataclass
+class TopologyUpdate:
+    """
+    Changes needed to turn a deployed topology into a new one.
+
+    Attributes:
+        full (bool): whether the whole lab has to be (re)deployed
+        remove (Set[str]): nodes to destroy, including nodes that are redeployed
+        deploy (Set[str]): nodes to deploy
+        links (List[List[str]]): links to create between running nodes
+    """
+
+    full: bool = False
+    remove: Set[str] = field(default_factory=set)
+    deploy: Set[str] = field(default_factory=set)
+    links: List[List[str]] = field(default_factory=list)
+
+    @property
+    def empty(self) -> bool:
+        return not (self.full or self.remove or self.deploy or self.links)
+
+
+def plan_update(deployed: Optional[TopologyDigest], target: TopologyDigest) -> TopologyUpdate:
+    """_Changes from the deployed topology to the target topology_
+
+    Nodes whose definition changed are destroyed and deployed again, their
+    links to unchanged nodes are created again between the running
+    containers. A removed link between unchanged nodes can only be removed by
+    redeploying one of its nodes. A change of the lab settings requires a full
+    redeploy.
+
+    Args:
+        deployed (Optional[TopologyDigest]): _Digest of the running lab, None if it is not running_
+        target (TopologyDigest): _Digest of the topology to deploy_
+
+    Returns:
+        TopologyUpdate: _The changes_
+    """
+    if deployed is None or deployed.settings != target.settings:
+        return TopologyUpdate(full=True)
+    if deployed.digest == target.digest:
+        return TopologyUpdate()
+
+    removed: Set[str] = deployed.nodes.keys() - target.nodes.keys()
+    changed: Set[str] = {name for name, digest in target.nodes.items() if deployed.nodes.get(name) != digest}
+    for digest, endpoints in deployed.links.items():
+        if digest in target.links:
+            continue
+        surviving = [
+            node for node in map(endpoint_node, endpoints)
+            if node not in PSEUDO_NODES and node in target.nodes
+        ]
+        if surviving and not any(node in changed for node in surviving):
+            changed.add(surviving[0])
+
+    # Links of a redeployed node to a node that keeps running are gone after
+    # the destroy, new links between running nodes are not created by a deploy
+    links: List[List[str]] = list()
+    for digest, endpoints in target.links.items():
+        nodes = [node for node in map(endpoint_node, endpoints) if node not in PSEUDO_NODES]
+        redeployed = [node in changed for node in nodes]
+        if (any(redeployed) and not all(redeployed)) or (digest not in deployed.links and not any(redeployed)):
+            links.append(endpoints)
+
+    return TopologyUpdate(
+        remove=removed | (changed & deployed.nodes.keys()),
+        deploy=changed,
+        links=links,
+    )
@@ -0,0 +1,435 @@
+"""Asynchronous containerlab deployment engine for DigSiNet"""
+import asyncio
+import json
+import os
+from dataclasses import dataclass, field
+from logging import Logger
+import tempfile
+from typing import Any, Dict, List, Optional, Sequence
+
+import yaml
+
+from builders.cache import TopologyDigest, TopologyUpdate, cache_file, container_name, plan_update
+from builders.topology import PSEUDO_NODES
+from config.settings import Settings
+
+
+CLAB_EXECUTABLE: str = "clab"
+# Line limit for clab output, the JSON inventory can get long for larger labs
+STREAM_LIMIT: int = 1 << 20
+# Seconds a cancelled clab process gets to exit before it is killed
+TERMINATE_TIMEOUT: float = 10.0
+
+
+@dataclass
+class ClabNode:
+    """
+    A node of a deployed containerlab topology.
+
+    Attributes:
+        name (str): container name of the node, e.g. clab-realnet-ceos1
+        kind (str): containerlab kind of the node
+        image (str): container image of the node
+        state (str): container state reported by containerlab
+        ipv4_address (str): management IPv4 address of the node
+        ipv6_address (str): management IPv6 address of the node
+    """
+
+    name: str
+    kind: str = ""
+    image: str = ""
+    state: str = ""
+    ipv4_address: str = ""
+    ipv6_address: str = ""
+
+
+@dataclass
+class ClabResult:
+    """
+    Result of a containerlab operation.
+
+    Attributes:
+        topology_file (str): topology definition the operation was run for
+        operation (str): containerlab operation, e.g. deploy or destroy
+        returncode (int): exit code of the clab process
+        nodes (List[ClabNode]): node inventory reported by containerlab
+        duration (float): runtime of the operation in seconds
+        skipped (bool): whether the deployment was skipped because the running lab is up to date
+    """
+
+    topology_file: str
+    operation: str
+    returncode: int
+    nodes: List[ClabNode] = field(default_factory=list)
+    duration: float = 0.0
+    skipped: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0
+
+
+def sibling_topology_file(config: Settings, sibling: str) -> str:
+    """_Path of the generated containerlab definition of a sibling_
+
+    Sibling topologies are stored next to the realnet topology definition.
+
+    Args:
+        config (Settings): _The settings_
+        sibling (str): _Name of the sibling_
+
+    Returns:
+        str: _Path of the sibling topology definition_
+    """
+    directory = os.path.dirname(config.topology.file)
+    return os.path.join(directory, f"{config.topology_name}_{sibling}.clab.yml")
+
+
+def parse_inventory(output: str) -> List[ClabNode]:
+    """_Parse the JSON node inventory printed by `clab ... --format json`_
+
+    Depending on the containerlab version the inventory is either a list of
+    containers or a mapping of lab names to lists of containers.
+
+    Args:
+        output (str): _stdout of the clab process_
+
+    Returns:
+        List[ClabNode]: _Deployed nodes, empty if the output contains no inventory_
+    """
+    output = output.strip()
+    if not output:
+        return []
+    # clab may print non JSON lines before the inventory
+    start = min((index for index in (output.find("["), output.find("{")) if index >= 0), default=-1)
+    if start < 0:
+        return []
+    try:
+        inventory: Any = json.loads(output[start:])
+    except json.JSONDecodeError:
+        return []
+
+    containers: List[Dict[str, Any]] = list()
+    if isinstance(inventory, dict):
+        for lab_containers in inventory.values():
+            if isinstance(lab_containers, list):
+                containers.extend(lab_containers)
+    elif isinstance(inventory, list):
+        containers = inventory
+
+    return [
+        ClabNode(
+            name=container.get("name", ""),
+            kind=container.get("kind", ""),
+            image=container.get("image", ""),
+            state=container.get("state", ""),
+            ipv4_address=container.get("ipv4_address", ""),
+            ipv6_address=container.get("ipv6_address", ""),
+        )
+        for container in containers
+        if isinstance(container, dict)
+    ]
+
+
+class ContainerlabEngine:
+    """
+    Runs containerlab as asyncio subprocesses.
+
+    clab output is streamed line by line into the logger while the process is
+    running, so the event loop of the calling controller is never blocked.
+    Several topologies can be deployed or destroyed at the same time, bounded by
+    `concurrency`.
+
+    Attributes:
+        logger (Logger): logger to stream the clab output into
+        executable (str): clab executable, looked up in PATH
+        concurrency (int): maximum number of clab processes running at the same time
+    """
+
+    def __init__(self, logger: Logger, executable: str = CLAB_EXECUTABLE, concurrency: int = 4):
+        self.logger: Logger = logger
+        self.executable: str = executable
+        self.concurrency: int = concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def deploy(self, topology_file: str, reconfigure: bool = False, node_filter: Optional[Sequence[str]] = None) -> ClabResult:
+        """_Deploy a containerlab topology_
+
+        Args:
+            topology_file (str): _containerlab topology definition_
+            reconfigure (bool, optional): _Redeploy an already running lab_. Defaults to False.
+            node_filter (Optional[Sequence[str]], optional): _Deploy only these nodes and the links between them_. Defaults to None.
+
+        Returns:
+            ClabResult: _Exit code and deployed node inventory_
+        """
+        arguments = ["deploy", "-t", topology_file, "--format", "json"]
+        if reconfigure:
+            arguments.append("--reconfigure")
+        if node_filter:
+            arguments.extend(["--node-filter", ",".join(sorted(node_filter))])
+        return await self._run("deploy", topology_file, arguments)
+
+    async def destroy(self, topology_file: str, cleanup: bool = True, node_filter: Optional[Sequence[str]] = None) -> ClabResult:
+        """_Destroy a containerlab topology_
+
+        Args:
+            topology_file (str): _containerlab topology definition_
+            cleanup (bool, optional): _Remove the lab directory_. Defaults to True.
+            node_filter (Optional[Sequence[str]], optional): _Destroy only these nodes_. Defaults to None.
+
+        Returns:
+            ClabResult: _Exit code of the destroy operation_
+        """
+        arguments = ["destroy", "-t", topology_file]
+        if cleanup:
+            arguments.append("--cleanup")
+        if node_filter:
+            arguments.extend(["--node-filter", ",".join(sorted(node_filter))])
+        return await self._run("destroy", topology_file, arguments)
+
+    async def inspect(self, topology_file: str) -> ClabResult:
+        """_Inventory of a running containerlab topology_
+
+        Args:
+            topology_file (str): _containerlab topology definition_
+
+        Returns:
+            ClabResult: _Exit code and node inventory, no nodes if the lab is not running_
+        """
+        return await self._run("inspect", topology_file, ["inspect", "-t", topology_file, "--format", "json"])
+
+    async def create_link(self, topology_file: str, endpoint_a: str, endpoint_b: str) -> ClabResult:
+        """_Create a veth link between two running containers_
+
+        Args:
+            topology_file (str): _containerlab topology definition the link belongs to_
+            endpoint_a (str): _First endpoint as container:interface_
+            endpoint_b (str): _Second endpoint as container:interface_
+
+        Returns:
+            ClabResult: _Exit code of the operation_
+        """
+        return await self._run("veth", topology_file, ["tools", "veth", "create", "-a", endpoint_a, "-b", endpoint_b])
+
+    async def reconcile(self, topology_file: str, definition: Dict[str, Any], write: bool = True) -> ClabResult:
+        """_Bring a lab up to date with a topology definition_
+
+        Content hashes of the definition are cached next to the topology file.
+        If the running lab was deployed from an identical definition, nothing is
+        deployed. If only some nodes or links changed, only the affected nodes
+        are destroyed and deployed again (`--node-filter`) and their links to
+        the remaining nodes are recreated. Everything else, like a lab that is
+        not running, a change of kinds or defaults or a failed partial update,
+        leads to a full deployment.
+
+        Args:
+            topology_file (str): _containerlab topology definition_
+            definition (Dict[str, Any]): _The topology definition to deploy_
+            write (bool, optional): _Write the definition to topology_file, False if the file is maintained elsewhere_. Defaults to True.
+
+        Returns:
+            ClabResult: _Exit code and node inventory, skipped if the lab was up to date_
+        """
+        target = TopologyDigest.of(definition)
+        deployed = TopologyDigest.load(cache_file(topology_file))
+        lab_running = False
+        if deployed is not None:
+            running = await self.inspect(topology_file)
+            lab_running = bool(running.nodes)
+            containers = {node.name for node in running.nodes if node.state == "running"}
+            # Only a lab where every node of the cached definition is running can be updated in place
+            if not running.ok or any(
+                container_name(deployed.definition, node) not in containers for node in deployed.nodes
+            ):
+                self.logger.info(f"Lab of {topology_file} is not running as cached, deploying it completely")
+                deployed = None
+            elif deployed.digest == target.digest:
+                self.logger.info(f"Lab of {topology_file} is up to date, skipping deployment")
+                return ClabResult(topology_file, "deploy", 0, running.nodes, running.duration, skipped=True)
+
+        update = plan_update(deployed, target)
+        result: Optional[ClabResult] = None
+        if not update.full:
+            assert deployed is not None
+            result = await self._update(topology_file, definition, deployed, update, write)
+            if not result.ok:
+                self.logger.warning(f"Partial update of {topology_file} failed, deploying it completely")
+                result = None
+        if result is None:
+            if write:
+                self._write(topology_file, definition)
+            result = await self.deploy(topology_file, reconfigure=lab_running)
+
+        if result.ok:
+            target.save(cache_file(topology_file))
+        else:
+            # A failed deployment leaves the lab in an unknown state
+            try:
+                os.unlink(cache_file(topology_file))
+            except FileNotFoundError:
+                pass
+        return result
+
+    async def _update(
+        self, topology_file: str, definition: Dict[str, Any], deployed: TopologyDigest, update: TopologyUpdate, write: bool
+    ) -> ClabResult:
+        self.logger.info(
+            f"Updating lab of {topology_file} in place: removing {sorted(update.remove)}, "
+            f"deploying {sorted(update.deploy)}, creating {len(update.links)} links"
+        )
+        if update.remove:
+            # Nodes that no longer exist can only be destroyed through the definition they were deployed from
+            directory = os.path.dirname(os.path.abspath(topology_file))
+            descriptor, previous = tempfile.mkstemp(dir=directory, prefix=".previous-", suffix=".clab.yml")
+            try:
+                with os.fdopen(descriptor, "w") as file:
+                    yaml.safe_dump(deployed.definition, file)
+                result = await self.destroy(previous, cleanup=False, node_filter=sorted(update.remove))
+            finally:
+                os.unlink(previous)
+            if not result.ok:
+                return result
+        if write:
+            self._write(topology_file, definition)
+        if update.deploy:
+            result = await self.deploy(topology_file, node_filter=sorted(update.deploy))
+            if not result.ok:
+                return result
+        for endpoints in update.links:
+            containers = [
+                f"{container_name(definition, node)}:{interface}" if node not in PSEUDO_NODES else endpoint
+                for endpoint in endpoints
+                for node, _, interface in [endpoint.partition(":")]
+            ]
+            result = await self.create_link(topology_file, *containers)
+            if not result.ok:
+                return result
+        return await self.inspect(topology_file)
+
+    def _write(self, topology_file: str, definition: Dict[str, Any]):
+        """_Write a topology definition atomically_"""
+        directory = os.path.dirname(os.path.abspath(topology_file))
+        descriptor, temporary = tempfile.mkstemp(dir=directory, prefix=".topology-", suffix=".clab.yml")
+        try:
+            with os.fdopen(descriptor, "w") as file:
+                yaml.safe_dump(definition, file, sort_keys=False)
+            os.replace(temporary, topology_file)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    async def deploy_all(self, topology_files: Sequence[str]) -> Dict[str, ClabResult]:
+        """_Deploy several topologies concurrently_
+
+        Args:
+            topology_files (Sequence[str]): _containerlab topology definitions_
+
+        Returns:
+            Dict[str, ClabResult]: _Results by topology file_
+        """
+        results = await asyncio.gather(*(self.deploy(file) for file in topology_files))
+        return dict(zip(topology_files, results))
+
+    async def destroy_all(self, topology_files: Sequence[str]) -> Dict[str, ClabResult]:
+        """_Destroy several topologies concurrently_
+
+        Args:
+            topology_files (Sequence[str]): _containerlab topology definitions_
+
+        Returns:
+            Dict[str, ClabResult]: _Results by topology file_
+        """
+        results = await asyncio.gather(*(self.destroy(file) for file in topology_files))
+        return dict(zip(topology_files, results))
+
+    async def _run(self, operation: str, topology_file: str, arguments: List[str]) -> ClabResult:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            self.logger.info(f"Running {self.executable} {' '.join(arguments)}")
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    self.executable,
+                    *arguments,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    limit=STREAM_LIMIT,
+                )
+            except OSError as e:
+                self.logger.error(f"Failed to start {self.executable} {operation} for {topology_file}: {e}")
+                return ClabResult(topology_file, operation, returncode=127)
+
+            assert process.stdout and process.stderr
+            prefix = f"clab {operation} {os.path.basename(topology_file)}"
+            try:
+                stdout, _ = await asyncio.gather(
+                    self._collect(process.stdout, prefix),
+                    self._collect(process.stderr, prefix),
+                )
+                returncode = await process.wait()
+            except BaseException:
+                # Do not leave clab running when the operation is cancelled, e.g. by the sibling build deadline
+                await self._terminate(process, prefix)
+                raise
+            result = ClabResult(
+                topology_file=topology_file,
+                operation=operation,
+                returncode=returncode,
+                nodes=parse_inventory(stdout) if operation in ("deploy", "inspect") else [],
+                duration=loop.time() - started,
+            )
+
+        if result.ok:
+            self.logger.info(f"{prefix} finished after {result.duration:.1f}s with {len(result.nodes)} nodes")
+        else:
+            self.logger.error(f"{prefix} failed after {result.duration:.1f}s with exit code {returncode}")
+        return result
+
+    async def _terminate(self, process: asyncio.subprocess.Process, prefix: str):
+        """_Stop a clab process, killing it if it does not exit in time_"""
+        if process.returncode is not None:
+            return
+        self.logger.warning(f"[{prefix}] Terminating clab process {process.pid}")
+        try:
+            process.terminate()
+            try:
+                await asyncio.wait_for(process.wait(), TERMINATE_TIMEOUT)
+            except TimeoutError:
+                self.logger.warning(f"[{prefix}] clab process {process.pid} did not terminate, killing it")
+                process.kill()
+                await process.wait()
+        except ProcessLookupError:
+            pass
+
+    async def _readline(self, stream: asyncio.StreamReader) -> bytes:
+        """_Read a line of any length, lines longer than STREAM_LIMIT are read in parts_"""
+        parts: List[bytes] = list()
+        while True:
+            try:
+                parts.append(await stream.readuntil(b"\n"))
+                break
+            except asyncio.LimitOverrunError as e:
+                parts.append(await stream.readexactly(e.consumed))
+            except asyncio.IncompleteReadError as e:
+                # End of the output without a final newline
+                parts.append(e.partial)
+                break
+        return b"".join(parts)
+
+    async def _collect(self, stream: asyncio.StreamReader, prefix: str) -> str:
+        """_Stream the output of clab into the logger and return it_"""
+        lines: List[str] = list()
+        while True:
+            line = await self._readline(stream)
+            if not line:
+                break
+            text = line.decode(errors="replace").rstrip()
+            lines.append(text)
+            # The JSON inventory is parsed afterwards, only log human readable output
+            if text and not text.startswith((" ", "{", "}", "[", "]", "\"")):
+                self.logger.info(f"[{prefix}] {text}")
+        return "\n".join(lines)
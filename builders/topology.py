@@ -0,0 +1,310 @@
+"""Indexed containerlab topology model with copy-on-write sibling overlays"""
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, Iterator, List, Optional, Set, Tuple
+
+from config.settings import TopologyAdjustment
+
+
+# Endpoints of containerlab links that are not nodes of the topology
+PSEUDO_NODES: FrozenSet[str] = frozenset({"host", "mgmt-net", "macvlan"})
+# Characters that make a node-remove name a regex instead of a literal node name
+_REGEX_CHARACTERS = re.compile(r"[.^$*+?{}\[\]\\|()]")
+
+
+class TopologyError(Exception):
+    """Raised when a topology adjustment can not be applied"""
+
+
+def endpoint_node(endpoint: Any) -> str:
+    """_Node of a link endpoint, either `node:interface` or a mapping with a node key_"""
+    if isinstance(endpoint, dict):
+        return str(endpoint.get("node", ""))
+    return str(endpoint).split(":", 1)[0]
+
+
+def endpoint_key(endpoint: Any) -> str:
+    """_Endpoint as `node:interface` string_"""
+    if isinstance(endpoint, dict):
+        return f"{endpoint.get('node', '')}:{endpoint.get('interface', '')}"
+    return str(endpoint)
+
+
+@dataclass(frozen=True)
+class Link:
+    """
+    A link of a containerlab topology.
+
+    Attributes:
+        id (int): identifier of the link, unique within a topology and its overlays
+        endpoints (Tuple[str, ...]): endpoints as `node:interface`
+        definition (Dict[str, Any]): the containerlab link definition, shared and never modified
+    """
+
+    id: int
+    endpoints: Tuple[str, ...]
+    definition: Dict[str, Any]
+
+    @property
+    def nodes(self) -> Tuple[str, ...]:
+        return tuple(endpoint_node(endpoint) for endpoint in self.endpoints)
+
+
+class Topology:
+    """
+    Containerlab topology with node, link and adjacency indexes.
+
+    A topology parsed from a definition is a base. `derive` creates an overlay
+    that records only the nodes and links it adds or removes on top of its
+    base, so all siblings share the parsed realnet topology and its node and
+    link definitions instead of copying them. Removing a node removes its links
+    through the adjacency index, without scanning the link list.
+
+    Bases must not be changed after overlays were derived from them.
+
+    Attributes:
+        name (str): name of the containerlab lab
+        attributes (Dict[str, Any]): top-level keys of the definition besides name and topology
+        topology_attributes (Dict[str, Any]): keys of the topology section besides nodes and links, e.g. kinds
+    """
+
+    def __init__(self, name: str, base: Optional["Topology"] = None):
+        self.name: str = name
+        self._base: Optional[Topology] = base
+        self.attributes: Dict[str, Any] = base.attributes if base else dict()
+        self.topology_attributes: Dict[str, Any] = base.topology_attributes if base else dict()
+        # Nodes and links added by this topology
+        self._nodes: Dict[str, Dict[str, Any]] = dict()
+        self._links: Dict[int, Link] = dict()
+        self._adjacency: Dict[str, Set[int]] = dict()
+        self._endpoints: Dict[str, int] = dict()
+        # Nodes and links of the base removed by this topology
+        self._removed_nodes: Set[str] = set()
+        self._removed_links: Set[int] = set()
+        self._next_link_id: int = base._next_link_id if base else 0
+
+    @classmethod
+    def from_definition(cls, definition: Optional[Dict[str, Any]]) -> "Topology":
+        """_Parse a containerlab topology definition_
+
+        Args:
+            definition (Optional[Dict[str, Any]]): _The definition as loaded from the YAML file_
+
+        Returns:
+            Topology: _The indexed topology_
+        """
+        definition = definition or dict()
+        topology = cls(str(definition.get("name", "")))
+        topology.attributes = {key: value for key, value in definition.items() if key not in ("name", "topology")}
+        section: Dict[str, Any] = definition.get("topology") or dict()
+        topology.topology_attributes = {key: value for key, value in section.items() if key not in ("nodes", "links")}
+        for name, node in (section.get("nodes") or dict()).items():
+            topology.add_node(name, node)
+        # The definition was accepted by containerlab, so links are indexed without validation
+        for link in section.get("links") or list():
+            topology._insert_link(tuple(endpoint_key(endpoint) for endpoint in link.get("endpoints") or ()), link)
+        return topology
+
+    def derive(self, name: str) -> "Topology":
+        """_Copy-on-write overlay of this topology, e.g. for a sibling_"""
+        return Topology(name, self)
+
+    # Lookups
+
+    def has_node(self, name: str) -> bool:
+        if name in self._nodes:
+            return True
+        return self._base is not None and name not in self._removed_nodes and self._base.has_node(name)
+
+    def node(self, name: str) -> Optional[Dict[str, Any]]:
+        """_Definition of a node, None if the topology has no such node_"""
+        node = self._nodes.get(name)
+        if node is not None:
+            return node
+        if self._base is None or name in self._removed_nodes:
+            return None
+        return self._base.node(name)
+
+    def node_names(self) -> Iterator[str]:
+        if self._base is not None:
+            for name in self._base.node_names():
+                if name not in self._removed_nodes and name not in self._nodes:
+                    yield name
+        yield from self._nodes
+
+    def link(self, link_id: int) -> Optional[Link]:
+        link = self._links.get(link_id)
+        if link is not None:
+            return link
+        if self._base is None or link_id in self._removed_links:
+            return None
+        return self._base.link(link_id)
+
+    def links(self) -> Iterator[Link]:
+        if self._base is not None:
+            for link in self._base.links():
+                if link.id not in self._removed_links:
+                    yield link
+        yield from self._links.values()
+
+    def adjacent_links(self, node: str) -> Set[int]:
+        """_IDs of the links with an endpoint at node_"""
+        links: Set[int] = set(self._adjacency.get(node, ()))
+        if self._base is not None and node not in self._nodes:
+            links.update(link_id for link_id in self._base.adjacent_links(node) if link_id not in self._removed_links)
+        return links
+
+    def endpoint_link(self, endpoint: str) -> Optional[Link]:
+        """_Link using an endpoint, None if the endpoint is free_"""
+        link_id = self._endpoints.get(endpoint)
+        if link_id is not None:
+            return self._links[link_id]
+        if self._base is None:
+            return None
+        link = self._base.endpoint_link(endpoint)
+        if link is None or link.id in self._removed_links:
+            return None
+        return link
+
+    # Changes
+
+    def add_node(self, name: str, definition: Dict[str, Any]):
+        """_Add a node, replacing a node of the same name_"""
+        if self.has_node(name):
+            self.remove_node(name)
+        self._removed_nodes.discard(name)
+        self._nodes[name] = definition
+
+    def remove_node(self, name: str) -> bool:
+        """_Remove a node and all of its links_
+
+        Returns:
+            bool: _Whether the topology had the node_
+        """
+        if not self.has_node(name):
+            return False
+        for link_id in self.adjacent_links(name):
+            self._remove_link(link_id)
+        if self._nodes.pop(name, None) is None or (self._base is not None and self._base.has_node(name)):
+            self._removed_nodes.add(name)
+        self._adjacency.pop(name, None)
+        return True
+
+    def remove_nodes(self, pattern: str) -> List[str]:
+        """_Remove all nodes whose name fully matches a regex, and their links_
+
+        Names without regex characters are looked up directly instead of
+        matching every node.
+
+        Returns:
+            List[str]: _Names of the removed nodes_
+        """
+        if not _REGEX_CHARACTERS.search(pattern):
+            return [pattern] if self.remove_node(pattern) else []
+        compiled = re.compile(pattern)
+        matching = [name for name in self.node_names() if compiled.fullmatch(name)]
+        for name in matching:
+            self.remove_node(name)
+        return matching
+
+    def add_link(self, definition: Dict[str, Any]) -> Link:
+        """_Add a link between existing nodes_
+
+        Raises:
+            TopologyError: _If the link does not have two endpoints, a node does not exist or an endpoint is in use_
+        """
+        endpoints = tuple(endpoint_key(endpoint) for endpoint in definition.get("endpoints") or ())
+        if len(endpoints) != 2:
+            raise TopologyError(f"link {list(endpoints)} must have exactly two endpoints")
+        for endpoint in endpoints:
+            node = endpoint_node(endpoint)
+            if node not in PSEUDO_NODES and not self.has_node(node):
+                raise TopologyError(f"link endpoint {endpoint} refers to unknown node {node}")
+            if self.endpoint_link(endpoint) is not None:
+                raise TopologyError(f"link endpoint {endpoint} is already in use")
+        return self._insert_link(endpoints, definition)
+
+    def _insert_link(self, endpoints: Tuple[str, ...], definition: Dict[str, Any]) -> Link:
+        link = Link(self._next_link_id, endpoints, definition)
+        self._next_link_id += 1
+        self._links[link.id] = link
+        for endpoint in endpoints:
+            self._endpoints[endpoint] = link.id
+        for node in set(link.nodes):
+            self._adjacency.setdefault(node, set()).add(link.id)
+        return link
+
+    def remove_link(self, endpoints: List[str]) -> List[Link]:
+        """_Remove links by their endpoints_
+
+        Endpoints are `node:interface`, the order does not matter. Endpoints
+        given as bare node names remove every link between the two nodes.
+
+        Returns:
+            List[Link]: _The removed links_
+        """
+        if len(endpoints) != 2:
+            raise TopologyError(f"link {endpoints} must have exactly two endpoints")
+        first, second = endpoints
+        if ":" in first and ":" in second:
+            link = self.endpoint_link(first)
+            if link is None or set(link.endpoints) != {first, second}:
+                return []
+            removed = [link]
+        else:
+            nodes = {endpoint_node(first), endpoint_node(second)}
+            removed = [
+                link for link in map(self.link, self.adjacent_links(endpoint_node(first)))
+                if link is not None and set(link.nodes) == nodes
+                and all(":" not in endpoint or endpoint in link.endpoints for endpoint in endpoints)
+            ]
+        for link in removed:
+            self._remove_link(link.id)
+        return removed
+
+    def _remove_link(self, link_id: int):
+        link = self._links.pop(link_id, None)
+        if link is None:
+            link = self.link(link_id)
+            if link is None:
+                return
+            self._removed_links.add(link_id)
+        for endpoint in link.endpoints:
+            if self._endpoints.get(endpoint) == link_id:
+                del self._endpoints[endpoint]
+        for node in link.nodes:
+            adjacent = self._adjacency.get(node)
+            if adjacent is not None:
+                adjacent.discard(link_id)
+
+    def apply(self, adjustments: Optional[TopologyAdjustment]) -> "Topology":
+        """_Apply the topology adjustments of a sibling_
+
+        Nodes are removed first, then added, then links are removed and added.
+
+        Raises:
+            TopologyError: _If a link can not be added_
+        """
+        if adjustments is None:
+            return self
+        if adjustments.node_remove is not None:
+            self.remove_nodes(adjustments.node_remove.node_name)
+        for name, node in (adjustments.node_add or dict()).items():
+            self.add_node(name, {"kind": node.kind, "image": node.image})
+        for link in adjustments.link_remove or list():
+            self.remove_link(link.endpoints)
+        for link in adjustments.link_add or list():
+            self.add_link({"endpoints": list(link.endpoints)})
+        return self
+
+    def to_definition(self) -> Dict[str, Any]:
+        """_The containerlab topology definition, node and link definitions are shared_"""
+        return {
+            "name": self.name,
+            **self.attributes,
+            "topology": {
+                **self.topology_attributes,
+                "nodes": {name: self.node(name) for name in self.node_names()},
+                "links": [link.definition for link in self.links()],
+            },
+        }
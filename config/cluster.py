@@ -0,0 +1,28 @@
+from typing import Literal, Optional
+
+from pydantic import BaseModel
+
+
+class ClusterSettings(BaseModel):
+    """
+    Configuration for running the siblings on several DigSiNet instances.
+
+    Every worker of every instance announces itself with heartbeats through the
+    event broker. Siblings are owned by exactly one live worker, a worker that
+    stops sending heartbeats loses its siblings to the remaining workers.
+
+    Exactly one instance of a cluster is the primary. It deploys the realnet
+    and runs the realnet controller, which owns the realnet state the siblings
+    replicate. All other instances are workers and only run sibling workers.
+
+    Attributes:
+        role (Literal["primary", "worker"]): whether the instance runs the realnet controller or only sibling workers
+        member_id (Optional[str]): prefix of the worker names, defaults to the host name
+        heartbeat_interval (float): seconds between two heartbeats of a worker
+        member_timeout (float): seconds without heartbeat after which a worker is considered gone
+    """
+
+    role: Literal["primary", "worker"] = "primary"
+    member_id: Optional[str] = None
+    heartbeat_interval: float = 1.0
+    member_timeout: float = 3.0
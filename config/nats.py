@@ -8,7 +8,10 @@ class NatsSettings(EventBrokerConfig):
     Attributes:
         host (str): host of the NATS server
         port (int): port of the NATS server
+        telemetry_connection (bool): use a separate connection for telemetry, so a telemetry burst
+            queued on the socket does not delay control messages
     """
 
     host: str
-    port: int
\ No newline at end of file
+    port: int
+    telemetry_connection: bool = True
\ No newline at end of file
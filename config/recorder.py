@@ -0,0 +1,23 @@
+from typing import List
+
+from pydantic import BaseModel
+
+
+class RecorderSettings(BaseModel):
+    """
+    Configuration for recording the event broker traffic of all controllers.
+
+    Every controller writes the messages it publishes to its own log in `path`.
+    The logs can be replayed with `python -m eventbroker.recorder replay`.
+
+    Attributes:
+        path (str): directory for the logs
+        channels (List[str]): subject patterns to record, everything if empty
+        queue_size (int): number of messages buffered for the writer thread, further messages are not recorded
+        chunk_size (int): number of bytes the log files grow by
+    """
+
+    path: str = "recordings"
+    channels: List[str] = []
+    queue_size: int = 65536
+    chunk_size: int = 64 * 1024 * 1024
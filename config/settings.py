@@ -8,7 +8,12 @@ Configuration file used by DigSiNet.
 from dataclasses import dataclass
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict
+from interfaces.paths import PathFilter, compile_filter
+from config.cluster import ClusterSettings
+from config.recorder import RecorderSettings
 from config.nats import NatsSettings
+from config.shm import ShmSettings
+from config.synthetic import SyntheticSettings
 import yaml
 
 
@@ -17,8 +22,8 @@ class TopologyType(BaseModel):
     Specifies the Topology Type to use.
 
     Attributes:
-        type (str): The topology type. Currently only Containerlab is available.
-        file (str): The path to the file containing the topology definition.
+        type (str): The topology type, containerlab or synthetic for a simulated realnet without containers.
+        file (str): The path to the file containing the topology definition. Sibling definitions are written next to it.
     """
 
     type: str
@@ -57,12 +62,10 @@ class TopologyAdjustmentAddLink(BaseModel):
     Topology Adjustment that adds a link between nodes to the topology.
 
     Attributes:
-        node_source (str): source node
-        node_destination (str): destination node
+        endpoints (List[str]): the two endpoints of the link as node:interface
     """
 
-    node_source: str
-    node_destination: str
+    endpoints: List[str]
 
 
 @dataclass
@@ -71,12 +74,10 @@ class TopologyAdjustmentRemoveLink(BaseModel):
     Topology Adjustment that removes a link between nodes to the topology.
 
     Attributes:
-        node_source (str): source node
-        node_destination (str): destination node
+        endpoints (List[str]): the two endpoints of the link as node:interface, or two node names to remove all links between them
     """
 
-    node_source: str
-    node_destination: str
+    endpoints: List[str]
 
 
 class InterfaceSettings(BaseModel):
@@ -88,12 +89,26 @@ class InterfaceSettings(BaseModel):
         datatype (str): what type of data to poll
         paths (List[str]): gNMI paths to watch
         strip (List[str]): a common prefix to strip from gnmi paths
+        concurrency (int): number of nodes polled at the same time
+        node_timeout (Optional[float]): seconds a node may take to answer a poll, defaults to the sync interval
     """
 
     nodes: str
     datatype: str
     paths: List[str]
     strip: List[str]
+    concurrency: int = 64
+    node_timeout: Optional[float] = None
+
+    @property
+    def path_filter(self) -> PathFilter:
+        """
+        Compiled paths and strip prefixes.
+
+        Interface settings with the same paths and strip prefixes share one
+        compiled filter.
+        """
+        return compile_filter(tuple(self.paths), tuple(self.strip))
 
 
 class RealnetSettings(BaseModel):
@@ -124,7 +139,7 @@ class TopologyAdjustment(BaseModel):
         alias="link-remove", default=None
     )
     link_add: Optional[List[TopologyAdjustmentAddLink]] = Field(
-        alias="link-remove", default=None
+        alias="link-add", default=None
     )
 
 
@@ -210,20 +225,33 @@ class Settings(BaseModel):
     Attributes:
         topology_name (str): name of the topology.
         topology (TopologyType): Type of topology.
-        sync_interval (int): synchronization interval in milliseconds.
-        sibling_timeout (int): timeout for siblings in milliseconds.
+        sync_interval (int): synchronization interval in seconds.
+        sibling_timeout (int): timeout for siblings in seconds.
+        siblings_deadline (Optional[int]): total deadline for building all siblings. Defaults to sibling_timeout.
+        state_max_deltas (int): number of state changes the realnet retains for siblings to catch up.
+        sibling_workers (int): number of worker processes hosting the sibling controllers. 0 starts one process per sibling.
         realnet (RealnetSettings): Settings for the realnet.
         siblings (Dict[str, SiblingSettings]): Settings for the individual siblings grouped by name.
         controllers (Dict[str, ControllerSettings]): Settings for the controllers, grouped by controller name.
         builders (Dict[str, BuilderSettings]): Settings for the builders, grouped by builder name.
         interface_credentials (Dict[str, InterfaceCredentials]): Credential data for interfaces, grouped by name.
         apps (Dict[str, AppSettings]): Configuration for applications, grouped by app name.
+        nats (Optional[NatsSettings]): Settings for the NATS event broker.
+        shm (Optional[ShmSettings]): Settings for the shared-memory event broker for single-host deployments.
+        cluster (Optional[ClusterSettings]): Settings for sharing the siblings between the workers of several DigSiNet instances.
+        recorder (Optional[RecorderSettings]): Settings for recording the event broker traffic for later replay.
+        synthetic (Optional[SyntheticSettings]): Settings for the simulated realnet of the synthetic topology type.
     """
 
     topology_name: str = Field(..., alias="name")
     topology: TopologyType
     sync_interval: int = Field(..., alias="interval")
     sibling_timeout: int = Field(..., alias="create_sibling_timeout")
+    siblings_deadline: Optional[int] = Field(
+        alias="create_siblings_deadline", default=None
+    )
+    state_max_deltas: int = 10000
+    sibling_workers: int = 0
     realnet: RealnetSettings
     siblings: Dict[str, SiblingSettings]
     controllers: Dict[str, ControllerSettings]
@@ -233,6 +261,10 @@ class Settings(BaseModel):
     )
     apps: Dict[str, AppSettings]
     nats: Optional[NatsSettings] = None
+    shm: Optional[ShmSettings] = None
+    cluster: Optional[ClusterSettings] = None
+    recorder: Optional[RecorderSettings] = None
+    synthetic: Optional[SyntheticSettings] = None
 
 
 def read_config(config_file: str) -> Settings:
@@ -244,13 +276,24 @@ def read_config(config_file: str) -> Settings:
         data = yaml.safe_load(file)
         config = Settings(**data)
         if validate_config(config):
+            compile_paths(config)
             return config
         else:
-            raise Exception('configuration error: either nats, kafka or rabbitmq settings must be provided')
+            raise Exception('configuration error: exactly one of nats or shm settings must be provided')
 
 
 def validate_config(config: Settings) -> bool:
-    if config.nats is None:
-        return False
-    else:
-        return True
+    brokers = [broker for broker in (config.nats, config.shm) if broker is not None]
+    return len(brokers) == 1
+
+
+def compile_paths(config: Settings):
+    """
+    Compiles the path settings of all interfaces once, before the controller
+    processes are started, so realnet and siblings inherit the compiled filters.
+    """
+    interfaces = list(config.realnet.interfaces.values())
+    for sibling in config.siblings.values():
+        interfaces.extend(sibling.interfaces.values())
+    for interface in interfaces:
+        interface.path_filter
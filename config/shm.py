@@ -0,0 +1,22 @@
+from eventbroker.eventbroker import EventBrokerConfig
+
+
+class ShmSettings(EventBrokerConfig):
+    """
+    Configuration for the shared-memory event broker.
+
+    All controllers have to run on the same host and use the same path.
+
+    Attributes:
+        path (str): directory for the ring buffers, should be on a tmpfs like /dev/shm
+        ring_size (int): size of the ring buffer of a subscription in bytes
+        poll_interval (float): time in milliseconds after which an idle subscriber checks its ring buffer
+            even without being woken up by a publisher
+        publish_timeout (float): maximum time in milliseconds a publisher waits for space in the full
+            ring buffers of blocking subscribers before the message is dropped
+    """
+
+    path: str = "/dev/shm/digsinet"
+    ring_size: int = 4 * 1024 * 1024
+    poll_interval: float = 1000.0
+    publish_timeout: float = 100.0
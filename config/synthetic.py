@@ -0,0 +1,36 @@
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class SyntheticSettings(BaseModel):
+    """
+    Configuration for a simulated realnet, used with the topology type `synthetic`.
+
+    No lab is deployed. The realnet consists of `nodes` simulated nodes whose
+    config and state trees are generated for the paths of the realnet
+    interfaces and change at a configurable rate.
+
+    Attributes:
+        nodes (int): number of simulated nodes
+        node_name (str): name of the nodes, `{index}` is replaced by the node number starting at 1
+        kind (str): containerlab kind of the nodes in the generated topology definition
+        image (str): container image of the nodes in the generated topology definition
+        update_rate (float): changes of the trees of a node per second
+        tree_size (int): number of leaves of the tree of a node and path
+        change_ratio (float): fraction of the leaves that change with every update
+        latency (float): mean seconds a node takes to answer a poll, varying by up to half of it
+        failure_ratio (float): fraction of the polls that fail, like for an unreachable node
+        seed (Optional[int]): seed of the generated values, random if not set
+    """
+
+    nodes: int = 10
+    node_name: str = "ceos{index}"
+    kind: str = "ceos"
+    image: str = "ceos:latest"
+    update_rate: float = 1.0
+    tree_size: int = 64
+    change_ratio: float = 0.05
+    latency: float = 0.0
+    failure_ratio: float = 0.0
+    seed: Optional[int] = None
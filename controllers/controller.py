@@ -2,11 +2,13 @@ from abc import ABC, abstractmethod
 import asyncio
 from logging import Logger
 from multiprocessing import Process
-from typing import final
+from typing import List, Optional, final
 
+from builders.topology import Topology
 from config.settings import Settings
+from eventbroker import subjects
 from eventbroker.eventbroker import EventBroker
-from eventbroker.nats import NatsClient
+from eventbroker.factory import create_broker
 
 class Controller(ABC):
     """
@@ -15,6 +17,7 @@ class Controller(ABC):
     Attributes:
         config (dict): contents of configuration file and derived supplemental configuration values.
         real_topology_definition (dict): real network topology definition (e.g., containerlab YAML)
+        real_topology (Topology): indexed real network topology, shared by all controllers
         real_nodes (dict): nodes in the real network
         broker (EventBroker): broker for event streaming (e.g. RabbitMQ, Kafka)
 
@@ -64,6 +67,8 @@ class Controller(ABC):
         logger: Logger,
         config: Settings,
         real_topology_definition: dict,
+        real_topology: Optional[Topology] = None,
+        start_process: bool = True,
     ):
         """
         Initialize the controller.
@@ -75,6 +80,10 @@ class Controller(ABC):
             config (dict): contents of configuration file and derived supplemental configuration
                 values.
             real_topology_definition (dict): real network topology definition (e.g., containerlab YAML)
+            real_topology (Optional[Topology]): indexed real network topology, parsed from
+                real_topology_definition if not given. Pass the same instance to all controllers.
+            start_process (bool): start a process for the controller. Controllers hosted by a
+                worker process are created without a process of their own.
             real_nodes (dict): nodes in the real network
             sibling (str): name of the sibling to create
 
@@ -88,11 +97,14 @@ class Controller(ABC):
         self.logger: Logger = logger
         self.config: Settings = config
         self.real_topology_definition: dict = real_topology_definition
+        self.real_topology: Topology = real_topology or Topology.from_definition(real_topology_definition)
         self.broker: EventBroker | None = None
 
-        self.process: Process = Process(target=self.run, name="Controller " + self.name)
-        self.process.start()
-        self.logger.info(f"Started controller process for {self.name} with PID {self.process.pid}")
+        self.process: Process | None = None
+        if start_process:
+            self.process = Process(target=self.run, name="Controller " + self.name)
+            self.process.start()
+            self.logger.info(f"Started controller process for {self.name} with PID {self.process.pid}")
 
     @final
     def run(self):
@@ -108,11 +120,12 @@ class Controller(ABC):
             None
         """
         async def wrapper():
-            if self.config.nats is not None: # TODO: let the config determine the eventbroker type
-                self.broker = await NatsClient.create(self.config.nats, list(self.name), self.logger)
-            else:
+            self.broker = await create_broker(self.config, self.channels(), self.logger, self.name)
+            if self.broker is None:
                 self.logger.fatal(f"No EventBroker config supplied. This is fatal, exiting controller {self.name}")
                 return
+            # Sibling controllers listen on their control channels in queue groups
+            self.broker.grouped.update(self.control_channel(sibling) for sibling in self.config.siblings)
             await self.async_run()
 
 
@@ -120,7 +133,78 @@ class Controller(ABC):
     
     @final
     def join(self):
-        self.process.join()
+        if self.process is not None:
+            self.process.join()
+
+    def channels(self) -> List[str]:
+        """
+        Control channels known to the controller: its own, the realnet and all sibling channels.
+
+        Args:
+            None
+
+        Returns:
+            List[str]: names of the channels
+
+        Raises:
+            None
+        """
+
+        channels: List[str] = [self.control_channel(controller) for controller in ["realnet", *self.config.siblings.keys()]]
+        if self.control_channel(self.name) not in channels:
+            channels.append(self.control_channel(self.name))
+        return channels
+
+    async def report_slow_consumers(self):
+        """
+        Report subscriptions of the controller's broker that can not keep up to the realnet controller.
+
+        Run once per sync tick. Every slow subscription is reported once, and
+        again only after it recovered in between.
+
+        Args:
+            None
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+
+        assert self.broker
+        slow = self.broker.slow_consumers()
+        if not slow:
+            return
+        for stats in slow.values():
+            self.logger.warning(
+                f"Slow consumer on channel {stats.channel}: {stats.pending} messages pending for {stats.full_for:.1f}s, "
+                f"{stats.dropped} dropped, {stats.coalesced} coalesced"
+            )
+        await self.broker.publish(
+            self.control_channel("realnet"),
+            {
+                "type": "slow consumer report",
+                "source": self.name,
+                "subscriptions": {key: stats.to_dict() for key, stats in slow.items()},
+            },
+        )
+
+    def control_channel(self, controller: str) -> str:
+        """
+        Control channel of a controller in the subject hierarchy of the topology.
+
+        Args:
+            controller (str): name of the realnet or a sibling
+
+        Returns:
+            str: the control channel
+
+        Raises:
+            None
+        """
+
+        return subjects.control(self.config.topology_name, controller)
 
     @abstractmethod
     async def async_run(self):
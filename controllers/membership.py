@@ -0,0 +1,123 @@
+import asyncio
+import hashlib
+from logging import Logger
+from typing import Awaitable, Callable, Dict, Optional
+
+from eventbroker import subjects
+from eventbroker.eventbroker import EventBroker, Message
+
+
+HEARTBEAT: str = "heartbeat"
+LEAVE: str = "leave"
+
+
+def rendezvous_score(member: str, key: str) -> int:
+    """_Highest random weight of a member for a key, the same on every host_"""
+    return int.from_bytes(hashlib.blake2b(f"{member}\0{key}".encode(), digest_size=8).digest(), "big")
+
+
+class Membership:
+    """
+    Cluster membership and ownership through the event broker.
+
+    Every member publishes heartbeats on the membership subject of the
+    topology and tracks the heartbeats of the others. A member that leaves or
+    misses heartbeats for `member_timeout` seconds is dropped. Ownership of a
+    key, e.g. a sibling, is decided by rendezvous hashing over the live
+    members: all members agree on the owner without any further coordination,
+    and a change of membership only moves the keys of the members that came
+    or went.
+
+    Attributes:
+        member_id (str): name of this member, unique in the cluster
+        members (Dict[str, float]): live members and the time their last heartbeat was received
+        on_change (Optional[Callable[[], Awaitable[None]]]): called after the set of members changed
+    """
+
+    def __init__(
+        self,
+        broker: EventBroker,
+        topology: str,
+        member_id: str,
+        logger: Logger,
+        heartbeat_interval: float = 1.0,
+        member_timeout: float = 3.0,
+    ):
+        self.broker: EventBroker = broker
+        self.subject: str = subjects.membership(topology)
+        self.member_id: str = member_id
+        self.logger: Logger = logger
+        self.heartbeat_interval: float = heartbeat_interval
+        self.member_timeout: float = member_timeout
+        self.members: Dict[str, float] = dict()
+        self.on_change: Optional[Callable[[], Awaitable[None]]] = None
+        self._changed: asyncio.Event = asyncio.Event()
+
+    def owner(self, key: str) -> str:
+        """_Member owning key_"""
+        return max(self.members, key=lambda member: rendezvous_score(member, key), default=self.member_id)
+
+    def owns(self, key: str) -> bool:
+        return self.owner(key) == self.member_id
+
+    async def run(self):
+        """_Send heartbeats and track the other members until cancelled_
+
+        Ownership is first evaluated after `member_timeout`, once the heartbeats
+        of the running members had the chance to arrive. Otherwise a starting
+        member would take over every key for a moment.
+        """
+        loop = asyncio.get_running_loop()
+        self.members[self.member_id] = loop.time()
+        await self.broker.listen(self.subject, self._on_message)
+        settled = loop.time() + self.member_timeout
+        next_heartbeat = loop.time()
+        notified = False
+        try:
+            while True:
+                now = loop.time()
+                if now >= next_heartbeat:
+                    await self.broker.publish(self.subject, {"type": HEARTBEAT, "member": self.member_id})
+                    next_heartbeat = now + self.heartbeat_interval
+                self._expire(now)
+                if now >= settled and (self._changed.is_set() or not notified):
+                    self._changed.clear()
+                    notified = True
+                    self.logger.info(f"Cluster members: {', '.join(sorted(self.members))}")
+                    if self.on_change is not None:
+                        await self.on_change()
+                if not notified:
+                    await asyncio.sleep(max(0, min(next_heartbeat, settled) - loop.time()))
+                    continue
+                try:
+                    await asyncio.wait_for(self._changed.wait(), max(0, next_heartbeat - loop.time()))
+                except TimeoutError:
+                    pass
+        finally:
+            await self.broker.unlisten(self.subject, self._on_message)
+
+    async def leave(self):
+        """_Tell the other members to take over right away instead of waiting for the timeout_"""
+        await self.broker.publish(self.subject, {"type": LEAVE, "member": self.member_id})
+
+    def _expire(self, now: float):
+        for member, seen in list(self.members.items()):
+            if member != self.member_id and now - seen > self.member_timeout:
+                self.logger.warning(f"Cluster member {member} missed its heartbeats, dropping it")
+                del self.members[member]
+                self._changed.set()
+
+    async def _on_message(self, message: Message):
+        data = message.value()
+        if not isinstance(data, dict) or data.get("member") in (None, self.member_id):
+            return
+        member: str = data["member"]
+        if data.get("type") == LEAVE:
+            if self.members.pop(member, None) is not None:
+                self.logger.info(f"Cluster member {member} left")
+                self._changed.set()
+        elif data.get("type") == HEARTBEAT:
+            if member not in self.members:
+                self.logger.info(f"Cluster member {member} joined")
+                self._changed.set()
+            self.members[member] = asyncio.get_running_loop().time()
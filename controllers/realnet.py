@@ -1,13 +1,23 @@
 
-import json
+import asyncio
+import importlib
+import inspect
 from logging import Logger
-import os
+from builders.containerlab import ClabNode, ClabResult, ContainerlabEngine
+from builders.topology import Topology
 from config.settings import Settings
 from controllers.controller import Controller
-from typing import Any, List, final, override, Dict
+from controllers.scheduler import SyncScheduler
+from eventbroker import subjects
+from eventbroker.codec import CodecError
+from eventbroker.eventbroker import Message
+from state.store import StateStore
+from typing import Any, List, Optional, final, override, Dict
 
 from controllers.sibling import SiblingController
+from state.ops import REMOVED
 from interfaces.interface import Interface
+from interfaces.synthetic import SYNTHETIC, SyntheticInterface, simulated_deployment
 
 @final
 class RealnetController(Controller):
@@ -22,10 +32,15 @@ class RealnetController(Controller):
         _type_: _description_
     """
     
-    def __init__(self, logger: Logger, config: Settings, real_topology_definition: dict, siblings: Dict[str, Dict[str, SiblingController]]):
-        self.realnet_interfaces: Dict[str, Any] = dict()
+    def __init__(self, logger: Logger, config: Settings, real_topology_definition: dict, siblings: Dict[str, Dict[str, SiblingController]], real_topology: Optional[Topology] = None):
+        self.realnet_interfaces: Dict[str, Interface] = dict()
+        self.real_nodes: Dict[str, ClabNode] = dict()
+        self.state: StateStore = StateStore(config.state_max_deltas)
+        self.scheduler: SyncScheduler = SyncScheduler(config.sync_interval, logger)
         self.siblings: Dict[str, Dict[str, SiblingController]] = siblings
-        super().__init__(logger, config, real_topology_definition)
+        # Latest slow consumer report by controller
+        self.slow_consumers: Dict[str, Dict[str, Any]] = dict()
+        super().__init__(logger, config, real_topology_definition, real_topology)
 
     @property
     def name(self) -> str:
@@ -38,65 +53,341 @@ class RealnetController(Controller):
         self._name = name
     
     async def async_run(self):
-        self.deploy_topology()
         assert self.broker
+        # Siblings request the state as soon as they start, which is before the realnet is
+        # deployed and the siblings are built. Until the first poll they catch up with the empty state.
+        listener = await self.broker.listen(self.control_channel(self.name), self.handle_message)
+        if not await self.deploy_topology():
+            self.logger.fatal("Failed to deploy the realnet topology. Exiting")
+            await self.broker.close()
+            return
 
         # Enter main loop
         self.logger.info("Entering realnet main loop...")
-        realnet_subscriber, key = await self.broker.subscribe("realnet")
 
-        for sibling_name, sibling_attributes in self.siblings.items():
+        failed = await self.build_siblings()
+        for sibling_name, reason in failed.items():
+            self.logger.error(f"Sibling {sibling_name} was not built: {reason}")
+
+        # Finished Topology build request and response handling, entering main communication loop
+        self.load_realnet_interfaces()
+        for node_name in self.real_nodes:
+            if any(interface.matchesNode(node_name) for interface in self.realnet_interfaces.values()):
+                self.scheduler.add_node(node_name, self.poll_node)
+        self.scheduler.every_tick(self.compact_state)
+        self.scheduler.every_tick(self.report_slow_consumers)
+        scheduler = asyncio.get_running_loop().create_task(self.scheduler.run())
+        try:
+            await listener
+        finally:
+            scheduler.cancel()
+
+    async def handle_message(self, message: Message):
+        """_Handle a message received on the realnet control channel_
+
+        Answers state snapshot and state delta requests of siblings that catch up
+        with the realnet state.
+
+        Args:
+            message (Message): _The received message_
+        """
+        assert self.broker
+        try:
+            task = message.value()
+        except CodecError as e:
+            self.logger.error(f"Dropping undecodable message on channel {message.channel()}: {e}")
+            return
+        if not isinstance(task, dict):
+            self.logger.debug(f"Ignoring malformed message on channel {message.channel()}")
+            return
+
+        if task.get("type") == "state snapshot request":
+            await self.broker.reply(message, {"type": "state snapshot", "source": self.name, **self.state.snapshot()})
+        elif task.get("type") == "state delta request":
+            deltas = self.state.deltas_since(task.get("since", -1))
+            if deltas is None:
+                await self.broker.reply(
+                    message,
+                    {"type": "state deltas", "source": self.name, "sequence": self.state.sequence, "snapshot_required": True},
+                )
+            else:
+                await self.broker.reply(
+                    message,
+                    {
+                        "type": "state deltas",
+                        "source": self.name,
+                        "sequence": self.state.sequence,
+                        "deltas": [delta.to_dict() for delta in deltas],
+                    },
+                )
+        elif task.get("type") in ("merkle digest request", "merkle roots request", "merkle children request", "state subtree request"):
+            await self.broker.reply(message, {"source": self.name, "sequence": self.state.sequence, **self.verification_reply(task)})
+        elif task.get("type") == "slow consumer report":
+            self.record_slow_consumers(task.get("source", "unknown"), task.get("subscriptions", dict()))
+        elif task.get("type") == "slow consumer request":
+            await self.broker.reply(message, {"type": "slow consumers", "source": self.name, "controllers": self.slow_consumers})
+        elif task.get("type") == "sync metrics request":
+            await self.broker.reply(
+                message,
+                {
+                    "type": "sync metrics",
+                    "source": self.name,
+                    "interval": self.scheduler.interval,
+                    **self.scheduler.metrics.to_dict(),
+                    "lanes": self.broker.lane_metrics(),
+                    "transfers": self.broker.transfer_stats(),
+                },
+            )
+        else:
+            self.logger.debug(f"Ignoring message of type {task.get('type')} on channel {message.channel()}")
+
+    def verification_reply(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        """_Answer a request of a sibling that verifies its state replica against the realnet_
+
+        A sibling compares Merkle digests first and only fetches the digests
+        and values of subtrees that differ:
+
+            merkle digest request    combined digest of the nodes that did not change since the sequence of the sibling
+            merkle roots request     root digest of every node
+            merkle children request  digests of the children of subtrees
+            state subtree request    values of subtrees
+
+        Args:
+            task (Dict[str, Any]): _The decoded request_
+
+        Returns:
+            Dict[str, Any]: _The reply without source and sequence_
+        """
+        merkle = self.state.merkle
+        if task["type"] == "merkle digest request":
+            deltas = self.state.deltas_since(task.get("since", -1))
+            if deltas is None:
+                return {"type": "merkle digest", "snapshot_required": True}
+            changed = sorted({delta.node for delta in deltas})
+            return {"type": "merkle digest", "changed": changed, "digest": merkle.combined(changed)}
+        if task["type"] == "merkle roots request":
+            roots = merkle.roots()
+            if task.get("nodes") is not None:
+                roots = {node: roots[node] for node in task["nodes"] if node in roots}
+            return {"type": "merkle roots", "roots": roots}
+        paths = [(node, tuple(path)) for node, path in task.get("paths", [])]
+        if task["type"] == "merkle children request":
+            return {"type": "merkle children", "children": [merkle.children(node, path) for node, path in paths]}
+        subtrees = [self.state.subtree(node, path) for node, path in paths]
+        return {"type": "state subtrees", "subtrees": [{"exists": exists, "value": value} for exists, value in subtrees]}
+
+    @override
+    async def report_slow_consumers(self):
+        """_Record the slow subscriptions of the realnet controller itself_"""
+        assert self.broker
+        slow = self.broker.slow_consumers()
+        if slow:
+            self.record_slow_consumers(self.name, {key: stats.to_dict() for key, stats in slow.items()})
+
+    def record_slow_consumers(self, source: str, subscriptions: Dict[str, Any]):
+        """_Keep the latest slow consumer report of a controller_
+
+        Args:
+            source (str): _Name of the reporting controller_
+            subscriptions (Dict[str, Any]): _Counters of the slow subscriptions by subscription key_
+        """
+        for key, stats in subscriptions.items():
+            self.logger.warning(
+                f"Controller {source} is a slow consumer of {stats.get('channel', key)}: "
+                f"{stats.get('pending')} messages pending for {stats.get('full_for', 0):.1f}s, "
+                f"{stats.get('dropped')} dropped, {stats.get('coalesced')} coalesced"
+            )
+        self.slow_consumers.setdefault(source, dict()).update(subscriptions)
+
+    async def compact_state(self):
+        """_Compact the state store, run once per sync tick_"""
+        self.state.compact()
+
+    async def build_siblings(self) -> Dict[str, str]:
+        """_Build all siblings concurrently_
+
+        Sends a topology build request to every sibling at once and collects the
+        responses as they arrive. Every sibling has its own deadline
+        (`create_sibling_timeout`), the whole phase is bounded by
+        `create_siblings_deadline`. A sibling that fails or times out is reported
+        and does not hold up the others.
+
+        Returns:
+            Dict[str, str]: _Siblings that could not be built, mapped to the reason_
+        """
+        assert self.broker
+        loop = asyncio.get_running_loop()
+        sibling_timeout: float = self.config.sibling_timeout
+        deadline: float = (
+            self.config.siblings_deadline
+            if self.config.siblings_deadline is not None
+            else sibling_timeout
+        )
+
+        async def build_sibling(sibling_name: str) -> str | None:
             self.logger.info(f"Build sibling {sibling_name} using its controller...")
-            await self.broker.publish(
-                sibling_name,
+            started = loop.time()
+            try:
+                message = await self.broker.request(
+                    self.control_channel(sibling_name),
+                    {
+                        "type": "topology build request",
+                        "source": "realnet",
+                        "sibling": sibling_name,
+                    },
+                    timeout=sibling_timeout,
+                )
+                task = message.value()
+            except TimeoutError:
+                return f"no topology build response within {sibling_timeout}s"
+            except CodecError as e:
+                return f"undecodable topology build response: {e}"
+            except Exception as e:
+                return f"build request failed: {e}"
+
+            latency = loop.time() - started
+            if not isinstance(task, dict) or task.get("type") != "topology build response":
+                return "malformed topology build response"
+            if task.get("error"):
+                self.logger.warning(f"Sibling {sibling_name} failed to build after {latency:.3f}s")
+                return task["error"]
+            self.siblings[sibling_name].update(
                 {
-                    "type": "topology build request",
-                    "source": "realnet",
-                    "sibling": sibling_name,
+                    "topology": task["topology"],
+                    "nodes": task["nodes"],
+                    "interfaces": task["interfaces"],
+                    "running": task["running"],
                 }
             )
+            self.logger.info(f"Topology build response for sibling {sibling_name} received after {latency:.3f}s")
+            return None
 
-            self.logger.info("Waiting for topology build response for realnet...")
-            timeout = self.config.sibling_timeout
-            try:
-                while True:
-                    message = await self.broker.poll(realnet_subscriber, timeout=timeout)
-                    if message is None:
-                        self.logger.fatal(f"Timeout while waiting for topology build response from sibling {sibling_name}. Exiting")
-                        await self.broker.close()
-                        exit(1)
-                    elif message.error():
-                        self.logger.fatal(f"Consumer error {message.error()}. Exiting")
-                        await self.broker.close()
-                        exit(1)
-                    else:
-                        assert message.value()
-                        task = json.loads(message.value())
-                        if (
-                            task["type"] == "topology build response"
-                            and task["sibling"] == sibling_name
-                        ):
-                            sibling_attributes.update(
-                                {
-                                    "topology": task["topology"],
-                                    "nodes": task["nodes"],
-                                    "interfaces": task["interfaces"],
-                                    "running": task["running"],
-                                }
-                            )
-                            break
-            finally:
-                self.logger.debug(f"Topology build response for sibling {sibling_name} received")
-        
-        # Finished Topology build request and response handling, entering main communication loop
+        builds: Dict[str, asyncio.Task] = {
+            sibling_name: loop.create_task(build_sibling(sibling_name))
+            for sibling_name in self.siblings
+        }
+        self.logger.info(f"Waiting for topology build responses from {len(builds)} siblings...")
+        if builds:
+            await asyncio.wait(builds.values(), timeout=deadline)
+
+        failed: Dict[str, str] = dict()
+        for sibling_name, build in builds.items():
+            if not build.done():
+                build.cancel()
+                failed[sibling_name] = "no topology build response before the build deadline"
+            elif build.result() is not None:
+                failed[sibling_name] = build.result()
+        await asyncio.gather(*builds.values(), return_exceptions=True)
+        return failed
 
-        # TODO: insert main event loop
+    async def deploy_topology(self) -> bool:
+        """_Deploy the realnet topology using containerlab_
 
-    def deploy_topology(self):
-        os.system(f"clab deploy -t {self.config.topology.file}")
+        Skipped if the lab is already running with the same definition, e.g.
+        after a restart of DigSiNet, and for a simulated realnet.
+
+        Returns:
+            bool: _Whether the deployment succeeded_
+        """
+        if self.config.topology.type == SYNTHETIC:
+            result: ClabResult = simulated_deployment(self.config.topology.file, self.real_topology_definition)
+        else:
+            result = await ContainerlabEngine(self.logger).reconcile(
+                self.config.topology.file, self.real_topology_definition, write=False
+            )
+        self.real_nodes = {node.name: node for node in result.nodes}
+        return result.ok
 
     def load_realnet_interfaces(self):
+        """_Create the interfaces of the realnet_
+
+        The interface class is taken from the module configured for the
+        interface name in the `interfaces` section. A simulated realnet uses
+        the synthetic interface for every interface instead.
+        """
         self.realnet_interfaces = dict()
         for interface in self.config.realnet.interfaces:
             self.logger.debug(f"Loading realnet interface {interface}")
-            # TODO: interface loading
\ No newline at end of file
+            if self.config.topology.type == SYNTHETIC:
+                interface_class: type[Interface] = SyntheticInterface
+            else:
+                credentials = self.config.interface_credentials.get(interface)
+                if credentials is None:
+                    self.logger.error(f"No interface configuration found for realnet interface {interface}. Skipping")
+                    continue
+                try:
+                    module = importlib.import_module(credentials.module)
+                except ModuleNotFoundError as e:
+                    self.logger.error(f"Failed to load interface module {credentials.module} for realnet interface {interface}: {e}. Skipping")
+                    continue
+                classes = [
+                    member for _, member in inspect.getmembers(module, inspect.isclass)
+                    if issubclass(member, Interface) and not inspect.isabstract(member) and member.__module__ == module.__name__
+                ]
+                if not classes:
+                    self.logger.error(f"Interface module {credentials.module} does not define an interface. Skipping")
+                    continue
+                interface_class = classes[0]
+            self.realnet_interfaces[interface] = interface_class(
+                self.config, "realnet", self.logger, "clab", self.real_topology.name, interface
+            )
+            self.logger.info(f"Loaded realnet interface {interface} using {interface_class.__name__}")
+
+    async def poll_node(self, node_name: str) -> bool:
+        """_Poll a realnet node through all interfaces it matches_
+
+        Called by the scheduler, which polls the nodes concurrently. Changes are
+        applied to the realnet state and published on the telemetry subject of
+        the node and path. An interface that fails or times out is reported and
+        does not hold up the others.
+
+        Args:
+            node_name (str): _Name of the node_
+
+        Returns:
+            bool: _Whether the node changed_
+        """
+        assert self.broker
+        node = self.real_nodes.get(node_name)
+        interfaces = [
+            (interface_name, interface)
+            for interface_name, interface in self.realnet_interfaces.items()
+            if interface.matchesNode(node_name)
+        ]
+        results = await asyncio.gather(
+            *(interface.updateNode(node_name, node, self.broker, True, self.publish_update) for _, interface in interfaces),
+            return_exceptions=True,
+        )
+        changed = False
+        for (interface_name, interface), result in zip(interfaces, results):
+            if isinstance(result, TimeoutError):
+                self.logger.warning(f"Node {node_name} did not answer interface {interface_name} within {interface.node_timeout}s")
+            elif isinstance(result, BaseException):
+                self.logger.error(f"Failed to poll node {node_name} through interface {interface_name}: {result}")
+            else:
+                changed = changed or result
+        return changed
+
+    async def publish_update(self, event: Dict[str, Any]):
+        """_Apply an update event of an interface to the realnet state and publish it_
+
+        Args:
+            event (Dict[str, Any]): _A telemetry or telemetry delta event, see `Interface.buildNodeUpdate`_
+        """
+        assert self.broker
+        node: str = event["node"]
+        path: str = event["path"]
+        if event["type"] == "telemetry":
+            self.state.update(node, (path,), event["tree"])
+        else:
+            for delta in event["deltas"]:
+                if delta["op"] == REMOVED:
+                    self.state.delete(node, (path, *delta["path"]))
+                else:
+                    self.state.update(node, (path, *delta["path"]), delta["value"])
+        await self.broker.publish(
+            subjects.telemetry(self.config.topology_name, node, path),
+            {**event, "sequence": self.state.sequence},
+            # Only complete trees supersede earlier events, deltas must all be delivered
+            key=f"{node}|{path}" if event["type"] == "telemetry" else None,
+        )
\ No newline at end of file
@@ -0,0 +1,197 @@
+"""Interval scheduler for the sync work of a controller"""
+import asyncio
+from dataclasses import asdict, dataclass
+from logging import Logger
+import random
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import zlib
+
+
+TickCallback = Callable[[], Awaitable[None]]
+# Polls a node, returns whether anything changed
+NodePoll = Callable[[str], Awaitable[bool]]
+
+
+@dataclass
+class SchedulerMetrics:
+    """
+    Timing of the sync ticks of a scheduler.
+
+    Lag is the delay between the scheduled and the actual start of a tick. A
+    growing lag, skipped ticks or tick durations close to the interval mean the
+    controller can not keep up with the configured interval.
+
+    Attributes:
+        ticks (int): number of ticks run
+        skipped (int): number of ticks skipped because the previous tick overran
+        overruns (int): number of ticks that took longer than the interval
+        polls (int): number of node polls
+        unchanged_polls (int): number of node polls that found no change
+        last_duration (float): duration of the last tick in seconds
+        max_duration (float): longest tick in seconds
+        mean_duration (float): mean tick duration in seconds
+        last_lag (float): lag of the last tick in seconds
+        max_lag (float): largest lag in seconds
+    """
+
+    ticks: int = 0
+    skipped: int = 0
+    overruns: int = 0
+    polls: int = 0
+    unchanged_polls: int = 0
+    last_duration: float = 0.0
+    max_duration: float = 0.0
+    mean_duration: float = 0.0
+    last_lag: float = 0.0
+    max_lag: float = 0.0
+
+    def record(self, duration: float, lag: float):
+        self.ticks += 1
+        self.last_duration = duration
+        self.max_duration = max(self.max_duration, duration)
+        self.mean_duration += (duration - self.mean_duration) / self.ticks
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class SyncScheduler:
+    """
+    Runs sync work once per interval.
+
+    Ticks are aligned to a fixed grid of `interval` seconds. A tick that is
+    still running when the next one is due makes the scheduler skip the missed
+    ticks instead of queueing them, so an overloaded controller falls behind by
+    at most one tick.
+
+    Node polls are spread over the first `spread` part of the interval: every
+    node gets a stable offset derived from its name plus random jitter, so
+    many nodes and many controllers do not poll at the same moment. The rest
+    of the interval is headroom for the polls to finish before the next tick.
+
+    A node whose poll found no change is polled every 2nd, 4th, ... tick, up
+    to every `max_backoff`th tick, and again every tick as soon as a poll
+    finds a change.
+
+    Attributes:
+        interval (float): seconds between ticks
+        spread (float): fraction of the interval poll starts are spread over
+        jitter (float): random part of the poll offsets as fraction of the spread
+        max_backoff (int): largest number of ticks between two polls of an unchanged node
+        metrics (SchedulerMetrics): tick timing
+    """
+
+    def __init__(self, interval: float, logger: Logger, spread: float = 0.5, jitter: float = 0.1, max_backoff: int = 8):
+        if interval <= 0:
+            raise ValueError("sync interval must be positive")
+        self.interval: float = interval
+        self.logger: Logger = logger
+        self.spread: float = spread
+        self.jitter: float = jitter
+        self.max_backoff: int = max(1, max_backoff)
+        self.metrics: SchedulerMetrics = SchedulerMetrics()
+        self._callbacks: List[TickCallback] = list()
+        self._nodes: Dict[str, NodePoll] = dict()
+        self._backoff: Dict[str, int] = dict()
+        self._due: Dict[str, int] = dict()
+        self._tick: int = 0
+        self._random: random.Random = random.Random()
+
+    def every_tick(self, callback: TickCallback):
+        """_Run callback once per tick_"""
+        self._callbacks.append(callback)
+
+    def add_node(self, node: str, poll: NodePoll):
+        """_Poll a node once per tick, less often while it does not change_"""
+        self._nodes[node] = poll
+        self._backoff[node] = 1
+        self._due[node] = self._tick
+
+    def remove_node(self, node: str):
+        self._nodes.pop(node, None)
+        self._backoff.pop(node, None)
+        self._due.pop(node, None)
+
+    def offset(self, node: str) -> float:
+        """_Seconds after the start of a tick at which a node is polled_"""
+        # crc32 is stable across processes, unlike hash() of a str
+        base = (zlib.crc32(node.encode()) / 0xFFFFFFFF) * (1 - self.jitter)
+        return (base + self._random.random() * self.jitter) * self.spread * self.interval
+
+    async def run(self):
+        """_Run ticks until cancelled_"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        scheduled = started
+        while True:
+            delay = scheduled - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tick_started = loop.time()
+            lag = tick_started - scheduled
+            await self._run_tick(tick_started)
+            finished = loop.time()
+            duration = finished - tick_started
+            self.metrics.record(duration, lag)
+            if duration > self.interval:
+                self.metrics.overruns += 1
+
+            # Continue with the next tick on the grid that is not due yet
+            following = int((finished - started) / self.interval) + 1
+            current = round((scheduled - started) / self.interval)
+            skipped = following - current - 1
+            if skipped > 0:
+                self.metrics.skipped += skipped
+                self.logger.warning(
+                    f"Sync tick took {duration:.3f}s with an interval of {self.interval}s, skipping {skipped} ticks"
+                )
+            scheduled = started + following * self.interval
+            self._tick += max(1, following - current)
+
+    async def _run_tick(self, tick_started: float):
+        work: List[Awaitable[Any]] = [self._run_callback(callback) for callback in self._callbacks]
+        due = [node for node in self._nodes if self._due[node] <= self._tick]
+        if due:
+            work.append(self._run_polls(due, tick_started))
+        await asyncio.gather(*work)
+
+    async def _run_callback(self, callback: TickCallback):
+        try:
+            await callback()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.error(f"Sync tick failed: {e}")
+
+    async def _run_polls(self, nodes: List[str], tick_started: float):
+        loop = asyncio.get_running_loop()
+        polls: List[asyncio.Task] = list()
+        for offset, node in sorted((self.offset(node), node) for node in nodes):
+            delay = tick_started + offset - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            polls.append(loop.create_task(self._poll(node)))
+        await asyncio.gather(*polls)
+
+    async def _poll(self, node: str):
+        poll: Optional[NodePoll] = self._nodes.get(node)
+        if poll is None:
+            return
+        try:
+            changed = await poll(node)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.error(f"Polling node {node} failed: {e}")
+            changed = False
+        if node not in self._nodes:
+            return
+        self.metrics.polls += 1
+        if changed:
+            self._backoff[node] = 1
+        else:
+            self.metrics.unchanged_polls += 1
+            self._backoff[node] = min(self._backoff[node] * 2, self.max_backoff)
+        self._due[node] = self._tick + self._backoff[node]
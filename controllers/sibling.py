@@ -1,21 +1,424 @@
-
-
+import asyncio
+from dataclasses import asdict
 from logging import Logger
-from typing import List
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
 
+from builders.containerlab import ClabResult, ContainerlabEngine, sibling_topology_file
+from builders.topology import Topology
 from config.settings import Settings
 from controllers.controller import Controller
+from controllers.scheduler import SyncScheduler
+from eventbroker import subjects
+from eventbroker.codec import CodecError
+from eventbroker.eventbroker import Message, MessageHandler
+from interfaces.synthetic import SYNTHETIC, simulated_deployment
+from state.merkle import Drift, find_drift
+from state.store import Delta, StateStore
 
 
 class SiblingController(Controller):
 
-    def __init__(self, logger: Logger, config: Settings, real_topology_definition: dict, sibling: str):
+    def __init__(self, logger: Logger, config: Settings, real_topology_definition: dict, sibling: str, real_topology: Optional[Topology] = None, start_process: bool = True):
         self.siblings: List[str] = list()
         self.siblings.append(sibling)
+        # Replica of the realnet state, kept up to date with deltas
+        self.state: StateStore = StateStore(config.state_max_deltas)
+        self.scheduler: SyncScheduler = SyncScheduler(config.sync_interval, logger)
+        self.scheduler.every_tick(self.follow_state)
+        self.scheduler.every_tick(self.report_slow_consumers)
 
-        super().__init__(logger, config, real_topology_definition)
+        super().__init__(logger, config, real_topology_definition, real_topology, start_process)
     
     async def async_run(self):
-        # TODO: enter the main sibling controller loop
-        pass
-        
\ No newline at end of file
+        """
+        Serve the siblings of the controller until cancelled.
+
+        Control channels are subscribed in the queue group of the sibling, so
+        only one of several workers able to run the sibling handles a request,
+        e.g. while the sibling is handed over to another worker. Cancelling
+        stops the controller and removes its handlers from the shared broker,
+        it can be started again later.
+
+        Args:
+            None
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+
+        assert self.broker
+        listening: List[Tuple[str, MessageHandler, str | None]] = list()
+        for sibling in self.siblings:
+            listening.append((
+                self.control_channel(sibling),
+                self.handle_message,
+                subjects.queue_group(self.config.topology_name, sibling),
+            ))
+            for channel in self.telemetry_channels(sibling):
+                listening.append((channel, self.receive_telemetry, None))
+        listeners: List[asyncio.Task] = list()
+        try:
+            for channel, handler, group_id in listening:
+                listeners.append(await self.broker.listen(channel, handler, group_id))
+            self.logger.info(f"Entering sibling controller main loop for {', '.join(self.siblings)}...")
+            scheduler = asyncio.get_running_loop().create_task(self.scheduler.run())
+            try:
+                # Listener tasks may be shared with other controllers, wait does not cancel them
+                await asyncio.wait(set(listeners))
+            finally:
+                scheduler.cancel()
+        finally:
+            for channel, handler, group_id in listening:
+                await self.broker.unlisten(channel, handler, group_id)
+
+    async def follow_state(self):
+        """
+        Keep the state replica in sync with the realnet and verify it, run once per sync tick.
+
+        Args:
+            None
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+
+        try:
+            await self.sync_state()
+            await self.verify_state()
+        except TimeoutError:
+            self.logger.warning("Timeout while synchronizing state with the realnet")
+        except Exception as e:
+            self.logger.error(f"Failed to synchronize state with the realnet: {e}")
+
+    async def sync_state(self):
+        """
+        Catch up with the realnet state.
+
+        Fetches only the deltas after the sequence of the replica. A snapshot is
+        fetched instead if the realnet already compacted the required deltas, e.g.
+        when the sibling starts late or restarts.
+
+        Args:
+            None
+
+        Returns:
+            None
+
+        Raises:
+            TimeoutError: if the realnet does not answer in time
+        """
+
+        reply = await self.request_realnet({"type": "state delta request", "since": self.state.sequence})
+        if reply.get("snapshot_required"):
+            snapshot = await self.request_realnet({"type": "state snapshot request"})
+            if not isinstance(snapshot.get("nodes"), dict) or not isinstance(snapshot.get("sequence"), int):
+                raise ValueError("malformed state snapshot from the realnet")
+            self.state.load(snapshot)
+            self.logger.info(f"Loaded realnet state snapshot at sequence {self.state.sequence}")
+            return
+        deltas: List[Delta] = [Delta.from_dict(delta) for delta in reply.get("deltas", [])]
+        self.state.apply_deltas(deltas)
+        if deltas:
+            self.logger.debug(f"Applied {len(deltas)} realnet state deltas up to sequence {self.state.sequence}")
+
+    async def verify_state(self) -> List[Drift]:
+        """
+        Verify the state replica against the realnet and repair drifted subtrees.
+
+        Compares a single combined Merkle digest of all nodes that did not
+        change since the sequence of the replica, nodes with changes in flight
+        are checked once the replica caught up with them. Only if the digests
+        differ, the root digests of the nodes are compared and the differing
+        trees are walked down level by level, fetching only the child digests
+        of differing subtrees. The smallest differing subtrees are then fetched
+        and restored, without a full snapshot.
+
+        Args:
+            None
+
+        Returns:
+            List[Drift]: the subtrees that drifted and were repaired
+
+        Raises:
+            TimeoutError: if the realnet does not answer in time
+        """
+
+        reply = await self.request_realnet({"type": "merkle digest request", "since": self.state.sequence})
+        if reply.get("snapshot_required"):
+            # The next sync loads a snapshot anyway
+            return []
+        changed: Set[str] = set(reply.get("changed", []))
+        if reply.get("digest") == self.state.merkle.combined(changed):
+            return []
+
+        remote_roots: Dict[str, str] = {
+            node: digest
+            for node, digest in (await self.request_realnet({"type": "merkle roots request"})).get("roots", dict()).items()
+            if node not in changed
+        }
+        nodes: List[str] = sorted((self.state.merkle.roots(changed).keys() | remote_roots.keys()))
+
+        async def fetch_children(paths: List[Tuple[str, Tuple[str, ...]]]) -> List[Optional[Dict[str, str]]]:
+            reply = await self.request_realnet({"type": "merkle children request", "paths": [[node, list(path)] for node, path in paths]})
+            return reply.get("children", [])
+
+        drift: List[Drift] = await find_drift(self.state.merkle, remote_roots, fetch_children, nodes)
+        if not drift:
+            return drift
+        subtrees = (await self.request_realnet({
+            "type": "state subtree request",
+            "paths": [[entry.node, list(entry.path)] for entry in drift],
+        })).get("subtrees", [])
+        for entry, subtree in zip(drift, subtrees):
+            self.state.restore(entry.node, entry.path, subtree.get("value"), subtree.get("exists", False))
+        self.logger.warning(
+            f"Repaired {len(drift)} subtrees of the state replica that drifted from the realnet: "
+            + ", ".join("/".join((entry.node, *entry.path)) for entry in drift[:10])
+        )
+        return drift
+
+    async def request_realnet(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Send a request to the realnet controller and wait for its reply.
+
+        Args:
+            task (Dict[str, Any]): the request, the source is added
+
+        Returns:
+            Dict[str, Any]: the decoded reply
+
+        Raises:
+            TimeoutError: if the realnet does not answer within the sibling timeout
+            ValueError: if the reply can not be decoded or is no dict
+        """
+
+        assert self.broker
+        message = await self.broker.request(
+            self.control_channel("realnet"), {"source": self.name, **task}, self.config.sibling_timeout
+        )
+        try:
+            reply = message.value()
+        except CodecError as e:
+            raise ValueError(f"undecodable reply to {task.get('type')} from the realnet: {e}") from e
+        if not isinstance(reply, dict):
+            raise ValueError(f"malformed reply to {task.get('type')} from the realnet")
+        return reply
+
+    def telemetry_channels(self, sibling: str) -> List[str]:
+        """
+        Telemetry channels a sibling is interested in.
+
+        Derived from the nodes and paths of the interfaces of the sibling, so the
+        broker only delivers updates of nodes and paths the sibling mirrors.
+
+        Args:
+            sibling (str): name of the sibling
+
+        Returns:
+            List[str]: channels to subscribe to
+
+        Raises:
+            None
+        """
+
+        known_nodes: List[str] = list(self.real_topology.node_names())
+        channels: List[str] = list()
+        for interface in self.config.siblings[sibling].interfaces.values():
+            for channel in subjects.telemetry_interest(
+                self.config.topology_name, interface.nodes, interface.paths, known_nodes
+            ):
+                if channel not in channels:
+                    channels.append(channel)
+        return channels
+
+    def accepts_telemetry(self, subject: str) -> bool:
+        """
+        Whether a telemetry subject is of a node and path one of the siblings is interested in.
+
+        The telemetry channels are wider than the interfaces of the siblings
+        if their paths contain key wildcards, this narrows them down again.
+
+        Args:
+            subject (str): subject of a telemetry update
+
+        Returns:
+            bool: whether to handle the update
+        """
+
+        node: str = subjects.telemetry_node(subject)
+        return any(
+            re.fullmatch(interface.nodes, node) and subjects.path_accepts(interface.paths, subject)
+            for sibling in self.siblings
+            for interface in self.config.siblings[sibling].interfaces.values()
+        )
+
+    async def receive_telemetry(self, message: Message):
+        """
+        Pass telemetry updates of interest to `handle_telemetry`.
+
+        Args:
+            message (Message): the received update
+        """
+
+        if self.accepts_telemetry(message.channel()):
+            await self.handle_telemetry(message)
+
+    async def handle_telemetry(self, message: Message):
+        """
+        Handle a telemetry update of the realnet. Sibling controllers override this
+        method to apply updates to their sibling.
+
+        Args:
+            message (Message): the received update
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+
+        self.logger.debug(f"Received telemetry update on channel {message.channel()}")
+
+    async def handle_message(self, message: Message):
+        """
+        Handle a message received on the channel of one of the siblings.
+
+        Args:
+            message (Message): the received message
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        assert self.broker
+        try:
+            task = message.value()
+        except CodecError as e:
+            self.logger.error(f"Dropping undecodable message on channel {message.channel()}: {e}")
+            return
+        if not isinstance(task, dict):
+            self.logger.debug(f"Ignoring malformed message on channel {message.channel()}")
+            return
+
+        if task.get("type") == "topology build request":
+            sibling: str = task.get("sibling", "")
+            response: Dict[str, Any] = {
+                "type": "topology build response",
+                "source": self.name,
+                "sibling": sibling,
+            }
+            if sibling not in self.siblings:
+                response["error"] = f"sibling {sibling} is not managed by controller {self.name}"
+            else:
+                try:
+                    response.update(await self.build_topology(sibling))
+                except Exception as e:
+                    self.logger.error(f"Failed to build topology for sibling {sibling}: {e}")
+                    response["error"] = str(e)
+            await self.broker.reply(message, response)
+        elif task.get("type") == "sync metrics request":
+            await self.broker.reply(
+                message,
+                {
+                    "type": "sync metrics",
+                    "source": self.name,
+                    "interval": self.scheduler.interval,
+                    **self.scheduler.metrics.to_dict(),
+                    "lanes": self.broker.lane_metrics(),
+                    "transfers": self.broker.transfer_stats(),
+                },
+            )
+        else:
+            self.logger.debug(f"Ignoring message of type {task.get('type')} on channel {message.channel()}")
+
+    def sibling_topology(self, sibling: str) -> Topology:
+        """
+        Derive the topology of a sibling from the realnet topology.
+
+        The sibling topology is an overlay of the shared realnet topology with the
+        topology adjustments of the sibling applied.
+
+        Args:
+            sibling (str): name of the sibling
+
+        Returns:
+            Topology: topology of the sibling
+
+        Raises:
+            TopologyError: if an adjustment can not be applied
+        """
+
+        return self.real_topology.derive(sibling).apply(self.config.siblings[sibling].topology_adjustments)
+
+    async def deploy_topology(self, sibling: str, topology: Topology) -> ClabResult:
+        """
+        Deploy the topology of a sibling using containerlab.
+
+        The definition is written next to the realnet topology definition. A lab
+        that is already running with the same definition is not deployed again,
+        a changed one is updated node by node where possible. Siblings of a
+        simulated realnet are not deployed.
+
+        Args:
+            sibling (str): name of the sibling
+            topology (Topology): topology of the sibling, e.g. from sibling_topology
+
+        Returns:
+            ClabResult: exit code and node inventory of the sibling
+
+        Raises:
+            None
+        """
+
+        if self.config.topology.type == SYNTHETIC:
+            return simulated_deployment(sibling_topology_file(self.config, sibling), topology.to_definition())
+        return await ContainerlabEngine(self.logger).reconcile(
+            sibling_topology_file(self.config, sibling), topology.to_definition()
+        )
+
+    async def build_topology(self, sibling: str) -> Dict[str, Any]:
+        """
+        Build the topology of a sibling.
+
+        Siblings with autostart are deployed with deploy_topology, so a sibling
+        that is already running with the same topology is left as it is. Sibling
+        controllers override this method to create the sibling using their builder.
+
+        Args:
+            sibling (str): name of the sibling
+
+        Returns:
+            Dict[str, Any]: topology, nodes, interfaces and running state of the sibling
+
+        Raises:
+            Exception: if the sibling could not be built
+        """
+
+        topology: Topology = self.sibling_topology(sibling)
+        nodes: Dict[str, Any] = dict()
+        running: bool = False
+        if self.config.siblings[sibling].autostart:
+            result: ClabResult = await self.deploy_topology(sibling, topology)
+            if not result.ok:
+                raise RuntimeError(f"deployment of {result.topology_file} failed with exit code {result.returncode}")
+            nodes = {node.name: asdict(node) for node in result.nodes}
+            running = all(node.state == "running" for node in result.nodes)
+        return {
+            "topology": topology.to_definition(),
+            "nodes": nodes,
+            "interfaces": {
+                name: interface.model_dump()
+                for name, interface in self.config.siblings[sibling].interfaces.items()
+            },
+            "running": running,
+        }
@@ -0,0 +1,199 @@
+import asyncio
+import heapq
+from logging import Logger
+import os
+import socket
+from typing import Dict, List, Optional, Tuple
+
+from builders.topology import Topology
+from config.settings import Settings
+from controllers.controller import Controller
+from controllers.membership import Membership
+from controllers.sibling import SiblingController
+
+
+def assign_workers(weights: Dict[str, int], workers: int) -> List[List[str]]:
+    """
+    Assign siblings to workers with balanced load.
+
+    Siblings are placed heaviest first on the currently least loaded worker,
+    ties are broken by the number of siblings already on the worker.
+
+    Args:
+        weights (Dict[str, int]): load of every sibling, e.g. the number of nodes of its topology
+        workers (int): number of workers
+
+    Returns:
+        List[List[str]]: siblings of every worker, empty workers are omitted
+
+    Raises:
+        None
+    """
+
+    # (load, number of siblings, worker index)
+    loads: List[Tuple[int, int, int]] = [(0, 0, index) for index in range(max(1, workers))]
+    assignment: List[List[str]] = [list() for _ in loads]
+    for sibling in sorted(weights, key=lambda sibling: (-weights[sibling], sibling)):
+        load, count, index = heapq.heappop(loads)
+        assignment[index].append(sibling)
+        heapq.heappush(loads, (load + max(1, weights[sibling]), count + 1, index))
+    return [siblings for siblings in assignment if siblings]
+
+
+class WorkerController(Controller):
+    """
+    Hosts several sibling controllers in one process.
+
+    The hosted controllers are created without a process of their own and run
+    as asyncio tasks of the worker. They share the broker connection of the
+    worker, so the number of interpreters and broker connections is bounded by
+    the number of workers instead of the number of siblings.
+
+    With cluster settings, the workers of all DigSiNet instances sharing the
+    broker form a cluster. Every worker hosts controllers for all siblings but
+    only runs those it owns according to the cluster membership. When a
+    worker leaves or stops sending heartbeats, its siblings are started by
+    their new owners.
+
+    Attributes:
+        index (int): number of the worker
+        controllers (List[SiblingController]): hosted sibling controllers
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        config: Settings,
+        real_topology_definition: dict,
+        index: int,
+        controllers: List[SiblingController],
+        real_topology: Optional[Topology] = None,
+    ):
+        self.index: int = index
+        self.controllers: List[SiblingController] = controllers
+        super().__init__(logger, config, real_topology_definition, real_topology)
+
+    @property
+    def name(self) -> str:
+        return f"worker-{self.index}"
+
+    @name.setter
+    def name(self, name: str):
+        self._name = name
+
+    @property
+    def member_id(self) -> str:
+        """
+        Name of the worker in the cluster, unique across all hosts.
+
+        Args:
+            None
+
+        Returns:
+            str: configured member ID or host name and process ID, followed by the worker number
+
+        Raises:
+            None
+        """
+
+        cluster = self.config.cluster
+        prefix = cluster.member_id if cluster and cluster.member_id else f"{socket.gethostname()}-{os.getpid()}"
+        return f"{prefix}-{self.index}"
+
+    def channels(self) -> List[str]:
+        """
+        Control channels of all hosted controllers.
+
+        Args:
+            None
+
+        Returns:
+            List[str]: names of the channels
+
+        Raises:
+            None
+        """
+
+        channels: List[str] = list()
+        for controller in self.controllers:
+            for channel in controller.channels():
+                if channel not in channels:
+                    channels.append(channel)
+        return channels
+
+    async def async_run(self):
+        assert self.broker
+        for controller in self.controllers:
+            controller.broker = self.broker
+        if self.config.cluster is not None:
+            await self.run_cluster_member()
+            await self.broker.close()
+            return
+        self.logger.info(
+            f"Worker {self.index} running sibling controllers {', '.join(controller.name for controller in self.controllers)}"
+        )
+        results = await asyncio.gather(
+            *(controller.async_run() for controller in self.controllers), return_exceptions=True
+        )
+        for controller, result in zip(self.controllers, results):
+            if isinstance(result, BaseException):
+                self.logger.error(f"Sibling controller {controller.name} in worker {self.index} failed: {result}")
+        await self.broker.close()
+
+    async def run_cluster_member(self):
+        """
+        Run the controllers of the siblings owned by this worker.
+
+        Ownership is re-evaluated whenever a worker joins or leaves the cluster.
+        Controllers of siblings that moved to another worker are stopped, those
+        of siblings that moved here are started.
+
+        Args:
+            None
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+
+        assert self.broker and self.config.cluster
+        cluster = self.config.cluster
+        membership = Membership(
+            self.broker,
+            self.config.topology_name,
+            self.member_id,
+            self.logger,
+            cluster.heartbeat_interval,
+            cluster.member_timeout,
+        )
+        controllers: Dict[str, SiblingController] = {
+            ",".join(controller.siblings): controller for controller in self.controllers
+        }
+        running: Dict[str, asyncio.Task] = dict()
+        loop = asyncio.get_running_loop()
+
+        async def rebalance():
+            owned = {key for key in controllers if membership.owns(key)}
+            for key in list(running):
+                task = running[key]
+                if key in owned and not task.done():
+                    continue
+                if not task.done():
+                    self.logger.info(f"Handing over siblings {key} to cluster member {membership.owner(key)}")
+                    task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                del running[key]
+            for key in owned - running.keys():
+                self.logger.info(f"Cluster member {membership.member_id} takes over siblings {key}")
+                running[key] = loop.create_task(controllers[key].async_run(), name=f"siblings {key}")
+
+        membership.on_change = rebalance
+        try:
+            await membership.run()
+        finally:
+            for task in running.values():
+                task.cancel()
+            await asyncio.gather(*running.values(), return_exceptions=True)
+            await membership.leave()
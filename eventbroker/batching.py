@@ -0,0 +1,134 @@
+"""Publish micro-batching for EventBroker implementations"""
+import asyncio
+from itertools import count
+from logging import Logger
+from typing import Awaitable, Callable, Dict, Hashable, Iterator, List, Optional, Set
+
+
+class _Batch:
+    """
+    Messages buffered for a single subject.
+
+    Messages are stored by key in insertion order. Messages published without a
+    key get a unique sequence number as key, so they are never coalesced.
+    """
+
+    __slots__ = ("messages", "size", "timer")
+
+    def __init__(self):
+        self.messages: Dict[Hashable, bytes] = dict()
+        self.size: int = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class PublishBatcher:
+    """
+    Buffers outgoing payloads per subject and flushes them together.
+
+    A batch is flushed when its time window expires or when it exceeds the byte
+    budget, whichever comes first. Payloads published with the same key inside a
+    window are coalesced, only the newest one is sent.
+
+    Attributes:
+        window (float): time window in seconds a batch is held back at most
+        max_bytes (int): byte budget of a batch
+        flushed (int): number of flushed batches
+        coalesced (int): number of payloads replaced by a newer one with the same key
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str, List[bytes]], Awaitable[None]],
+        window: float,
+        max_bytes: int,
+        logger: Logger,
+    ):
+        """
+        Args:
+            send (Callable[[str, List[bytes]], Awaitable[None]]): sends the payloads of a batch to a subject
+            window (float): time window in seconds
+            max_bytes (int): byte budget per subject
+            logger (Logger): logger
+        """
+        self._send = send
+        self.window: float = window
+        self.max_bytes: int = max_bytes
+        self.logger: Logger = logger
+        self.flushed: int = 0
+        self.coalesced: int = 0
+        self._batches: Dict[str, _Batch] = dict()
+        self._sequence: Iterator[int] = count()
+        self._flush_tasks: Set[asyncio.Task] = set()
+        # Held while a batch is sent, so a flush returns only after earlier batches went out
+        self._sending: asyncio.Lock = asyncio.Lock()
+        self._closed: bool = False
+
+    async def add(self, subject: str, payload: bytes, key: Optional[str] = None):
+        """_Buffer a payload for subject_
+
+        Args:
+            subject (str): _The subject to publish to_
+            payload (bytes): _The encoded payload_
+            key (Optional[str], optional): _Coalescing key, e.g. node and path of a telemetry update_. Defaults to None.
+        """
+        if self._closed:
+            await self._send(subject, [payload])
+            return
+
+        batch = self._batches.get(subject)
+        if batch is None:
+            batch = self._batches[subject] = _Batch()
+
+        message_key: Hashable = next(self._sequence) if key is None else key
+        previous = batch.messages.pop(message_key, None)
+        if previous is not None:
+            batch.size -= len(previous)
+            self.coalesced += 1
+        batch.messages[message_key] = payload
+        batch.size += len(payload)
+
+        if batch.size >= self.max_bytes:
+            await self.flush(subject)
+        elif batch.timer is None:
+            batch.timer = asyncio.get_running_loop().call_later(self.window, self._on_window_expired, subject)
+
+    async def flush(self, subject: Optional[str] = None):
+        """_Send buffered payloads_
+
+        Returns once the payloads and any batch already being sent went out.
+
+        Args:
+            subject (Optional[str], optional): _Subject to flush, all subjects if None_. Defaults to None.
+        """
+        async with self._sending:
+            subjects = list(self._batches) if subject is None else [subject]
+            for name in subjects:
+                batch = self._batches.pop(name, None)
+                if batch is None:
+                    continue
+                if batch.timer is not None:
+                    batch.timer.cancel()
+                if batch.messages:
+                    self.flushed += 1
+                    await self._send(name, list(batch.messages.values()))
+
+    async def close(self):
+        """_Flush all buffered payloads and stop batching_
+
+        Publishing after close sends payloads immediately.
+        """
+        self._closed = True
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        await self.flush()
+
+    def _on_window_expired(self, subject: str):
+        task = asyncio.get_running_loop().create_task(self._flush_expired(subject))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _flush_expired(self, subject: str):
+        try:
+            await self.flush(subject)
+        except Exception as e:
+            self.logger.error(f"Failed to flush batch for subject {subject}: {e}")
@@ -0,0 +1,136 @@
+"""Payload codecs for EventBroker messages"""
+from abc import ABC, abstractmethod
+import json
+from typing import Any, Dict, Type
+
+
+Buffer = bytes | bytearray | memoryview
+
+
+class CodecError(Exception):
+    """
+    Raised when a payload can not be encoded or decoded.
+    """
+    pass
+
+
+class Codec(ABC):
+    """
+    Abstract base class for payload codecs.
+
+    A codec turns the data passed to `EventBroker.publish` into the bytes sent
+    over the broker and decodes received buffers back into Python objects.
+    """
+
+    name: str = ""
+
+    @abstractmethod
+    def encode(self, data: Any) -> bytes:
+        """_Encode data into a payload_
+
+        Args:
+            data (Any): _The data to encode_
+
+        Returns:
+            bytes: _The encoded payload_
+
+        Raises:
+            CodecError: _If the data contains values the codec can not represent_
+        """
+        pass
+
+    @abstractmethod
+    def decode(self, payload: Buffer) -> Any:
+        """_Decode a received payload_
+
+        Args:
+            payload (Buffer): _The received buffer_
+
+        Returns:
+            Any: _The decoded data_
+
+        Raises:
+            CodecError: _If the payload is malformed_
+        """
+        pass
+
+
+class JsonCodec(Codec):
+    """
+    Compact JSON codec. This is the default codec.
+    """
+
+    name = "json"
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False)
+
+    def encode(self, data: Any) -> bytes:
+        try:
+            return self._encoder.encode(data).encode()
+        except (TypeError, ValueError) as e:
+            raise CodecError(f"Failed to encode payload as JSON: {e}") from e
+
+    def decode(self, payload: Buffer) -> Any:
+        # json.loads accepts bytes directly, only memoryviews have to be copied
+        if isinstance(payload, memoryview):
+            payload = payload.tobytes()
+        try:
+            return json.loads(payload)
+        except (ValueError, UnicodeDecodeError) as e:
+            raise CodecError(f"Failed to decode JSON payload: {e}") from e
+
+
+class MsgpackCodec(Codec):
+    """
+    Compact binary codec based on MessagePack.
+
+    Requires the optional `msgpack` dependency.
+    """
+
+    name = "msgpack"
+
+    def __init__(self):
+        try:
+            import msgpack
+        except ImportError as e:
+            raise CodecError("The msgpack codec requires the 'msgpack' package to be installed") from e
+        self._packer = msgpack.Packer(use_bin_type=True)
+        self._unpackb = msgpack.unpackb
+        self._errors = (msgpack.UnpackException, ValueError)
+
+    def encode(self, data: Any) -> bytes:
+        try:
+            return self._packer.pack(data)
+        except (TypeError, ValueError, OverflowError) as e:
+            raise CodecError(f"Failed to encode payload as MessagePack: {e}") from e
+
+    def decode(self, payload: Buffer) -> Any:
+        try:
+            return self._unpackb(payload, raw=False)
+        except self._errors as e:
+            raise CodecError(f"Failed to decode MessagePack payload: {e}") from e
+
+
+CODECS: Dict[str, Type[Codec]] = {
+    JsonCodec.name: JsonCodec,
+    MsgpackCodec.name: MsgpackCodec,
+}
+
+
+def get_codec(name: str) -> Codec:
+    """_Create the codec registered under name_
+
+    Args:
+        name (str): _Name of the codec, e.g. json or msgpack_
+
+    Returns:
+        Codec: _The codec instance_
+
+    Raises:
+        CodecError: _If no codec is registered under name_
+    """
+    codec_class = CODECS.get(name)
+    if codec_class is None:
+        raise CodecError(f"Unknown codec {name}, available codecs: {', '.join(CODECS)}")
+    return codec_class()
@@ -1,56 +1,600 @@
 from abc import ABC, abstractmethod
-from typing import Any, List, Optional, Tuple
+import asyncio
+import time
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Literal, Optional, Set, Tuple
 from logging import Logger
 
 from pydantic import BaseModel
 
+from eventbroker.codec import Buffer, Codec, get_codec
+from eventbroker.handoff import HANDOFF, Handoff
+from eventbroker.lanes import Lane, LaneGate, lane_of
+from eventbroker.rpc import CORRELATION_ID, REPLY_TO, Requester
+from eventbroker import subjects
+from eventbroker.subscription import OverflowPolicy, Subscription, SubscriptionStats
+from eventbroker.transfer import ENCODING, TRANSFER, Frame, Transfers
+from state.ops import CHANGED
+
+if TYPE_CHECKING:
+    from eventbroker.recorder import Recorder
+
+_UNDECODED = object()
+
 class Message(ABC):
-    def __init__(self, message: Any):
+    def __init__(self, message: Any, codec: Codec):
         self._message = message
+        self._codec = codec
+        self._value = _UNDECODED
+        # Monotonic time the message was received, for dispatch latency metrics
+        self.received: float = time.monotonic()
 
     @abstractmethod
     def error(self) -> str | None:
         pass
 
     @abstractmethod
-    def value(self) -> Optional[str]:
+    def channel(self) -> str:
+        """_The channel the message was published to_"""
+        pass
+
+    @abstractmethod
+    def headers(self) -> Dict[str, str]:
+        """_Headers sent along with the message_"""
+        pass
+
+    @abstractmethod
+    def payload(self) -> Buffer:
+        """_The raw payload as received from the broker_"""
         pass
 
+    def value(self) -> Any:
+        """_The decoded payload_
+
+        The payload is decoded straight from the received buffer on first access,
+        later calls return the same object.
+
+        Raises:
+            CodecError: _If the payload can not be decoded_
+        """
+        if self._value is _UNDECODED:
+            self._value = self._codec.decode(self.payload())
+        return self._value
+
+class AssembledMessage(Message):
+    """_A message reassembled from chunks or decompressed, see `Transfers`_"""
+
+    def __init__(self, channel: str, headers: Dict[str, str], payload: bytes, codec: Codec, received: float):
+        super().__init__((channel, headers, payload), codec)
+        self.received = received
+
+    def error(self) -> str | None:
+        return None
+
+    def channel(self) -> str:
+        return self._message[0]
+
+    def headers(self) -> Dict[str, str]:
+        return self._message[1]
+
+    def payload(self) -> bytes:
+        return self._message[2]
+
+class HandoffMessage(Message):
+    """_A message whose payload is read from a shared-memory segment, see `Handoff`_
+
+    The payload is a read-only memoryview of the segment, the segment is
+    unmapped once the message and all views of its payload are released.
+    """
+
+    def __init__(self, channel: str, headers: Dict[str, str], payload: memoryview, codec: Codec, received: float):
+        super().__init__((channel, headers, payload), codec)
+        self.received = received
+
+    def error(self) -> str | None:
+        return None
+
+    def channel(self) -> str:
+        return self._message[0]
+
+    def headers(self) -> Dict[str, str]:
+        return self._message[1]
+
+    def payload(self) -> memoryview:
+        return self._message[2]
+
+class MergedMessage(Message):
+    """_A message combined from buffered messages by a subscription, encoded on demand_"""
+
+    def __init__(self, channel: str, headers: Dict[str, str], value: Any, codec: Codec, received: float):
+        super().__init__((channel, headers), codec)
+        self._value = value
+        self._payload: bytes | None = None
+        self.received = received
+
+    def error(self) -> str | None:
+        return None
+
+    def channel(self) -> str:
+        return self._message[0]
+
+    def headers(self) -> Dict[str, str]:
+        return self._message[1]
+
+    def payload(self) -> bytes:
+        if self._payload is None:
+            self._payload = self._codec.encode(self._value)
+        return self._payload
+
+def merge_telemetry(pending: Message, newer: Message) -> Optional[Message]:
+    """_Combine a buffered telemetry event with a newer one of the same node and path_
+
+    A complete tree supersedes everything buffered before it. Deltas must not
+    be lost, so a delta is appended to the buffered deltas, or to the buffered
+    tree expressed as a change of the whole tree. The combined event carries the
+    sequence of the newer one.
+
+    Args:
+        pending (Message): _The buffered message_
+        newer (Message): _The newly received message_
+
+    Returns:
+        Optional[Message]: _The combined message, None if the messages are no telemetry events_
+    """
+    try:
+        older, update = pending.value(), newer.value()
+    except Exception:
+        return None
+    if not isinstance(older, dict) or not isinstance(update, dict):
+        return None
+    if update.get("type") == "telemetry":
+        return newer
+    if update.get("type") != "telemetry delta":
+        return None
+    if older.get("type") == "telemetry":
+        deltas = [{"op": CHANGED, "path": [], "value": older.get("tree")}]
+    elif older.get("type") == "telemetry delta":
+        deltas = list(older.get("deltas") or ())
+    else:
+        return None
+    return MergedMessage(
+        newer.channel(),
+        newer.headers(),
+        {**update, "deltas": deltas + list(update.get("deltas") or ())},
+        newer._codec,
+        pending.received,
+    )
+
 class EventBrokerConfig(BaseModel):
     """_ABC for a configuration for an EventBroker_
 
     Inherits from Pydantic BaseModel for easy validation and parsing.
     Override this class to add specific configuration parameters for different EventBroker implementations.
 
+    Attributes:
+        codec (str): codec used for message payloads, json or msgpack. Defaults to json.
+        batch_window (float): time window in milliseconds outgoing messages are batched for, 0 disables batching.
+        batch_max_bytes (int): byte budget per subject after which a batch is flushed early.
+        subscription_buffer (int): maximum number of received messages buffered per subscription.
+        subscription_buffer_bytes (int): maximum payload bytes buffered per subscription, 0 for no limit.
+        overflow (OverflowPolicy): what a full control subscription does with further messages:
+            block the broker, drop the oldest messages or coalesce messages by subject.
+        telemetry_overflow (OverflowPolicy): what a full telemetry subscription does with further messages.
+        slow_consumer_after (float): seconds a subscription has to stay full to be reported as slow consumer.
+        compress_threshold (int): payload size in bytes from which on payloads are compressed, 0 disables compression.
+        compression_level (int): zlib compression level, 1 is fastest.
+        chunk_size (int): maximum size of a sent payload in bytes, larger payloads are split into chunks. 0 disables chunking.
+        transfer_timeout (float): seconds the chunks of a payload may take to arrive.
+        transfer_buffer_bytes (int): maximum bytes of chunks buffered for incomplete payloads.
+        handoff_threshold (int): payload size in bytes from which on payloads are handed off through shared memory
+            instead of being sent over the broker, 0 disables the handoff. Only for controllers on the same host.
+        handoff_lease (float): seconds a handed off payload stays available for receivers to attach to.
     """
-    pass
+    codec: Literal["json", "msgpack"] = "json"
+    batch_window: float = 0
+    batch_max_bytes: int = 64 * 1024
+    subscription_buffer: int = 1024
+    subscription_buffer_bytes: int = 16 * 1024 * 1024
+    overflow: OverflowPolicy = "block"
+    telemetry_overflow: OverflowPolicy = "coalesce"
+    slow_consumer_after: float = 5.0
+    compress_threshold: int = 64 * 1024
+    compression_level: int = 1
+    chunk_size: int = 512 * 1024
+    transfer_timeout: float = 30.0
+    transfer_buffer_bytes: int = 256 * 1024 * 1024
+    handoff_threshold: int = 0
+    handoff_lease: float = 30.0
+
+MessageHandler = Callable[[Message], Awaitable[None]]
+
+
+def subscription_key(channel: str, group_id: str | None = None) -> str:
+    """_Key of a subscription, a channel can be subscribed once per group_"""
+    return channel if group_id is None else f"{channel}|{group_id}"
 
 class EventBroker(ABC):
 
-    async def __init__(self, config: EventBrokerConfig, channels: List[str], logger: Logger):
-        pass
+    def __init__(self, config: EventBrokerConfig, channels: List[str], logger: Logger):
+        self.logger: Logger = logger
+        self.codec: Codec = get_codec(config.codec)
+        self.subscription_buffer: int = config.subscription_buffer
+        self.subscription_buffer_bytes: int = config.subscription_buffer_bytes
+        self.overflow: OverflowPolicy = config.overflow
+        self.telemetry_overflow: OverflowPolicy = config.telemetry_overflow
+        self.slow_consumer_after: float = config.slow_consumer_after
+        self.transfers: Transfers = Transfers(
+            config.compress_threshold,
+            config.compression_level,
+            config.chunk_size,
+            config.transfer_timeout,
+            config.transfer_buffer_bytes,
+            logger,
+        )
+        self.handoff: Handoff = Handoff(config.handoff_threshold, config.handoff_lease, logger)
+        # Smallest payload that is not published as it is, see `frames`
+        self.large_payload: int = min(self.transfers.threshold, self.handoff.threshold)
+        # Channels subscribed in queue groups by any broker, payloads published to them are never chunked
+        self.grouped: Set[str] = set()
+        self.subscribers: Dict[str, Subscription] = dict()
+        # Keys of the subscriptions already reported as slow consumers
+        self._slow: Set[str] = set()
+        self.listeners: Set[asyncio.Task] = set()
+        # Listener task and handlers by subscription key
+        self._listeners: Dict[str, Tuple[asyncio.Task, List[MessageHandler]]] = dict()
+        self.lanes: LaneGate = LaneGate()
+        # Records published messages if set, see `eventbroker.recorder`
+        self.recorder: Optional["Recorder"] = None
+        self._requester: Requester | None = None
+        self._requester_lock: asyncio.Lock = asyncio.Lock()
 
     @abstractmethod
-    async def publish(self, channel: str, data: Any):
+    async def publish(self, channel: str, data: Any, key: str | None = None, headers: Dict[str, str] | None = None):
+        """_Publish data to channel_
+
+        If batching is enabled the message is buffered and sent together with
+        other messages for the same channel. Messages with headers are always
+        sent immediately.
+
+        Args:
+            channel (str): _The channel to publish to_
+            data (Any): _The data to publish, encoded with the configured codec_
+            key (str | None, optional): _Coalescing key. With batching enabled only the
+                newest message per key and channel is sent within a window_. Defaults to None.
+            headers (Dict[str, str] | None, optional): _Headers sent along with the message_. Defaults to None.
+
+        Raises:
+            CodecError: _If data can not be encoded_
+        """
         pass
 
     @abstractmethod
-    async def poll(self, consumer: Any, timeout: float) -> Optional[Message]:
+    async def publish_payload(
+        self, channel: str, payload: bytes, key: str | None = None, headers: Dict[str, str] | None = None
+    ):
+        """_Publish an already encoded payload to channel, e.g. a recorded message_
+
+        Args:
+            channel (str): _The channel to publish to_
+            payload (bytes): _The payload, encoded with the configured codec_
+            key (str | None, optional): _Coalescing key, see `publish`_. Defaults to None.
+            headers (Dict[str, str] | None, optional): _Headers sent along with the message_. Defaults to None.
+        """
         pass
 
+    def receive(self, message: Message, subscription: str) -> Optional[Message]:
+        """_Pass a received message through the transfer layer before it is buffered_
+
+        Messages without transfer headers are returned as they are. Compressed
+        payloads are decompressed, chunks are buffered until their payload is
+        complete and verified, see `Transfers`.
+
+        Args:
+            message (Message): _The received message_
+            subscription (str): _Key of the subscription that received the message_
+
+        Returns:
+            Optional[Message]: _The message to buffer, None while chunks are missing or if it was dropped_
+        """
+        headers = message.headers()
+        if not headers:
+            return message
+        if HANDOFF in headers:
+            attached = self.handoff.read(message.channel(), headers)
+            if attached is None:
+                return None
+            headers, payload = attached
+            handed_off = HandoffMessage(message.channel(), headers, payload, self.codec, message.received)
+            self.handoff.track(handed_off)
+            return handed_off
+        if ENCODING not in headers and TRANSFER not in headers:
+            return message
+        received = self.transfers.receive(subscription, message.channel(), headers, bytes(message.payload()), message.received)
+        if received is None:
+            return None
+        headers, payload, started = received
+        return AssembledMessage(message.channel(), headers, payload, self.codec, started)
+
+    def frames(self, channel: str, payload: bytes, headers: Dict[str, str] | None) -> List[Frame]:
+        """_Frames to publish for a payload of at least `large_payload` bytes_
+
+        Payloads of at least the handoff threshold are written to shared memory
+        and only their handle is published, other payloads are compressed and
+        chunked, see `Handoff` and `Transfers`.
+
+        A queue group delivers every frame to one of its members, so the chunks
+        of a payload would be spread over the members. Payloads for channels
+        subscribed in queue groups, see `is_grouped`, are therefore compressed
+        or handed off but never chunked. Above `chunk_size` they are sent whole
+        and are subject to the message size limit of the broker.
+
+        Args:
+            channel (str): _The channel the payload is published to_
+            payload (bytes): _The encoded payload_
+            headers (Dict[str, str] | None): _Headers of the message_
+
+        Returns:
+            List[Frame]: _Payload and headers of every frame in order_
+        """
+        if len(payload) >= self.handoff.threshold:
+            return [(b"", self.handoff.write(payload, headers))]
+        if not self.is_grouped(channel):
+            return self.transfers.frames(payload, headers)
+        frames = self.transfers.frames(payload, headers, chunk=False)
+        if 0 < self.transfers.chunk_size < len(frames[0][0]):
+            self.logger.warning(
+                f"Publishing {len(frames[0][0])} bytes unchunked to channel {channel}, which is subscribed in a queue group"
+            )
+        return frames
+
+    def is_grouped(self, channel: str) -> bool:
+        """_Whether channel is subscribed in a queue group_
+
+        Args:
+            channel (str): _The channel_
+
+        Returns:
+            bool: _True if the channel was declared in `grouped` or is listened to in a group by this broker_
+        """
+        return channel in self.grouped
+
+    def transfer_stats(self) -> Dict[str, Any]:
+        """_Counters of compressed, chunked and handed off transfers_"""
+        return {**self.transfers.stats.to_dict(), "handoff": self.handoff.stats.to_dict()}
+
+    def record(self, channel: str, payload: bytes, headers: Dict[str, str] | None):
+        """_Pass a published message to the recorder, if recording_"""
+        if self.recorder is not None:
+            self.recorder.append(channel, headers, payload)
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    async def poll(self, consumer: Subscription, timeout: float) -> Optional[Message]:
+        """_Wait for the next message of a subscription_
+
+        Compatibility layer on top of the push-based subscriptions, new code
+        should iterate the subscription or use `listen`.
+
+        Args:
+            consumer (Subscription): _The subscription returned by `subscribe`_
+            timeout (float): _Seconds to wait_
+
+        Returns:
+            Optional[Message]: _The next message or None on timeout_
+        """
+        return await consumer.get(timeout)
+
     @abstractmethod
-    async def subscribe(self, channel: str, group_id: str | None = None) -> Tuple[Any, str]:
+    async def subscribe(self, channel: str, group_id: str | None = None) -> Tuple[Subscription, str]:
         """_Subscribe to channel_
 
+        Received messages are pushed into the returned subscription, which buffers
+        up to `subscription_buffer` messages. Use `new_subscription` to create it
+        with the configured limits and overflow policy.
+
+        Subscriptions with the same group_id form a queue group: every message
+        is delivered to one member of the group only, across all processes and
+        hosts. This spreads the workload of a channel over several consumers.
+
         Args:
-            channel (str): _description_
-            group_id (str | None, optional): _description_. Defaults to None.
+            channel (str): _The channel to subscribe to_
+            group_id (str | None, optional): _Consumer group of the subscription_. Defaults to None.
 
         Returns:
-            Tuple[Any, str]: _Broker defined Subscription and the corresponding channel_
+            Tuple[Subscription, str]: _The subscription and its key for `close_consumer`_
         """
         pass
 
+    def new_subscription(self, channel: str, handle: Any = None) -> Subscription:
+        """_Create a subscription with the configured limits_
+
+        Telemetry subscriptions use the telemetry overflow policy and coalesce
+        by combining telemetry events, all others use the general policy.
+
+        Args:
+            channel (str): _The subscribed channel_
+            handle (Any, optional): _Broker specific subscription handle_. Defaults to None.
+
+        Returns:
+            Subscription: _The subscription_
+        """
+        telemetry: bool = subjects.is_telemetry(channel)
+        return Subscription(
+            channel,
+            self.subscription_buffer,
+            handle,
+            self.telemetry_overflow if telemetry else self.overflow,
+            self.subscription_buffer_bytes,
+            merge_telemetry if telemetry else None,
+        )
+
+    def slow_consumers(self) -> Dict[str, SubscriptionStats]:
+        """_Subscriptions that became slow consumers since the last call_
+
+        A subscription is a slow consumer once its buffer stayed full for
+        `slow_consumer_after` seconds. It is returned once, and again only after
+        it recovered in between.
+
+        Returns:
+            Dict[str, SubscriptionStats]: _Counters of the slow subscriptions by subscription key_
+        """
+        slow: Dict[str, SubscriptionStats] = dict()
+        for key, subscription in self.subscribers.items():
+            if subscription.full_for() < self.slow_consumer_after:
+                self._slow.discard(key)
+            elif key not in self._slow:
+                self._slow.add(key)
+                slow[key] = subscription.stats()
+        self._slow.intersection_update(self.subscribers.keys())
+        return slow
+
+    async def listen(
+        self, channel: str, handler: MessageHandler, group_id: str | None = None, lane: Lane | None = None
+    ) -> asyncio.Task:
+        """_Handle all messages of channel with handler_
+
+        Subscribes to channel and dispatches every received message to handler
+        in a background task, so a controller can serve many channels
+        concurrently. Exceptions raised by handler are logged and do not stop
+        the listener. Listeners are cancelled when the broker is closed.
+
+        Listeners are dispatched in priority lanes, see `LaneGate`: telemetry
+        waits while control messages are ready to be handled, so a telemetry
+        burst does not delay control messages.
+
+        Several controllers can share a broker. Listening again on a channel
+        adds handler to the existing listener, every message is passed to all
+        handlers of the channel in the order they were added.
+
+        Args:
+            channel (str): _The channel to subscribe to_
+            handler (MessageHandler): _Coroutine function called for every message_
+            group_id (str | None, optional): _Consumer group of the subscription_. Defaults to None.
+            lane (Lane | None, optional): _Priority lane, derived from channel if None_. Defaults to None.
+
+        Returns:
+            asyncio.Task: _The listener task, shared by all handlers of the channel_
+        """
+        key = subscription_key(channel, group_id)
+        if group_id is not None:
+            self.grouped.add(channel)
+        listener = self._listeners.get(key)
+        if listener is not None and not listener[0].done():
+            listener[1].append(handler)
+            return listener[0]
+
+        subscription, _ = await self.subscribe(channel, group_id)
+        handlers: List[MessageHandler] = [handler]
+        message_lane: Lane = lane or lane_of(channel)
+        self.lanes.add(message_lane, subscription)
+
+        async def dispatch():
+            async for message in subscription:
+                await self.lanes.wait_turn(message_lane)
+                started = self.lanes.started(message_lane, subscription, message.received)
+                try:
+                    for handler in handlers:
+                        try:
+                            await handler(message)
+                        except Exception as e:
+                            self.logger.error(f"Handler for channel {channel} failed: {e}")
+                finally:
+                    self.lanes.finished(message_lane, subscription, started)
+
+        task = asyncio.get_running_loop().create_task(dispatch(), name=f"listener {channel}")
+        self.listeners.add(task)
+        self._listeners[key] = (task, handlers)
+
+        def done(task: asyncio.Task):
+            self.lanes.remove(message_lane, subscription)
+            self.listeners.discard(task)
+            if self._listeners.get(key, (None,))[0] is task:
+                del self._listeners[key]
+
+        task.add_done_callback(done)
+        return task
+
+    async def unlisten(self, channel: str, handler: MessageHandler, group_id: str | None = None):
+        """_Stop passing messages of channel to handler_
+
+        The subscription is closed when the last handler of the channel is
+        removed, e.g. when a controller hands a sibling over to another worker.
+
+        Args:
+            channel (str): _The channel passed to `listen`_
+            handler (MessageHandler): _The handler passed to `listen`_
+            group_id (str | None, optional): _The group passed to `listen`_. Defaults to None.
+        """
+        key = subscription_key(channel, group_id)
+        listener = self._listeners.get(key)
+        if listener is None:
+            return
+        task, handlers = listener
+        if handler in handlers:
+            handlers.remove(handler)
+        if handlers:
+            return
+        del self._listeners[key]
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await self.close_consumer(key)
+
+    def lane_metrics(self) -> Dict[str, Dict[str, Any]]:
+        """_Dispatch latency, handler duration and backlog of every priority lane_"""
+        return self.lanes.snapshot()
+
+    async def request(self, channel: str, data: Any, timeout: float) -> Message:
+        """_Send a request to channel and wait for the reply_
+
+        Requests carry a correlation ID and the inbox of this broker, the
+        receiver answers with `reply`. Many requests can be in flight
+        concurrently over the same inbox subscription.
+
+        Args:
+            channel (str): _The channel to send the request to_
+            data (Any): _The request_
+            timeout (float): _Seconds to wait for the reply_
+
+        Returns:
+            Message: _The reply_
+
+        Raises:
+            TimeoutError: _If no reply arrives within timeout_
+        """
+        async with self._requester_lock:
+            if self._requester is None:
+                requester = Requester(self, self.logger)
+                await requester.start()
+                self._requester = requester
+        return await self._requester.request(channel, data, timeout)
+
+    async def reply(self, request: Message, data: Any) -> bool:
+        """_Answer a request received through `request`_
+
+        Args:
+            request (Message): _The request message_
+            data (Any): _The reply_
+
+        Returns:
+            bool: _False if the message was not sent as a request_
+        """
+        headers = request.headers()
+        reply_to = headers.get(REPLY_TO)
+        correlation_id = headers.get(CORRELATION_ID)
+        if reply_to is None or correlation_id is None:
+            self.logger.warning(f"Unable to reply to message on channel {request.channel()}: not a request")
+            return False
+        await self.publish(reply_to, data, headers={CORRELATION_ID: correlation_id})
+        return True
+
+    async def stop_listeners(self):
+        """_Cancel all listener tasks started by `listen`_"""
+        for task in list(self.listeners):
+            task.cancel()
+        await asyncio.gather(*self.listeners, return_exceptions=True)
+
     @abstractmethod
     async def get_sibling_channels(self) -> List[str]:
         pass
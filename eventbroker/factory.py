@@ -0,0 +1,45 @@
+from logging import Logger
+import os
+from typing import List
+
+from config.settings import Settings
+from eventbroker.eventbroker import EventBroker
+
+
+async def create_broker(
+    config: Settings, channels: List[str], logger: Logger, name: str | None = None
+) -> EventBroker | None:
+    """_Create the EventBroker selected in the settings_
+
+    Brokers are imported lazily, so only the dependencies of the selected
+    broker have to be installed. If recording is configured, the broker
+    records what it publishes to `<recorder path>/<name>.log`.
+
+    Args:
+        config (Settings): _The settings_
+        channels (List[str]): _Channels known to the controller_
+        logger (Logger): _The logger_
+        name (str | None, optional): _Name of the recording, no recording if None_. Defaults to None.
+
+    Returns:
+        EventBroker | None: _The connected broker, None if no broker is configured_
+    """
+    broker: EventBroker | None = None
+    if config.nats is not None:
+        from eventbroker.nats import NatsClient
+        broker = await NatsClient.create(config.nats, channels, logger)
+    elif config.shm is not None:
+        from eventbroker.shm import ShmClient
+        broker = await ShmClient.create(config.shm, channels, logger)
+    if broker is not None and config.recorder is not None and name is not None:
+        from eventbroker.recorder import LOG_SUFFIX, Recorder
+        os.makedirs(config.recorder.path, exist_ok=True)
+        broker.recorder = Recorder(
+            os.path.join(config.recorder.path, name + LOG_SUFFIX),
+            logger,
+            config.recorder.channels,
+            config.recorder.queue_size,
+            config.recorder.chunk_size,
+        )
+        logger.info(f"Recording published messages to {broker.recorder.path}")
+    return broker
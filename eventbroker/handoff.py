@@ -0,0 +1,252 @@
+"""Shared-memory handoff of large payloads between EventBroker clients on the same host"""
+import asyncio
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from itertools import count
+from logging import Logger
+import mmap
+from multiprocessing.shared_memory import SharedMemory
+import os
+import struct
+import time
+from typing import Any, Dict, Optional, Tuple
+import weakref
+
+
+HANDOFF: str = "Digsinet-Handoff"
+# Directory POSIX shared memory segments are mapped from by receivers and reaped in
+SEGMENT_DIRECTORY: str = "/dev/shm"
+SEGMENT_PREFIX: str = "dsn-"
+
+# magic, version, owner pid, payload length
+_HEADER = struct.Struct("<IIQQ")
+_HEADER_SIZE = 32
+_MAGIC = 0x44534E48  # "DSNH"
+
+
+@dataclass
+class HandoffStats:
+    """
+    Counters of the shared-memory handoffs of a broker.
+
+    Attributes:
+        written (int): number of payloads written to segments
+        written_bytes (int): bytes of the payloads written to segments
+        owned (int): number of written segments still linked, i.e. within their lease
+        read (int): number of received handles whose payload was attached
+        read_bytes (int): bytes of the attached payloads
+        attached (int): number of attached segments not yet released
+        missed (int): number of received handles whose segment was gone or did not match
+        reaped (int): number of segments of crashed owners removed
+    """
+
+    written: int = 0
+    written_bytes: int = 0
+    owned: int = 0
+    read: int = 0
+    read_bytes: int = 0
+    attached: int = 0
+    missed: int = 0
+    reaped: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def _owner_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _release(stats: HandoffStats):
+    stats.attached -= 1
+
+
+class Handoff:
+    """
+    Hands large payloads to receivers on the same host through shared memory.
+
+    A payload of at least `threshold` bytes is written once into a new
+    `multiprocessing.shared_memory` segment, and only a handle with the name
+    of the segment, the offset and length of the payload and a version is
+    published. Receivers map the segment read-only and read the payload
+    through a memoryview, without copying it.
+
+    The memory of a segment is reference counted by the kernel: the name of
+    the segment holds one reference for the owner, every mapping of a
+    receiver another one. The owner unlinks the name once the `lease` is
+    over, by which time receivers have attached to it, and the memory is
+    freed as soon as the last receiver released its message, or exited or
+    crashed. Names of segments whose owner crashed are reaped by the next
+    client that starts or lets a lease expire on the host.
+
+    Receivers map segments from `SEGMENT_DIRECTORY` directly, rather than
+    through `SharedMemory`, which would register every attached segment with
+    the resource tracker of the receiver and unlink it once that exits.
+
+    A receiver on another host can not attach to the segment and drops the
+    message, so the handoff must only be enabled if all controllers share a
+    host.
+
+    Attributes:
+        threshold (int): payload size from which on payloads are handed off, 0 disables the handoff
+        lease (float): seconds a written segment stays attachable
+        stats (HandoffStats): counters of written and attached segments
+    """
+
+    def __init__(self, threshold: int, lease: float, logger: Logger):
+        self.threshold: int = threshold if threshold > 0 else 1 << 62
+        self.lease: float = lease
+        self.logger: Logger = logger
+        self.stats: HandoffStats = HandoffStats()
+        self._pid: int = os.getpid()
+        self._versions: count = count(1)
+        # Written segments by name, ordered by their expiry
+        self._owned: "OrderedDict[str, Tuple[SharedMemory, float]]" = OrderedDict()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.reap()
+
+    def write(self, payload: bytes, headers: Dict[str, str] | None) -> Dict[str, str]:
+        """_Write a payload into a new segment_
+
+        Args:
+            payload (bytes): _The encoded payload_
+            headers (Dict[str, str] | None): _Headers of the message_
+
+        Returns:
+            Dict[str, str]: _Headers of the message with the handle of the segment, to publish with an empty payload_
+        """
+        version = next(self._versions)
+        name = f"{SEGMENT_PREFIX}{self._pid}-{version}"
+        segment = SharedMemory(name, create=True, size=_HEADER_SIZE + len(payload))
+        _HEADER.pack_into(segment.buf, 0, _MAGIC, version, self._pid, len(payload))
+        segment.buf[_HEADER_SIZE:_HEADER_SIZE + len(payload)] = payload
+        self._owned[name] = (segment, time.monotonic() + self.lease)
+        self.stats.written += 1
+        self.stats.written_bytes += len(payload)
+        self.stats.owned = len(self._owned)
+        self._schedule()
+        return {**(headers or dict()), HANDOFF: f"{name}:{_HEADER_SIZE}:{len(payload)}:{version}"}
+
+    def read(self, channel: str, headers: Dict[str, str]) -> Optional[Tuple[Dict[str, str], memoryview]]:
+        """_Attach to the segment of a received handle_
+
+        Args:
+            channel (str): _The channel the handle was received on_
+            headers (Dict[str, str]): _Headers of the received message, including the handle_
+
+        Returns:
+            Optional[Tuple[Dict[str, str], memoryview]]: _Headers without the handle and a read-only view of
+                the payload in the segment, None if the segment is gone or does not match the handle_
+        """
+        handle = headers[HANDOFF]
+        try:
+            name, offset, length, version = handle.rsplit(":", 3)
+            offset, length, version = int(offset), int(length), int(version)
+            if not name.startswith(SEGMENT_PREFIX) or os.sep in name:
+                raise ValueError(name)
+        except ValueError:
+            self.stats.missed += 1
+            self.logger.error(f"Dropping message on channel {channel}: malformed handoff handle {handle}")
+            return None
+        try:
+            fd = os.open(os.path.join(SEGMENT_DIRECTORY, name), os.O_RDONLY)
+            try:
+                mapping = mmap.mmap(fd, 0, prot=mmap.PROT_READ)
+            finally:
+                os.close(fd)
+        except (OSError, ValueError) as e:
+            self.stats.missed += 1
+            self.logger.error(
+                f"Dropping message on channel {channel}: segment {name} is not available ({e}), "
+                "either its lease expired or the publisher runs on another host"
+            )
+            return None
+        magic, written_version, _, written_length = _HEADER.unpack_from(mapping, 0)
+        if magic != _MAGIC or written_version != version or written_length != length or offset + length > len(mapping):
+            mapping.close()
+            self.stats.missed += 1
+            self.logger.error(f"Dropping message on channel {channel}: segment {name} does not match handle {handle}")
+            return None
+        self.stats.read += 1
+        self.stats.read_bytes += length
+        self.stats.attached += 1
+        # The mapping stays open as long as a view of it is referenced
+        return {key: value for key, value in headers.items() if key != HANDOFF}, memoryview(mapping)[offset:offset + length]
+
+    def track(self, message: Any):
+        """_Count a message reading from a segment as attached until it is garbage collected_"""
+        weakref.finalize(message, _release, self.stats)
+
+    def _schedule(self):
+        if self._timer is not None or not self._owned:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        _, expires = next(iter(self._owned.values()))
+        self._timer = loop.call_at(loop.time() + max(0.0, expires - time.monotonic()), self._expire)
+
+    def _expire(self):
+        self._timer = None
+        now = time.monotonic()
+        while self._owned:
+            name, (_, expires) = next(iter(self._owned.items()))
+            if expires > now:
+                break
+            self._unlink(name)
+        self.reap()
+        self._schedule()
+
+    def _unlink(self, name: str):
+        segment, _ = self._owned.pop(name)
+        self.stats.owned = len(self._owned)
+        try:
+            segment.close()
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+
+    def reap(self) -> int:
+        """_Unlink the segments of owners that are no longer running_
+
+        Returns:
+            int: _Number of reaped segments_
+        """
+        try:
+            names = os.listdir(SEGMENT_DIRECTORY)
+        except OSError:
+            return 0
+        reaped = 0
+        for name in names:
+            if not name.startswith(SEGMENT_PREFIX):
+                continue
+            try:
+                pid = int(name[len(SEGMENT_PREFIX):].split("-", 1)[0])
+            except ValueError:
+                continue
+            if pid == self._pid or _owner_alive(pid):
+                continue
+            try:
+                os.unlink(os.path.join(SEGMENT_DIRECTORY, name))
+                reaped += 1
+            except FileNotFoundError:
+                pass
+        if reaped:
+            self.stats.reaped += reaped
+            self.logger.warning(f"Reaped {reaped} shared-memory handoff segments of crashed controllers")
+        return reaped
+
+    def close(self):
+        """_Unlink all written segments, receivers that attached to them keep their payloads_"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for name in list(self._owned):
+            self._unlink(name)
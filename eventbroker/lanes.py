@@ -0,0 +1,135 @@
+"""Priority lanes for dispatching received messages"""
+import asyncio
+from dataclasses import asdict, dataclass
+import time
+from typing import Any, Dict, Literal, Set, Tuple
+
+from eventbroker import subjects
+from eventbroker.subscription import Subscription
+
+
+Lane = Literal["control", "telemetry"]
+CONTROL_LANE: Lane = "control"
+TELEMETRY_LANE: Lane = "telemetry"
+# Highest priority first
+LANES: Tuple[Lane, ...] = (CONTROL_LANE, TELEMETRY_LANE)
+
+
+def lane_of(channel: str) -> Lane:
+    """_Lane of a channel: telemetry subjects are bulk traffic, everything else is control traffic_"""
+    return TELEMETRY_LANE if subjects.is_telemetry(channel) else CONTROL_LANE
+
+
+@dataclass
+class LaneMetrics:
+    """
+    Dispatch statistics of a lane.
+
+    Latency is the time from receiving a message until its handlers start, it
+    includes the time spent in the subscription buffer and waiting for
+    higher priority lanes.
+
+    Attributes:
+        subscriptions (int): number of subscriptions dispatched in the lane
+        handled (int): number of messages passed to the handlers
+        pending (int): number of messages buffered in the subscriptions of the lane
+        yields (int): number of times the lane waited for a higher priority lane
+        last_latency (float): latency of the last message in seconds
+        mean_latency (float): mean latency in seconds
+        max_latency (float): largest latency in seconds
+        mean_duration (float): mean time the handlers of a message took in seconds
+        max_duration (float): longest time the handlers of a message took in seconds
+    """
+
+    subscriptions: int = 0
+    handled: int = 0
+    pending: int = 0
+    yields: int = 0
+    last_latency: float = 0.0
+    mean_latency: float = 0.0
+    max_latency: float = 0.0
+    mean_duration: float = 0.0
+    max_duration: float = 0.0
+
+    def record_latency(self, latency: float):
+        self.handled += 1
+        self.last_latency = latency
+        self.mean_latency += (latency - self.mean_latency) / self.handled
+        self.max_latency = max(self.max_latency, latency)
+
+    def record_duration(self, duration: float):
+        self.mean_duration += (duration - self.mean_duration) / max(1, self.handled)
+        self.max_duration = max(self.max_duration, duration)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class LaneGate:
+    """
+    Orders the dispatch of received messages by lane priority.
+
+    Every listener dispatches its subscription in its own task. Before a
+    listener of a lower priority lane hands a message to its handlers, it waits
+    while a listener of a higher priority lane has messages queued and is ready
+    to handle them. A control message is therefore always handled before
+    queued telemetry, no matter how much telemetry is buffered. A listener busy
+    with a long-running handler, e.g. building a sibling, does not hold up the
+    lower lanes, waiting would not get its queued messages handled sooner.
+
+    Attributes:
+        metrics (Dict[Lane, LaneMetrics]): dispatch statistics by lane
+    """
+
+    def __init__(self):
+        self.metrics: Dict[Lane, LaneMetrics] = {lane: LaneMetrics() for lane in LANES}
+        self._subscriptions: Dict[Lane, Set[Subscription]] = {lane: set() for lane in LANES}
+        # Subscriptions whose listener is running handlers
+        self._busy: Set[Subscription] = set()
+        self._changed: asyncio.Event = asyncio.Event()
+
+    def add(self, lane: Lane, subscription: Subscription):
+        self._subscriptions[lane].add(subscription)
+
+    def remove(self, lane: Lane, subscription: Subscription):
+        self._subscriptions[lane].discard(subscription)
+        self._busy.discard(subscription)
+        self._changed.set()
+
+    def _blocked(self, lane: Lane) -> bool:
+        for higher in LANES[:LANES.index(lane)]:
+            for subscription in self._subscriptions[higher]:
+                if subscription.pending() and subscription not in self._busy:
+                    return True
+        return False
+
+    async def wait_turn(self, lane: Lane):
+        """_Wait until no higher priority lane has messages ready to be handled_"""
+        if lane == LANES[0] or not self._blocked(lane):
+            return
+        self.metrics[lane].yields += 1
+        while self._blocked(lane):
+            self._changed.clear()
+            await self._changed.wait()
+
+    def started(self, lane: Lane, subscription: Subscription, received: float) -> float:
+        """_Record that the handlers of a message start, returns the start time_"""
+        now = time.monotonic()
+        self.metrics[lane].record_latency(now - received)
+        self._busy.add(subscription)
+        # The message left the buffer of the subscription
+        self._changed.set()
+        return now
+
+    def finished(self, lane: Lane, subscription: Subscription, started: float):
+        """_Record that the handlers of a message finished_"""
+        self.metrics[lane].record_duration(time.monotonic() - started)
+        self._busy.discard(subscription)
+        self._changed.set()
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """_Metrics of all lanes with the current number of subscriptions and pending messages_"""
+        for lane, subscriptions in self._subscriptions.items():
+            self.metrics[lane].subscriptions = len(subscriptions)
+            self.metrics[lane].pending = sum(subscription.pending() for subscription in subscriptions)
+        return {lane: metrics.to_dict() for lane, metrics in self.metrics.items()}
@@ -3,16 +3,19 @@
 from logging import Logger
 from typing import Dict, List, Any, Optional, Tuple
 from config.nats import NatsSettings
-from eventbroker.eventbroker import EventBroker, Message
+from eventbroker.batching import PublishBatcher
+from eventbroker.codec import Codec
+from eventbroker.eventbroker import EventBroker, Message, subscription_key
+from eventbroker.lanes import TELEMETRY_LANE, lane_of
+from eventbroker import subjects
+from eventbroker.subscription import Subscription
 from nats.aio.msg import Msg as NatsMsg
-from nats.aio.subscription import Subscription as NatsSubscription
 from nats.aio.client import Client
-import json
 import nats
 
 class NatsMessage(Message):
-    def __init__(self, message: NatsMsg):
-        self._message = message
+    def __init__(self, message: NatsMsg, codec: Codec):
+        super().__init__(message, codec)
 
     def error(self) -> str | None:
         if self._message:
@@ -20,70 +23,132 @@ class NatsMessage(Message):
         else:
             return "NATS Message Error"
 
-    def value(self) -> str | None:
-        return self._message.data.decode() # Defaults to UTF-8
+    def channel(self) -> str:
+        return self._message.subject
+
+    def headers(self) -> Dict[str, str]:
+        return self._message.headers or dict()
+
+    def payload(self) -> bytes:
+        return self._message.data
     
 class NatsClient(EventBroker):
 
-    def __init__(self, nats_client: Client, config: NatsSettings, channels: List[str], logger: Logger):
+    def __init__(
+        self,
+        nats_client: Client,
+        config: NatsSettings,
+        channels: List[str],
+        logger: Logger,
+        telemetry_client: Optional[Client] = None,
+    ):
         super().__init__(config, channels, logger)
         self.config: NatsSettings = config
         self.subjects: List[str] = channels
         self.logger: Logger = logger
-        self.subscribers: Dict[str, NatsSubscription] = dict()
         self.client = nats_client
+        # Telemetry lane connection, the control connection is used for everything if None
+        self.telemetry_client: Optional[Client] = telemetry_client
+        self.batcher: PublishBatcher | None = None
+        if config.batch_window > 0:
+            self.batcher = PublishBatcher(self._publish_batch, config.batch_window / 1000, config.batch_max_bytes, logger)
 
     @classmethod # Define a classmethod because of pythons weird async logic
     async def create(cls, config: NatsSettings, channels: List[str], logger: Logger):
         client = await nats.connect(f"{config.host}:{config.port}")
-        return cls(client, config, channels, logger)
+        telemetry_client: Optional[Client] = None
+        if config.telemetry_connection:
+            telemetry_client = await nats.connect(f"{config.host}:{config.port}")
+        return cls(client, config, channels, logger, telemetry_client)
+
+    def _client(self, channel: str) -> Client:
+        """_Connection of the lane of channel_"""
+        if self.telemetry_client is not None and lane_of(channel) == TELEMETRY_LANE:
+            return self.telemetry_client
+        return self.client
 
-    async def publish(self, channel: str, data: Any):
-        if channel not in self.subjects:
+    async def publish(self, channel: str, data: Any, key: str | None = None, headers: Dict[str, str] | None = None):
+        if channel not in self.subjects and not subjects.is_dynamic(channel):
             self.logger.warning(f"NATS subject {channel} is an unknown subject")
-        serialized_data: str = json.dumps(data, default=lambda x: "<not serializable>")
-        self.logger.info(f"Publishing message to NATS subject {channel}: {serialized_data}")
-        await self.client.publish(channel, bytes(serialized_data, 'utf-8'))
-
-    async def poll(self, consumer: NatsSubscription, timeout: float) -> Optional[NatsMessage]:
-        try:
-            return NatsMessage(await consumer.next_msg(timeout=timeout))
-        except TimeoutError:
-            return None
-        except Exception as exception:
-            self.logger.error(f"Unhandled exception when polling for NATS subject {consumer.subject}: {exception}")
-            return None
-        
-    async def subscribe(self, channel: str, group_id: str | None = None) -> Tuple[Any, str]:
-        if channel not in self.subscribers.keys():
-            subscription: NatsSubscription = await self.client.subscribe(channel)
-            self.subscribers.update({channel: subscription})
+        await self.publish_payload(channel, self.codec.encode(data), key, headers)
+
+    async def publish_payload(self, channel: str, payload: bytes, key: str | None = None, headers: Dict[str, str] | None = None):
+        self.logger.debug(f"Publishing {len(payload)} bytes to NATS subject {channel}")
+        self.record(channel, payload, headers)
+        if self.batcher is not None and headers is None and len(payload) < self.large_payload:
+            await self.batcher.add(channel, payload, key)
+            return
+        if self.batcher is not None:
+            # Send the payloads buffered for the channel first, so a delta never arrives after a newer full tree
+            await self.batcher.flush(channel)
+        if len(payload) >= self.large_payload:
+            # Compressed, chunked and handed off frames carry headers and are never batched
+            client = self._client(channel)
+            for frame, frame_headers in self.frames(channel, payload, headers):
+                await client.publish(channel, frame, headers=frame_headers or None)
+        else:
+            await self._client(channel).publish(channel, payload, headers=headers)
+
+    async def _publish_batch(self, channel: str, payloads: List[bytes]):
+        # The client buffers consecutive publishes and writes them to the socket at once
+        client = self._client(channel)
+        for payload in payloads:
+            await client.publish(channel, payload)
+
+    async def subscribe(self, channel: str, group_id: str | None = None) -> Tuple[Subscription, str]:
+        key: str = subscription_key(channel, group_id)
+        if key not in self.subscribers.keys():
+            subscription: Subscription = self.new_subscription(channel)
+
+            async def deliver(message: NatsMsg):
+                received = self.receive(NatsMessage(message, self.codec), key)
+                if received is not None:
+                    await subscription.put(received)
+
+            # Members of a queue group share the messages, each one is delivered to one member only.
+            # While a blocking subscription is full, the client buffers up to the same limits and
+            # drops further messages as slow consumer, so memory stays bounded in any case.
+            limits: Dict[str, int] = {"pending_msgs_limit": self.subscription_buffer}
+            if self.subscription_buffer_bytes > 0:
+                limits["pending_bytes_limit"] = self.subscription_buffer_bytes
+            subscription.handle = await self._client(channel).subscribe(channel, queue=group_id or "", cb=deliver, **limits)
+            self.subscribers.update({key: subscription})
             self.logger.info(f"Subscribed to NATS subject {channel} in group {group_id}")
         else:
-            self.logger.warning(f"Tried to subscribe to NATS subject with active subscription: {channel}")
-        return self.subscribers[channel], channel
+            self.logger.warning(f"Tried to subscribe to NATS subject with active subscription: {key}")
+        return self.subscribers[key], key
 
     async def get_sibling_channels(self):
         return self.subjects
     
     async def close(self):
+        # Send buffered messages before anything is torn down
+        if self.batcher is not None:
+            await self.batcher.close()
+            self.logger.info(f"Flushed NATS publish batches ({self.batcher.flushed} batches, {self.batcher.coalesced} messages coalesced)")
+        await self.stop_listeners()
+        self.stop_recording()
+        self.handoff.close()
         # Unsubscribe from all subjects
-        for subject, subscriber in self.subscribers.items():
+        for subject in list(self.subscribers):
             await self.close_consumer(subject)
         self.logger.info("All NATS subscribers closed")
         # Delete all subjects
         del self.subjects
         self.logger.info("Deleted all NATS subjects")
         # Shut down client
-        await self.client.flush()
-        await self.client.close()
+        for client in (self.client, self.telemetry_client):
+            if client is not None:
+                await client.flush()
+                await client.close()
         self.logger.info("Closed NATS client")            
 
     async def close_consumer(self, consumer: str):
         if consumer in self.subscribers.keys():
-            await self.subscribers[consumer].unsubscribe()
+            subscription: Subscription = self.subscribers.pop(consumer)
+            await subscription.handle.unsubscribe()
+            subscription.close()
             self.logger.info(f"Subscriber for NATS subject {consumer} closed.")
-            # del self.subscribers[key]
         else:
             self.logger.warning(f"Unable to close subscriber for NATS subject {consumer}: Subscriber not found")
 
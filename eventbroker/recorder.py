@@ -0,0 +1,445 @@
+"""
+Recording and replay of EventBroker traffic.
+
+A recording is an append-only log of published messages plus an index, both
+memory-mapped files. Every controller records what it publishes into its own
+log, replaying merges the logs by timestamp.
+
+Usage:
+    python -m eventbroker.recorder info recordings/*.log
+    python -m eventbroker.recorder replay [--config digsinet.yml] [--speed 1] [--channel PATTERN] recordings/*.log
+"""
+from argparse import ArgumentParser, Namespace
+import asyncio
+from bisect import bisect_left
+from dataclasses import asdict, dataclass
+import heapq
+import json
+import logging
+from logging import Logger
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from eventbroker import subjects
+from eventbroker.shm import decode_headers, encode_headers
+
+if TYPE_CHECKING:
+    from eventbroker.eventbroker import EventBroker
+
+
+LOG_SUFFIX: str = ".log"
+INDEX_SUFFIX: str = ".idx"
+# magic, version, committed length in bytes
+_FILE_HEADER = struct.Struct("<4sIQ")
+_FILE_HEADER_SIZE = 64
+_LENGTH_OFFSET = 8
+_LENGTH = struct.Struct("<Q")
+_LOG_MAGIC = b"DSNL"
+_INDEX_MAGIC = b"DSNI"
+_VERSION = 1
+# timestamp in ns, subject length, headers length, payload length
+_RECORD = struct.Struct("<QHHI")
+# timestamp in ns, offset of the record in the log
+_INDEX_ENTRY = struct.Struct("<QQ")
+# Records the writer thread takes off the queue before committing
+_WRITE_BATCH = 1024
+_STOP = None
+
+
+class _AppendOnlyFile:
+    """
+    Memory-mapped file that grows by `chunk_size` bytes.
+
+    The header holds the committed length. A reader never sees data beyond it,
+    so a recording interrupted by a crash is readable up to the last commit.
+    """
+
+    def __init__(self, path: str, magic: bytes, chunk_size: int):
+        self.path: str = path
+        self.chunk_size: int = chunk_size
+        self.length: int = 0
+        self._fd: int = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        self._size: int = _FILE_HEADER_SIZE + chunk_size
+        os.ftruncate(self._fd, self._size)
+        self._buffer: mmap.mmap = mmap.mmap(self._fd, self._size)
+        _FILE_HEADER.pack_into(self._buffer, 0, magic, _VERSION, 0)
+
+    def reserve(self, size: int) -> int:
+        """_Make room for size bytes, returns the file offset to write them at_"""
+        offset = _FILE_HEADER_SIZE + self.length
+        if offset + size > self._size:
+            self._buffer.flush()
+            self._buffer.close()
+            self._size += max(self.chunk_size, size)
+            os.ftruncate(self._fd, self._size)
+            self._buffer = mmap.mmap(self._fd, self._size)
+        self.length += size
+        return offset
+
+    @property
+    def buffer(self) -> mmap.mmap:
+        return self._buffer
+
+    def commit(self):
+        _LENGTH.pack_into(self._buffer, _LENGTH_OFFSET, self.length)
+
+    def close(self):
+        self.commit()
+        self._buffer.flush()
+        self._buffer.close()
+        os.ftruncate(self._fd, _FILE_HEADER_SIZE + self.length)
+        os.close(self._fd)
+
+
+@dataclass
+class Record:
+    """
+    A recorded message.
+
+    Attributes:
+        timestamp (int): wall clock time of the publish in nanoseconds
+        channel (str): the channel the message was published to
+        headers (Dict[str, str]): headers sent along with the message
+        payload (bytes): the encoded payload
+    """
+
+    timestamp: int
+    channel: str
+    headers: Dict[str, str]
+    payload: bytes
+
+
+class Recorder:
+    """
+    Records published messages in a background thread.
+
+    `append` only puts a reference to the already encoded payload on a
+    bounded queue, so publishing pays neither for serialization nor for disk
+    I/O. The writer thread filters the channels, writes the records into the
+    memory-mapped log and index and commits them in batches. When the writer
+    falls behind and the queue is full, further messages are not recorded and
+    counted in `dropped`.
+
+    Attributes:
+        path (str): path of the log, the index is next to it
+        channels (List[str]): subject patterns to record, everything if empty
+        recorded (int): number of recorded messages
+        dropped (int): number of messages not recorded because the queue was full
+    """
+
+    def __init__(
+        self,
+        path: str,
+        logger: Logger,
+        channels: Optional[List[str]] = None,
+        queue_size: int = 65536,
+        chunk_size: int = 64 * 1024 * 1024,
+    ):
+        self.path: str = path
+        self.logger: Logger = logger
+        self.channels: List[str] = list(channels or [])
+        self.recorded: int = 0
+        self.dropped: int = 0
+        self._log: _AppendOnlyFile = _AppendOnlyFile(path, _LOG_MAGIC, chunk_size)
+        self._index: _AppendOnlyFile = _AppendOnlyFile(
+            index_path(path), _INDEX_MAGIC, max(_INDEX_ENTRY.size, chunk_size // 64)
+        )
+        self._queue: queue.Queue = queue.Queue(queue_size)
+        self._thread: threading.Thread = threading.Thread(target=self._run, name=f"recorder {path}", daemon=True)
+        self._thread.start()
+
+    def append(self, channel: str, headers: Optional[Dict[str, str]], payload: bytes):
+        """_Record a published message_"""
+        try:
+            self._queue.put_nowait((time.time_ns(), channel, headers, payload))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """_Write the queued messages and close the log_"""
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._log.close()
+        self._index.close()
+        self.logger.info(f"Recorded {self.recorded} messages to {self.path}, {self.dropped} dropped")
+
+    def _wanted(self, channel: str) -> bool:
+        return not self.channels or any(subjects.matches(pattern, channel) for pattern in self.channels)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while len(batch) < _WRITE_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            for item in batch:
+                if item is _STOP:
+                    stopping = True
+                    continue
+                try:
+                    self._write(*item)
+                except Exception as e:
+                    self.logger.error(f"Failed to record message on channel {item[1]}: {e}")
+            self._log.commit()
+            self._index.commit()
+
+    def _write(self, timestamp: int, channel: str, headers: Optional[Dict[str, str]], payload: bytes):
+        if not self._wanted(channel):
+            return
+        subject = channel.encode()
+        encoded_headers = encode_headers(headers)
+        size = _RECORD.size + len(subject) + len(encoded_headers) + len(payload)
+        offset = self._log.reserve(size)
+        buffer = self._log.buffer
+        _RECORD.pack_into(buffer, offset, timestamp, len(subject), len(encoded_headers), len(payload))
+        position = offset + _RECORD.size
+        buffer[position:position + len(subject)] = subject
+        position += len(subject)
+        buffer[position:position + len(encoded_headers)] = encoded_headers
+        position += len(encoded_headers)
+        buffer[position:position + len(payload)] = payload
+        entry = self._index.reserve(_INDEX_ENTRY.size)
+        _INDEX_ENTRY.pack_into(self._index.buffer, entry, timestamp, offset)
+        self.recorded += 1
+
+
+def index_path(log_path: str) -> str:
+    """_Path of the index of a log_"""
+    base = log_path[:-len(LOG_SUFFIX)] if log_path.endswith(LOG_SUFFIX) else log_path
+    return base + INDEX_SUFFIX
+
+
+def _map(path: str, magic: bytes) -> Tuple[mmap.mmap, int]:
+    """_Map a log or index file read-only, returns the mapping and the committed length_"""
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if size < _FILE_HEADER_SIZE:
+            raise ValueError(f"{path} is not a digsinet recording")
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    found, version, length = _FILE_HEADER.unpack_from(buffer, 0)
+    if found != magic or version != _VERSION:
+        buffer.close()
+        raise ValueError(f"{path} is not a digsinet recording")
+    return buffer, min(length, size - _FILE_HEADER_SIZE)
+
+
+class _Timestamps(Sequence[int]):
+    """_Timestamps of the index entries, for bisecting_"""
+
+    def __init__(self, index: mmap.mmap, count: int):
+        self._index = index
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, position):  # type: ignore[override]
+        return _INDEX_ENTRY.unpack_from(self._index, _FILE_HEADER_SIZE + position * _INDEX_ENTRY.size)[0]
+
+
+class RecordLog:
+    """
+    Read access to a recorded log through its index.
+
+    Attributes:
+        path (str): path of the log
+    """
+
+    def __init__(self, path: str):
+        self.path: str = path
+        self._log, self._length = _map(path, _LOG_MAGIC)
+        self._index, index_length = _map(index_path(path), _INDEX_MAGIC)
+        self._count: int = index_length // _INDEX_ENTRY.size
+
+    def __len__(self) -> int:
+        return self._count
+
+    def timestamp(self, position: int) -> int:
+        return _INDEX_ENTRY.unpack_from(self._index, _FILE_HEADER_SIZE + position * _INDEX_ENTRY.size)[0]
+
+    def record(self, position: int) -> Record:
+        """_The record at a position of the index_"""
+        _, offset = _INDEX_ENTRY.unpack_from(self._index, _FILE_HEADER_SIZE + position * _INDEX_ENTRY.size)
+        timestamp, subject_length, headers_length, payload_length = _RECORD.unpack_from(self._log, offset)
+        position = offset + _RECORD.size
+        channel = self._log[position:position + subject_length].decode()
+        position += subject_length
+        headers = decode_headers(self._log[position:position + headers_length])
+        position += headers_length
+        return Record(timestamp, channel, headers, self._log[position:position + payload_length])
+
+    def seek(self, timestamp: int) -> int:
+        """_Position of the first record at or after timestamp_"""
+        return bisect_left(_Timestamps(self._index, self._count), timestamp)
+
+    def records(self, start: Optional[int] = None, end: Optional[int] = None) -> Iterator[Record]:
+        """_Records between the start and end timestamps in nanoseconds, in publish order_"""
+        position = 0 if start is None else self.seek(start)
+        for position in range(position, self._count):
+            if end is not None and self.timestamp(position) >= end:
+                return
+            yield self.record(position)
+
+    def close(self):
+        self._log.close()
+        self._index.close()
+
+
+@dataclass
+class ReplayStats:
+    """
+    Result of a replay.
+
+    Attributes:
+        messages (int): number of replayed messages
+        bytes (int): payload bytes of the replayed messages
+        duration (float): seconds the replay took
+        recorded_duration (float): seconds between the first and the last replayed message in the recording
+        max_lag (float): largest delay of a message behind its schedule in seconds
+    """
+
+    messages: int = 0
+    bytes: int = 0
+    duration: float = 0.0
+    recorded_duration: float = 0.0
+    max_lag: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+async def replay(
+    broker: "EventBroker",
+    logs: List[RecordLog],
+    speed: float = 1.0,
+    channels: Optional[List[str]] = None,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+) -> ReplayStats:
+    """_Publish recorded messages again_
+
+    The records of all logs are merged by timestamp. With a speed of 1 the
+    messages are published with their recorded spacing, a speed of 10 replays
+    ten times faster and 0 replays as fast as possible.
+
+    Args:
+        broker (EventBroker): _Broker to publish to_
+        logs (List[RecordLog]): _The recorded logs_
+        speed (float, optional): _Replay speed relative to the recording, 0 for as fast as possible_. Defaults to 1.0.
+        channels (Optional[List[str]], optional): _Subject patterns to replay, everything if empty_. Defaults to None.
+        start (Optional[int], optional): _Replay records from this timestamp in nanoseconds_. Defaults to None.
+        end (Optional[int], optional): _Replay records before this timestamp in nanoseconds_. Defaults to None.
+
+    Returns:
+        ReplayStats: _Statistics of the replay_
+    """
+    loop = asyncio.get_running_loop()
+    stats = ReplayStats()
+    started = loop.time()
+    first: Optional[int] = None
+    last: int = 0
+    for record in heapq.merge(*(log.records(start, end) for log in logs), key=lambda record: record.timestamp):
+        if channels and not any(subjects.matches(pattern, record.channel) for pattern in channels):
+            continue
+        if first is None:
+            first = record.timestamp
+        last = record.timestamp
+        if speed > 0:
+            due = started + (record.timestamp - first) / 1e9 / speed
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                stats.max_lag = max(stats.max_lag, -delay)
+        elif stats.messages % 256 == 0:
+            # Let the broker and the subscribers of this process run
+            await asyncio.sleep(0)
+        await broker.publish_payload(record.channel, record.payload, headers=record.headers or None)
+        stats.messages += 1
+        stats.bytes += len(record.payload)
+    stats.duration = loop.time() - started
+    stats.recorded_duration = (last - first) / 1e9 if first is not None else 0.0
+    return stats
+
+
+def info(paths: List[str]) -> List[Dict[str, Any]]:
+    """_Number of records, time range and busiest channels of every log_"""
+    results: List[Dict[str, Any]] = list()
+    for path in paths:
+        log = RecordLog(path)
+        channels: Dict[str, int] = dict()
+        size = 0
+        for record in log.records():
+            channels[record.channel] = channels.get(record.channel, 0) + 1
+            size += len(record.payload)
+        results.append(
+            {
+                "log": path,
+                "messages": len(log),
+                "bytes": size,
+                "first": log.timestamp(0) / 1e9 if len(log) else None,
+                "last": log.timestamp(len(log) - 1) / 1e9 if len(log) else None,
+                "channels": dict(sorted(channels.items(), key=lambda item: -item[1])[:20]),
+            }
+        )
+        log.close()
+    return results
+
+
+async def replay_logs(arguments: Namespace, logger: Logger) -> ReplayStats:
+    from config.settings import read_config
+    from eventbroker.factory import create_broker
+
+    config = read_config(arguments.config)
+    broker = await create_broker(config, list(), logger)
+    if broker is None:
+        raise ValueError("no event broker configured")
+    logs = [RecordLog(path) for path in arguments.logs]
+    try:
+        return await replay(
+            broker,
+            logs,
+            arguments.speed,
+            arguments.channel,
+            int(arguments.start * 1e9) if arguments.start is not None else None,
+            int(arguments.end * 1e9) if arguments.end is not None else None,
+        )
+    finally:
+        await broker.close()
+        for log in logs:
+            log.close()
+
+
+def main():
+    parser: ArgumentParser = ArgumentParser(description="Inspect and replay recorded EventBroker traffic")
+    commands = parser.add_subparsers(dest="command", required=True)
+    info_command = commands.add_parser("info", help="Print a summary of recorded logs")
+    info_command.add_argument("logs", help="Recorded logs", nargs="+")
+    replay_command = commands.add_parser("replay", help="Publish recorded messages to the configured broker")
+    replay_command.add_argument("logs", help="Recorded logs, merged by timestamp", nargs="+")
+    replay_command.add_argument("--config", help="Configuration file with the broker settings", default="digsinet.yml")
+    replay_command.add_argument("--speed", help="Replay speed, 0 for as fast as possible", type=float, default=1.0)
+    replay_command.add_argument("--channel", help="Subject pattern to replay, may be repeated", action="append")
+    replay_command.add_argument("--start", help="Replay from this UNIX timestamp", type=float)
+    replay_command.add_argument("--end", help="Replay until this UNIX timestamp", type=float)
+    replay_command.add_argument("--debug", help="Enable debug logging", action="store_true")
+    arguments: Namespace = parser.parse_args()
+
+    if arguments.command == "info":
+        print(json.dumps(info(arguments.logs), indent=2))
+        return
+    logging.basicConfig(level=logging.DEBUG if arguments.debug else logging.INFO)
+    stats = asyncio.run(replay_logs(arguments, logging.getLogger("replay")))
+    print(json.dumps(stats.to_dict(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
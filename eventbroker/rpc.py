@@ -0,0 +1,75 @@
+"""Request/reply on top of EventBroker publish and subscribe"""
+import asyncio
+from logging import Logger
+from typing import TYPE_CHECKING, Any, Dict
+from uuid import uuid4
+
+if TYPE_CHECKING:
+    from eventbroker.eventbroker import EventBroker, Message
+
+
+INBOX_PREFIX: str = "_INBOX."
+REPLY_TO: str = "Digsinet-Reply-To"
+CORRELATION_ID: str = "Digsinet-Correlation-Id"
+
+
+def is_inbox(channel: str) -> bool:
+    """_Whether channel is a reply inbox of a requester_"""
+    return channel.startswith(INBOX_PREFIX)
+
+
+class Requester:
+    """
+    Correlates replies with outstanding requests.
+
+    Every request gets a correlation ID and a future. All replies arrive on a
+    single inbox subscription and resolve the future with the matching ID, so
+    any number of requests can be in flight at the same time. Replies for
+    requests that already timed out or were answered are dropped.
+
+    Attributes:
+        inbox (str): channel replies are sent to
+        late_replies (int): number of dropped late or duplicate replies
+    """
+
+    def __init__(self, broker: "EventBroker", logger: Logger):
+        self.broker: "EventBroker" = broker
+        self.logger: Logger = logger
+        self.inbox: str = f"{INBOX_PREFIX}{uuid4().hex}"
+        self.late_replies: int = 0
+        self._pending: Dict[str, asyncio.Future] = dict()
+
+    async def start(self):
+        await self.broker.listen(self.inbox, self._on_reply)
+
+    async def request(self, channel: str, data: Any, timeout: float) -> "Message":
+        """_Send a request and wait for its reply_
+
+        Args:
+            channel (str): _The channel to send the request to_
+            data (Any): _The request_
+            timeout (float): _Seconds to wait for the reply_
+
+        Returns:
+            Message: _The reply_
+
+        Raises:
+            TimeoutError: _If no reply arrives within timeout_
+        """
+        correlation_id = uuid4().hex
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._pending[correlation_id] = future
+        try:
+            await self.broker.publish(channel, data, headers={REPLY_TO: self.inbox, CORRELATION_ID: correlation_id})
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            del self._pending[correlation_id]
+
+    async def _on_reply(self, message: "Message"):
+        correlation_id = message.headers().get(CORRELATION_ID)
+        future = self._pending.get(correlation_id) if correlation_id else None
+        if future is None or future.done():
+            self.late_replies += 1
+            self.logger.debug(f"Dropping late or duplicate reply with correlation ID {correlation_id}")
+            return
+        future.set_result(message)
@@ -0,0 +1,650 @@
+import asyncio
+import fcntl
+from itertools import count
+from logging import Logger
+import mmap
+import os
+import struct
+from typing import Any, Dict, Iterator, List, Set, Tuple
+from urllib.parse import quote, unquote
+
+from config.shm import ShmSettings
+from eventbroker.codec import Codec
+from eventbroker.eventbroker import EventBroker, Message, subscription_key
+from eventbroker import subjects
+from eventbroker.subscription import Subscription, SubscriptionStats
+
+
+# magic, version, capacity, write position, read position, owner pid, dropped records, consumer waiting
+_HEADER = struct.Struct("<IIQQQQQQ")
+_HEADER_SIZE = 64
+_MAGIC = 0x44534E52  # "DSNR"
+_VERSION = 3
+_WRITE_OFFSET = 16
+_READ_OFFSET = 24
+_DROPPED_OFFSET = 40
+_WAITING_OFFSET = 48
+_POSITION = struct.Struct("<Q")
+_LENGTH = struct.Struct("<I")
+_FIELD_LENGTH = struct.Struct("<H")
+_PADDING = 0xFFFFFFFF
+_RING_SUFFIX = ".ring"
+# FIFO next to every ring that producers write to in order to wake up a waiting consumer
+_BELL_SUFFIX = ".bell"
+# Counter of the created and removed rings below the broker path
+_GENERATION_FILE = ".generation"
+# Separates the queue group from the owner in ring file names
+_GROUP_SEPARATOR = "~"
+_MATCH_CACHE_SIZE = 65536
+# Numbers the rings of all clients of the process, ring file names are the PID and this number
+_RING_SEQUENCE: Iterator[int] = count()
+# Backoff of a publisher waiting for space in a full ring buffer, in seconds
+_MIN_FULL_BACKOFF = 0.00005
+_MAX_FULL_BACKOFF = 0.005
+# Records a subscriber takes out of its ring at once before yielding to other tasks,
+# so a telemetry burst does not hold up the dispatch of control messages
+_READ_BATCH = 256
+
+
+def _bell_path(path: str) -> str:
+    return path[:-len(_RING_SUFFIX)] + _BELL_SUFFIX
+
+
+def encode_headers(headers: Dict[str, str] | None) -> bytes:
+    if not headers:
+        return b""
+    return "\0".join(f"{key}\0{value}" for key, value in headers.items()).encode()
+
+
+def decode_headers(data: bytes) -> Dict[str, str]:
+    if not data:
+        return dict()
+    fields = data.decode().split("\0")
+    return dict(zip(fields[0::2], fields[1::2]))
+
+
+class ShmRingFull(Exception):
+    """
+    Raised when a record does not fit into a ring buffer.
+    """
+    pass
+
+
+class ShmRecordTooLarge(ShmRingFull):
+    """
+    Raised when a record does not even fit into an empty ring buffer.
+    """
+    pass
+
+
+class ShmRing:
+    """
+    Multi-producer, single-consumer ring buffer in a memory-mapped file.
+
+    The file lives on a tmpfs, so the mapping is plain shared memory between the
+    processes on a host. Producers and the consumer serialize access to the
+    positions with an exclusive flock on the file. Positions increase
+    monotonically, the offset into the data region is the position modulo the
+    capacity.
+
+    A record is a 4 byte length followed by the record body, which holds the
+    length-prefixed subject and headers and the payload. A record never wraps
+    around the end of the data region, the remainder is skipped with a padding
+    marker instead.
+
+    A consumer that finds the ring empty marks it as waiting and waits for the
+    doorbell, a FIFO next to the ring file. The producer that writes the next
+    record clears the mark and writes a byte to the doorbell, so an idle
+    consumer sleeps instead of polling. Marking and clearing happen under the
+    flock, so a record written after the consumer found the ring empty always
+    rings the doorbell.
+
+    Attributes:
+        path (str): path of the ring file
+        capacity (int): size of the data region in bytes
+        bell (int): consumer side: file descriptor of the doorbell to wait on, -1 for producers
+    """
+
+    def __init__(self, path: str, fd: int, buffer: mmap.mmap, bell: int = -1):
+        self.path: str = path
+        self._fd: int = fd
+        self._buffer: mmap.mmap = buffer
+        magic, version, capacity, _, _, owner, _, _ = _HEADER.unpack_from(buffer, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{path} is not a digsinet ring buffer")
+        self.capacity: int = capacity
+        self.owner: int = owner
+        # A ring created later under the same path, e.g. by a process reusing the PID, is a different file
+        self.inode: int = os.fstat(fd).st_ino
+        self.bell: int = bell
+        # Producer side: queue group of the subscription, from the file name
+        self.group: str | None = None
+        # Producer side: doorbell opened on the first wakeup
+        self._bell_writer: int = -1
+
+    @classmethod
+    def create(cls, path: str, capacity: int) -> "ShmRing":
+        """_Create a ring file owned by the calling process_
+
+        The file is written under a temporary name and renamed afterwards, so
+        producers never open a partially initialized ring.
+        """
+        temporary = f"{path}.{os.getpid()}.tmp"
+        fd = os.open(temporary, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.ftruncate(fd, _HEADER_SIZE + capacity)
+        buffer = mmap.mmap(fd, _HEADER_SIZE + capacity)
+        _HEADER.pack_into(buffer, 0, _MAGIC, _VERSION, capacity, 0, 0, os.getpid(), 0, 0)
+        # Opened for reading and writing, so the doorbell does not report end of file while no producer has it open
+        try:
+            # Left behind by a crashed process with the same PID
+            os.unlink(_bell_path(path))
+        except FileNotFoundError:
+            pass
+        os.mkfifo(_bell_path(path), 0o600)
+        bell = os.open(_bell_path(path), os.O_RDWR | os.O_NONBLOCK)
+        os.rename(temporary, path)
+        return cls(path, fd, buffer, bell)
+
+    @classmethod
+    def open(cls, path: str) -> "ShmRing":
+        """_Open an existing ring file as producer_"""
+        fd = os.open(path, os.O_RDWR)
+        try:
+            buffer = mmap.mmap(fd, 0)
+        except Exception:
+            os.close(fd)
+            raise
+        return cls(path, fd, buffer)
+
+    def owner_alive(self) -> bool:
+        try:
+            os.kill(self.owner, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def write(self, subject: bytes, headers: bytes, payload: bytes):
+        """_Append a record_
+
+        Raises:
+            ShmRingFull: _If the consumer has not freed enough space_
+            ShmRecordTooLarge: _If the record exceeds half the capacity of the ring_
+        """
+        length = 2 * _FIELD_LENGTH.size + len(subject) + len(headers) + len(payload)
+        if _LENGTH.size + length > self.capacity // 2:
+            raise ShmRecordTooLarge(f"record of {length} bytes exceeds the ring capacity of {self.capacity} bytes")
+
+        buffer = self._buffer
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            write = _POSITION.unpack_from(buffer, _WRITE_OFFSET)[0]
+            read = _POSITION.unpack_from(buffer, _READ_OFFSET)[0]
+            offset = write % self.capacity
+            tail = self.capacity - offset
+            skip = tail if tail < _LENGTH.size + length else 0
+            if self.capacity - (write - read) < skip + _LENGTH.size + length:
+                raise ShmRingFull(f"ring buffer {self.path} is full")
+            if skip:
+                if tail >= _LENGTH.size:
+                    _LENGTH.pack_into(buffer, _HEADER_SIZE + offset, _PADDING)
+                write += skip
+                offset = 0
+            position = _HEADER_SIZE + offset
+            _LENGTH.pack_into(buffer, position, length)
+            position += _LENGTH.size
+            _FIELD_LENGTH.pack_into(buffer, position, len(subject))
+            position += _FIELD_LENGTH.size
+            buffer[position:position + len(subject)] = subject
+            position += len(subject)
+            _FIELD_LENGTH.pack_into(buffer, position, len(headers))
+            position += _FIELD_LENGTH.size
+            buffer[position:position + len(headers)] = headers
+            position += len(headers)
+            buffer[position:position + len(payload)] = payload
+            _POSITION.pack_into(buffer, _WRITE_OFFSET, write + _LENGTH.size + length)
+            waiting = _POSITION.unpack_from(buffer, _WAITING_OFFSET)[0]
+            if waiting:
+                _POSITION.pack_into(buffer, _WAITING_OFFSET, 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        if waiting:
+            self._ring_bell()
+
+    def _ring_bell(self):
+        try:
+            if self._bell_writer < 0:
+                self._bell_writer = os.open(_bell_path(self.path), os.O_WRONLY | os.O_NONBLOCK)
+            os.write(self._bell_writer, b"\1")
+        except BlockingIOError:
+            # The doorbell is still full of earlier wakeups
+            pass
+        except OSError:
+            # The consumer terminated and took the doorbell with it
+            pass
+
+    @property
+    def read_position(self) -> int:
+        return _POSITION.unpack_from(self._buffer, _READ_OFFSET)[0]
+
+    @property
+    def dropped(self) -> int:
+        """_Number of records producers dropped because the ring was full_"""
+        return _POSITION.unpack_from(self._buffer, _DROPPED_OFFSET)[0]
+
+    def record_dropped(self):
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            _POSITION.pack_into(self._buffer, _DROPPED_OFFSET, self.dropped + 1)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def read(self, limit: int = 0, wait: bool = False) -> List[Tuple[str, Dict[str, str], bytes]]:
+        """_Take the available records out of the ring_
+
+        Args:
+            limit (int, optional): _Maximum number of records to take, 0 for all_. Defaults to 0.
+            wait (bool, optional): _Mark the ring as waiting if it is empty, so the next write rings the doorbell_.
+                Defaults to False.
+
+        Returns:
+            List[Tuple[str, Dict[str, str], bytes]]: _Subject, headers and payload of every record_
+        """
+        buffer = self._buffer
+        records: List[Tuple[str, Dict[str, str], bytes]] = list()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            write = _POSITION.unpack_from(buffer, _WRITE_OFFSET)[0]
+            read = _POSITION.unpack_from(buffer, _READ_OFFSET)[0]
+            while read < write and not (limit and len(records) >= limit):
+                offset = read % self.capacity
+                tail = self.capacity - offset
+                if tail < _LENGTH.size:
+                    read += tail
+                    continue
+                position = _HEADER_SIZE + offset
+                length = _LENGTH.unpack_from(buffer, position)[0]
+                if length == _PADDING:
+                    read += tail
+                    continue
+                position += _LENGTH.size
+                subject_length = _FIELD_LENGTH.unpack_from(buffer, position)[0]
+                position += _FIELD_LENGTH.size
+                subject = buffer[position:position + subject_length].decode()
+                position += subject_length
+                headers_length = _FIELD_LENGTH.unpack_from(buffer, position)[0]
+                position += _FIELD_LENGTH.size
+                headers = decode_headers(buffer[position:position + headers_length])
+                position += headers_length
+                end = _HEADER_SIZE + offset + _LENGTH.size + length
+                records.append((subject, headers, buffer[position:end]))
+                read += _LENGTH.size + length
+            _POSITION.pack_into(buffer, _READ_OFFSET, read)
+            if wait and not records:
+                _POSITION.pack_into(buffer, _WAITING_OFFSET, 1)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return records
+
+    def clear_bell(self):
+        """_Consume the pending wakeups of the doorbell_"""
+        try:
+            while os.read(self.bell, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self, unlink: bool = False):
+        self._buffer.close()
+        os.close(self._fd)
+        for bell in (self.bell, self._bell_writer):
+            if bell >= 0:
+                os.close(bell)
+        if unlink:
+            for path in (self.path, _bell_path(self.path)):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+
+class ShmGeneration:
+    """
+    Counter of the rings created and removed below the path of a broker.
+
+    The counter lives in a memory-mapped file next to the channel directories.
+    Subscribers increment it after they created or removed a ring, and
+    publishers only list the channel directories again once it changed, so
+    publishing does not have to stat them for every message.
+    """
+
+    def __init__(self, path: str):
+        self._fd: int = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < _POSITION.size:
+            os.ftruncate(self._fd, _POSITION.size)
+        self._buffer: mmap.mmap = mmap.mmap(self._fd, _POSITION.size)
+
+    @property
+    def value(self) -> int:
+        return _POSITION.unpack_from(self._buffer, 0)[0]
+
+    def increment(self):
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            _POSITION.pack_into(self._buffer, 0, self.value + 1)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        self._buffer.close()
+        os.close(self._fd)
+
+
+class ShmMessage(Message):
+    def __init__(self, message: Tuple[str, Dict[str, str], bytes], codec: Codec):
+        super().__init__(message, codec)
+
+    def error(self) -> str | None:
+        return None
+
+    def channel(self) -> str:
+        return self._message[0]
+
+    def headers(self) -> Dict[str, str]:
+        return self._message[1]
+
+    def payload(self) -> bytes:
+        return self._message[2]
+
+
+class ShmClient(EventBroker):
+    """
+    EventBroker for controllers running on a single host.
+
+    Every subscription owns a ring buffer in a memory-mapped file below
+    `config.path`, grouped in one directory per subscribed channel pattern.
+    Publishing writes the payload into the rings of all patterns matching the
+    channel, so no broker server is needed. Patterns may contain the wildcards
+    described in `eventbroker.subjects`. Rings of subscriptions in a queue
+    group carry the group in their file name, a message is written to one
+    ring per group only, round robin, skipping rings of terminated processes.
+    Subscribers wait on the doorbell of their ring while it is empty, see
+    `ShmRing`, and check it every `poll_interval` in case a wakeup was lost.
+    Publishers cache the rings of every pattern and only list the directories
+    again after a subscription was created or closed, see `ShmGeneration`.
+
+    A ring only fills up while its subscription blocks, see the overflow
+    policies of `Subscription`. The publisher then waits up to
+    `publish_timeout` for the subscriber to catch up before the message is
+    dropped for that subscriber. It does not wait again for a subscriber that
+    has not read anything since, so a stuck subscriber slows the publisher
+    down once instead of on every message.
+    """
+
+    def __init__(self, config: ShmSettings, channels: List[str], logger: Logger):
+        super().__init__(config, channels, logger)
+        self.config: ShmSettings = config
+        self.subjects: List[str] = channels
+        self.logger: Logger = logger
+        self._rings: Dict[str, ShmRing] = dict()
+        self._readers: Dict[str, asyncio.Task] = dict()
+        # Producer side: subscribed patterns, the patterns matching a channel and
+        # the open rings per pattern, each with the directory mtime they were listed at
+        self._patterns: Tuple[int, List[str]] = (-1, list())
+        self._matching: Dict[str, List[str]] = dict()
+        # Targets of a pattern: one list per ungrouped ring and one per queue group
+        self._targets: Dict[str, Tuple[int, List[List[ShmRing]]]] = dict()
+        # Generation of the subscriptions the cached patterns and targets are valid for,
+        # and the patterns whose directory was checked since it changed
+        self._generation: ShmGeneration = ShmGeneration(os.path.join(config.path, _GENERATION_FILE))
+        self._listed_generation: int = -1
+        self._checked: Set[str] = set()
+        self._round_robin: Iterator[int] = count()
+        # Read positions of full rings the last publish timed out on, by path
+        self._stalled: Dict[str, int] = dict()
+
+    @classmethod
+    async def create(cls, config: ShmSettings, channels: List[str], logger: Logger):
+        os.makedirs(config.path, exist_ok=True)
+        return cls(config, channels, logger)
+
+    def _channel_directory(self, channel: str) -> str:
+        return os.path.join(self.config.path, quote(channel, safe=""))
+
+    def _target_rings(self, channel: str) -> List[List[ShmRing]]:
+        generation = self._generation.value
+        if generation != self._listed_generation:
+            self._listed_generation = generation
+            self._checked.clear()
+            mtime = os.stat(self.config.path).st_mtime_ns
+            if mtime != self._patterns[0]:
+                patterns = [unquote(entry) for entry in os.listdir(self.config.path) if entry != _GENERATION_FILE]
+                self._patterns = (mtime, patterns)
+                self._matching.clear()
+        matching = self._matching.get(channel)
+        if matching is None:
+            if len(self._matching) >= _MATCH_CACHE_SIZE:
+                self._matching.clear()
+            matching = self._matching[channel] = [
+                pattern for pattern in self._patterns[1] if subjects.matches(pattern, channel)
+            ]
+        if len(matching) == 1:
+            return self._pattern_rings(matching[0])
+        return [targets for pattern in matching for targets in self._pattern_rings(pattern)]
+
+    def _pattern_rings(self, channel: str) -> List[List[ShmRing]]:
+        cached = self._targets.get(channel)
+        if cached is not None and channel in self._checked:
+            return cached[1]
+        directory = self._channel_directory(channel)
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        self._checked.add(channel)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        known: Dict[str, ShmRing] = {ring.path: ring for targets in cached[1] for ring in targets} if cached else dict()
+        rings: List[List[ShmRing]] = list()
+        groups: Dict[str, List[ShmRing]] = dict()
+        for item in os.scandir(directory):
+            entry = item.name
+            if not entry.endswith(_RING_SUFFIX):
+                continue
+            path = item.path
+            ring = known.pop(path, None)
+            if ring is not None and ring.inode != item.inode():
+                ring.close()
+                self._stalled.pop(path, None)
+                ring = None
+            if ring is None:
+                try:
+                    ring = ShmRing.open(path)
+                except (OSError, ValueError) as e:
+                    self.logger.debug(f"Skipping ring buffer {path}: {e}")
+                    continue
+            if not ring.owner_alive():
+                self.logger.info(f"Removing ring buffer {path} of terminated process {ring.owner}")
+                ring.close(unlink=True)
+                self._stalled.pop(path, None)
+                continue
+            if _GROUP_SEPARATOR in entry:
+                ring.group = entry.split(_GROUP_SEPARATOR, 1)[0]
+                groups.setdefault(ring.group, list()).append(ring)
+            else:
+                rings.append([ring])
+        rings.extend(groups.values())
+        for ring in known.values():
+            ring.close()
+            self._stalled.pop(ring.path, None)
+        self._targets[channel] = (mtime, rings)
+        return rings
+
+    async def publish(self, channel: str, data: Any, key: str | None = None, headers: Dict[str, str] | None = None):
+        if channel not in self.subjects and not subjects.is_dynamic(channel):
+            self.logger.warning(f"Shared-memory channel {channel} is an unknown channel")
+        await self.publish_payload(channel, self.codec.encode(data), key, headers)
+
+    async def publish_payload(self, channel: str, payload: bytes, key: str | None = None, headers: Dict[str, str] | None = None):
+        self.logger.debug(f"Publishing {len(payload)} bytes to shared-memory channel {channel}")
+        self.record(channel, payload, headers)
+        if len(payload) < self.large_payload:
+            await self._publish_frame(channel, payload, headers)
+            return
+        # Chunks and handles are smaller than the ring buffers, so large payloads are not dropped as too large
+        for frame, frame_headers in self.frames(channel, payload, headers):
+            await self._publish_frame(channel, frame, frame_headers)
+
+    def is_grouped(self, channel: str) -> bool:
+        return super().is_grouped(channel) or any(
+            ring.group is not None for targets in self._target_rings(channel) for ring in targets
+        )
+
+    async def _publish_frame(self, channel: str, payload: bytes, headers: Dict[str, str] | None):
+        subject: bytes = channel.encode()
+        encoded_headers: bytes = encode_headers(headers)
+        loop = asyncio.get_running_loop()
+        # All waits of a publish share one deadline
+        deadline: float | None = None
+        for targets in self._target_rings(channel):
+            backoff = _MIN_FULL_BACKOFF
+            while not self._write(channel, targets, subject, encoded_headers, payload):
+                now = loop.time()
+                if deadline is None:
+                    deadline = now + self.config.publish_timeout / 1000
+                if now >= deadline:
+                    for ring in targets:
+                        ring.record_dropped()
+                        self._stalled[ring.path] = ring.read_position
+                    self.logger.warning(f"Dropping message for channel {channel}: ring buffer of a slow subscriber is full")
+                    break
+                await asyncio.sleep(min(backoff, deadline - now))
+                backoff = min(backoff * 2, _MAX_FULL_BACKOFF)
+
+    def _write(self, channel: str, targets: List[ShmRing], subject: bytes, headers: bytes, payload: bytes) -> bool:
+        """_Write to a ring or one member of a queue group, round robin_
+
+        Returns:
+            bool: _False if all rings of live subscribers are full and the write should be retried_
+        """
+        start = next(self._round_robin) if len(targets) > 1 else 0
+        waiting = False
+        stalled: List[ShmRing] = list()
+        for attempt in range(len(targets)):
+            ring = targets[(start + attempt) % len(targets)]
+            try:
+                ring.write(subject, headers, payload)
+                if self._stalled:
+                    self._stalled.pop(ring.path, None)
+                return True
+            except ShmRecordTooLarge as e:
+                self.logger.warning(f"Dropping message for channel {channel}: {e}")
+                return True
+            except ShmRingFull as e:
+                # A full ring may belong to a subscriber that terminated without cleaning up
+                if not ring.owner_alive():
+                    self.logger.debug(f"Skipping ring buffer {ring.path} of terminated process {ring.owner}")
+                    continue
+                if self._stalled.get(ring.path) == ring.read_position:
+                    stalled.append(ring)
+                    continue
+                waiting = True
+                self.logger.debug(f"Ring buffer full: {e}")
+        if not waiting:
+            for ring in stalled:
+                ring.record_dropped()
+            self.logger.debug(f"Dropping message for channel {channel}: all subscribers are stalled or gone")
+        return not waiting
+
+    async def subscribe(self, channel: str, group_id: str | None = None) -> Tuple[Subscription, str]:
+        key: str = subscription_key(channel, group_id)
+        if key not in self.subscribers.keys():
+            directory = self._channel_directory(channel)
+            os.makedirs(directory, exist_ok=True)
+            name = f"{os.getpid()}-{next(_RING_SEQUENCE)}{_RING_SUFFIX}"
+            if group_id is not None:
+                group = quote(group_id, safe="").replace(_GROUP_SEPARATOR, "%7E")
+                name = f"{group}{_GROUP_SEPARATOR}{name}"
+            ring = ShmRing.create(os.path.join(directory, name), self.config.ring_size)
+            self._generation.increment()
+            subscription: Subscription = self.new_subscription(channel, ring)
+            self._rings[key] = ring
+            self.subscribers.update({key: subscription})
+
+            self._readers[key] = asyncio.get_running_loop().create_task(self._read(key, subscription, ring))
+            self.logger.info(f"Subscribed to shared-memory channel {channel} in group {group_id}")
+        else:
+            self.logger.warning(f"Tried to subscribe to shared-memory channel with active subscription: {key}")
+        return self.subscribers[key], key
+
+    async def _read(self, key: str, subscription: Subscription, ring: ShmRing):
+        while not subscription.closed:
+            records = ring.read(_READ_BATCH, wait=True)
+            if not records:
+                await self._wait(ring)
+                continue
+            for record in records:
+                message = self.receive(ShmMessage(record, self.codec), key)
+                if message is not None:
+                    await subscription.put(message)
+            if len(records) == _READ_BATCH:
+                await asyncio.sleep(0)
+
+    async def _wait(self, ring: ShmRing):
+        loop = asyncio.get_running_loop()
+        rung: asyncio.Future = loop.create_future()
+        loop.add_reader(ring.bell, lambda: rung.done() or rung.set_result(None))
+        try:
+            # A publisher that terminates between writing a record and ringing the doorbell loses the wakeup
+            await asyncio.wait_for(rung, self.config.poll_interval / 1000)
+        except TimeoutError:
+            pass
+        finally:
+            loop.remove_reader(ring.bell)
+        ring.clear_bell()
+
+    def slow_consumers(self) -> Dict[str, SubscriptionStats]:
+        slow = super().slow_consumers()
+        # Include the messages publishers dropped because the ring was full
+        for key, stats in slow.items():
+            ring = self._rings.get(key)
+            if ring is not None:
+                stats.dropped += ring.dropped
+        return slow
+
+    async def get_sibling_channels(self):
+        return self.subjects
+
+    async def close(self):
+        await self.stop_listeners()
+        self.stop_recording()
+        self.handoff.close()
+        for subject in list(self.subscribers):
+            await self.close_consumer(subject)
+        self.logger.info("All shared-memory subscribers closed")
+        for _, targets in self._targets.values():
+            for rings in targets:
+                for ring in rings:
+                    ring.close()
+        self._targets.clear()
+        self._generation.close()
+        self.logger.info("Closed shared-memory client")
+
+    async def close_consumer(self, consumer: str):
+        if consumer in self.subscribers.keys():
+            subscription: Subscription = self.subscribers.pop(consumer)
+            subscription.close()
+            reader: asyncio.Task = self._readers.pop(consumer)
+            reader.cancel()
+            await asyncio.gather(reader, return_exceptions=True)
+            self._rings.pop(consumer).close(unlink=True)
+            self._generation.increment()
+            self.logger.info(f"Subscriber for shared-memory channel {consumer} closed.")
+        else:
+            self.logger.warning(f"Unable to close subscriber for shared-memory channel {consumer}: Subscriber not found")
+
+    # This method is not used publicly
+    async def new_sibling_channel(self, channel: str):
+        pass
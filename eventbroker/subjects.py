@@ -0,0 +1,252 @@
+"""
+Subject hierarchy for DigSiNet broker traffic.
+
+Subjects are dot separated tokens, following the NATS conventions:
+
+    digsinet.<topology>.control.<controller>               control messages for a controller
+    digsinet.<topology>.telemetry.<node>.<path tokens...>  telemetry updates of a node
+    digsinet.<topology>.membership                         heartbeats of the workers of a cluster
+
+gNMI paths are split into one token per path element, so subscribers can
+select nodes and path prefixes with wildcards. `*` matches exactly one token,
+`>` matches one or more trailing tokens. Brokers with native wildcard support
+(NATS) filter on the server, other brokers use `matches`.
+"""
+import re
+from typing import Iterable, List
+from urllib.parse import unquote
+
+from eventbroker.rpc import is_inbox
+
+
+ROOT: str = "digsinet"
+CONTROL: str = "control"
+TELEMETRY: str = "telemetry"
+MEMBERSHIP: str = "membership"
+SINGLE_WILDCARD: str = "*"
+TAIL_WILDCARD: str = ">"
+# gNMI path element matching any number of elements
+GNMI_TAIL_WILDCARD: str = "..."
+
+_ESCAPES = str.maketrans({
+    "%": "%25",
+    ".": "%2E",
+    "*": "%2A",
+    ">": "%3E",
+    " ": "%20",
+    "\t": "%09",
+})
+
+
+def escape_token(token: str) -> str:
+    """_Escape characters that are not allowed in a subject token_"""
+    return token.translate(_ESCAPES)
+
+
+def unescape_token(token: str) -> str:
+    """_Reverse `escape_token`_"""
+    return unquote(token)
+
+
+def telemetry_node(subject: str) -> str:
+    """_Name of the node of a telemetry subject_"""
+    return unescape_token(subject.split(".")[3])
+
+
+def path_elements(path: str) -> List[str]:
+    """_Split a gNMI path into its elements_
+
+    Path elements are separated by `/`, slashes inside `[key=value]` selectors
+    do not separate elements.
+    """
+    tokens: List[str] = list()
+    element: List[str] = list()
+    depth = 0
+    for character in path:
+        if character == "[":
+            depth += 1
+        elif character == "]":
+            depth -= 1
+        if character == "/" and depth == 0:
+            if element:
+                tokens.append("".join(element))
+            element = list()
+        else:
+            element.append(character)
+    if element:
+        tokens.append("".join(element))
+    return tokens
+
+
+def path_tokens(path: str) -> List[str]:
+    """_Split a gNMI path into escaped subject tokens_
+
+    Example:
+        `openconfig:interfaces/interface[name=Ethernet1]` becomes
+        `["openconfig:interfaces", "interface[name=Ethernet1]"]`
+    """
+    return [escape_token(element) for element in path_elements(path)]
+
+
+def interest_tokens(path: str) -> List[str]:
+    """_Split a gNMI path that may contain wildcards into subject tokens with wildcards_
+
+    An element `*` or with a wildcard key like `interface[name=*]` becomes
+    `*`, which matches more than the element does, see `path_accepts`. The
+    element `...` becomes `>` and ends the tokens.
+    """
+    tokens: List[str] = list()
+    for element in path_elements(path):
+        if element == GNMI_TAIL_WILDCARD:
+            tokens.append(TAIL_WILDCARD)
+            break
+        tokens.append(SINGLE_WILDCARD if SINGLE_WILDCARD in element else escape_token(element))
+    return tokens
+
+
+def _element_pattern(element: str) -> re.Pattern:
+    return re.compile(".*".join(re.escape(part) for part in element.split(SINGLE_WILDCARD)))
+
+
+def path_accepts(paths: Iterable[str], subject: str) -> bool:
+    """_Whether a telemetry subject is of one of the paths, of a path below or above one of them_
+
+    Telemetry is published for the paths the realnet polls, so the updates of
+    an interest may arrive on the subject of an ancestor path. Unlike the
+    subject wildcards, key wildcards only match values of their key.
+
+    Args:
+        paths (Iterable[str]): _gNMI paths with wildcards, all paths if empty_
+        subject (str): _A telemetry subject_
+
+    Returns:
+        bool: _Whether the subject carries updates of the paths_
+    """
+    tokens = [unescape_token(token) for token in subject.split(".")[4:]]
+    patterns = [path_elements(path) for path in paths]
+    if not patterns:
+        return True
+    for elements in patterns:
+        for element, token in zip(elements, tokens):
+            if element == GNMI_TAIL_WILDCARD:
+                return True
+            if not _element_pattern(element).fullmatch(token):
+                break
+        else:
+            return True
+    return False
+
+
+def control(topology: str, controller: str) -> str:
+    """_Control subject of a controller, e.g. digsinet.digsinet.control.realnet_"""
+    return f"{ROOT}.{escape_token(topology)}.{CONTROL}.{escape_token(controller)}"
+
+
+def membership(topology: str) -> str:
+    """_Subject the workers of a cluster exchange heartbeats on_"""
+    return f"{ROOT}.{escape_token(topology)}.{MEMBERSHIP}"
+
+
+def queue_group(topology: str, name: str) -> str:
+    """_Queue group shared by all workers that can handle name, e.g. a sibling_"""
+    return f"{ROOT}.{escape_token(topology)}.{escape_token(name)}"
+
+
+def telemetry(topology: str, node: str, path: str = "") -> str:
+    """_Telemetry subject of a node and gNMI path_"""
+    return ".".join([ROOT, escape_token(topology), TELEMETRY, escape_token(node), *path_tokens(path)])
+
+
+def telemetry_interest(topology: str, nodes: str, paths: Iterable[str], known_nodes: Iterable[str]) -> List[str]:
+    """_Subjects a subscriber of telemetry has to subscribe to_
+
+    The node regex of the interface settings is resolved against the known
+    nodes of the topology, so only updates of matching nodes are delivered. If
+    every known node matches or no nodes are known, a single wildcard token is
+    used. Every path contributes the subject of the path itself, of
+    everything below it and of its ancestors, since the realnet publishes
+    updates on the subject of the path it polls. Subjects covered by another
+    one of the interest are left out, so no update is delivered twice.
+    Wildcards in paths widen the subjects to whole tokens, subscribers filter
+    the updates with `path_accepts`.
+
+    Args:
+        topology (str): _Name of the topology_
+        nodes (str): _Regex of the nodes to receive updates for_
+        paths (Iterable[str]): _gNMI path prefixes to receive updates for, all paths if empty_
+        known_nodes (Iterable[str]): _Names of the nodes in the topology_
+
+    Returns:
+        List[str]: _The subjects to subscribe to_
+    """
+    known: List[str] = list(known_nodes)
+    pattern = re.compile(nodes)
+    matching: List[str] = [node for node in known if pattern.fullmatch(node)]
+    if known and not matching:
+        return []
+    node_tokens: List[str] = (
+        [SINGLE_WILDCARD] if len(matching) == len(known) else [escape_token(node) for node in matching]
+    )
+
+    prefix = f"{ROOT}.{escape_token(topology)}.{TELEMETRY}"
+    path_prefixes: List[List[str]] = [interest_tokens(path) for path in paths] or [[]]
+    interest: List[str] = list()
+    for node_token in node_tokens:
+        for tokens in path_prefixes:
+            if tokens and tokens[-1] == TAIL_WILDCARD:
+                tokens = tokens[:-1]
+            for depth in range(len(tokens) + 1):
+                subject = ".".join([prefix, node_token, *tokens[:depth]])
+                if subject not in interest:
+                    interest.append(subject)
+            interest.append(f"{'.'.join([prefix, node_token, *tokens])}.{TAIL_WILDCARD}")
+    return [
+        subject for index, subject in enumerate(interest)
+        if not any(
+            other != subject and covers(other, subject) or other == subject and earlier < index
+            for earlier, other in enumerate(interest)
+        )
+    ]
+
+
+def covers(general: str, specific: str) -> bool:
+    """_Whether every subject matching the pattern specific also matches the pattern general_"""
+    general_tokens = general.split(".")
+    specific_tokens = specific.split(".")
+    for index, token in enumerate(general_tokens):
+        if token == TAIL_WILDCARD:
+            return len(specific_tokens) > index
+        if index >= len(specific_tokens) or specific_tokens[index] == TAIL_WILDCARD:
+            return False
+        if token != SINGLE_WILDCARD and (specific_tokens[index] == SINGLE_WILDCARD or token != specific_tokens[index]):
+            return False
+    return len(general_tokens) == len(specific_tokens)
+
+
+def matches(pattern: str, subject: str) -> bool:
+    """_Whether subject matches a subscription pattern with wildcards_"""
+    pattern_tokens = pattern.split(".")
+    subject_tokens = subject.split(".")
+    for index, token in enumerate(pattern_tokens):
+        if token == TAIL_WILDCARD:
+            return len(subject_tokens) > index
+        if index >= len(subject_tokens):
+            return False
+        if token != SINGLE_WILDCARD and token != subject_tokens[index]:
+            return False
+    return len(pattern_tokens) == len(subject_tokens)
+
+
+def is_telemetry(subject: str) -> bool:
+    tokens = subject.split(".", 3)
+    return len(tokens) > 3 and tokens[0] == ROOT and tokens[2] == TELEMETRY
+
+
+def is_membership(subject: str) -> bool:
+    tokens = subject.split(".")
+    return len(tokens) == 3 and tokens[0] == ROOT and tokens[2] == MEMBERSHIP
+
+
+def is_dynamic(subject: str) -> bool:
+    """_Whether subject is created on demand, like telemetry subjects, reply inboxes and cluster heartbeats_"""
+    return is_inbox(subject) or is_telemetry(subject) or is_membership(subject)
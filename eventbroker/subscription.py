@@ -0,0 +1,264 @@
+"""Push-based subscriptions for EventBroker implementations"""
+import asyncio
+from collections import deque
+from dataclasses import asdict, dataclass
+import time
+from typing import TYPE_CHECKING, Any, Callable, Deque, Dict, List, Literal, Optional
+
+if TYPE_CHECKING:
+    from eventbroker.eventbroker import Message
+
+
+OverflowPolicy = Literal["block", "drop_oldest", "coalesce"]
+BLOCK: OverflowPolicy = "block"
+DROP_OLDEST: OverflowPolicy = "drop_oldest"
+COALESCE: OverflowPolicy = "coalesce"
+# Combines a buffered message with a newer one of the same subject, None if they can not be combined
+Merge = Callable[["Message", "Message"], Optional["Message"]]
+
+
+@dataclass
+class SubscriptionStats:
+    """
+    Counters of a subscription, reported for slow consumers.
+
+    Attributes:
+        channel (str): the subscribed channel
+        policy (str): overflow policy of the subscription
+        pending (int): number of buffered messages
+        pending_bytes (int): payload bytes of the buffered messages
+        delivered (int): number of messages taken by the consumer
+        dropped (int): number of messages dropped because the buffer was full
+        coalesced (int): number of messages combined with a newer one on the same subject
+        blocked (int): number of messages the broker had to wait for buffer space for
+        full_for (float): seconds the buffer has been full, 0 if it is not
+    """
+
+    channel: str
+    policy: str
+    pending: int
+    pending_bytes: int
+    delivered: int
+    dropped: int
+    coalesced: int
+    blocked: int
+    full_for: float
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class Subscription:
+    """
+    Bounded buffer of messages received for a channel.
+
+    The broker implementation pushes received messages into the subscription,
+    consumers read them with `get` or by iterating asynchronously:
+
+        subscription, _ = await broker.subscribe("realnet")
+        async for message in subscription:
+            ...
+
+    The buffer holds at most `maxsize` messages and `max_bytes` payload bytes.
+    What happens to a message received while the buffer is full depends on the
+    overflow policy:
+
+        block        `put` waits until the consumer catches up, which propagates
+                     backpressure to the broker implementation and the publisher
+        drop_oldest  the oldest buffered messages are dropped to make room
+        coalesce     a buffered message of the same subject is combined in place
+                     with the newer one by the `merge` function, otherwise the
+                     oldest messages are dropped. Meant for telemetry, where the
+                     newest update of a node and path supersedes older ones and
+                     changes can be combined. Without a merge function the newer
+                     message replaces the buffered one.
+
+    The buffer counts as full from the first message that did not fit until the
+    consumer drained it to half its size. A consumer whose buffer stays full is
+    a slow consumer.
+
+    Attributes:
+        channel (str): the subscribed channel
+        maxsize (int): maximum number of buffered messages
+        max_bytes (int): maximum payload bytes of the buffered messages, 0 for no limit
+        policy (OverflowPolicy): what to do with messages received while the buffer is full
+        merge (Optional[Merge]): combines buffered and newer messages of a subject for the coalesce policy
+        handle (Any): broker specific subscription handle
+        delivered (int): number of messages taken by the consumer
+        dropped (int): number of messages dropped because the buffer was full
+        coalesced (int): number of messages combined with a newer one on the same subject
+        blocked (int): number of messages `put` had to wait for buffer space for
+    """
+
+    def __init__(
+        self,
+        channel: str,
+        maxsize: int,
+        handle: Any = None,
+        policy: OverflowPolicy = BLOCK,
+        max_bytes: int = 0,
+        merge: Optional[Merge] = None,
+    ):
+        self.channel: str = channel
+        self.maxsize: int = max(1, maxsize)
+        self.max_bytes: int = max_bytes
+        self.policy: OverflowPolicy = policy
+        self.merge: Optional[Merge] = merge
+        self.handle: Any = handle
+        self.delivered: int = 0
+        self.dropped: int = 0
+        self.coalesced: int = 0
+        self.blocked: int = 0
+        # Entries are [subject, message, payload size], mutable so coalescing replaces in place
+        self._buffer: Deque[List[Any]] = deque()
+        self._subjects: Dict[str, List[Any]] = dict()
+        self._bytes: int = 0
+        self._full_since: Optional[float] = None
+        self._not_empty: asyncio.Event = asyncio.Event()
+        self._not_full: asyncio.Event = asyncio.Event()
+        self._closed: bool = False
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def pending(self) -> int:
+        """_Number of buffered messages_"""
+        return len(self._buffer)
+
+    def pending_bytes(self) -> int:
+        """_Payload bytes of the buffered messages_"""
+        return self._bytes
+
+    def full_for(self) -> float:
+        """_Seconds the buffer has been full, 0 if it is not_"""
+        if self._full_since is None:
+            return 0.0
+        return time.monotonic() - self._full_since
+
+    def stats(self) -> SubscriptionStats:
+        return SubscriptionStats(
+            channel=self.channel,
+            policy=self.policy,
+            pending=len(self._buffer),
+            pending_bytes=self._bytes,
+            delivered=self.delivered,
+            dropped=self.dropped,
+            coalesced=self.coalesced,
+            blocked=self.blocked,
+            full_for=self.full_for(),
+        )
+
+    def _full(self, size: int) -> bool:
+        if len(self._buffer) >= self.maxsize:
+            return True
+        return self.max_bytes > 0 and bool(self._buffer) and self._bytes + size > self.max_bytes
+
+    def _drop_oldest(self):
+        entry = self._buffer.popleft()
+        if self._subjects.get(entry[0]) is entry:
+            del self._subjects[entry[0]]
+        self._bytes -= entry[2]
+        self.dropped += 1
+
+    async def put(self, message: "Message"):
+        """_Buffer a received message, applying the overflow policy if the buffer is full_
+
+        Messages received after the subscription was closed are dropped.
+        """
+        if self._closed:
+            return
+        size = len(message.payload())
+        subject = message.channel()
+        if self._full(size):
+            if self._full_since is None:
+                self._full_since = time.monotonic()
+            if self.policy == COALESCE and self._coalesce(subject, message):
+                return
+            if self.policy == BLOCK:
+                self.blocked += 1
+                while self._full(size):
+                    self._not_full.clear()
+                    await self._not_full.wait()
+                    if self._closed:
+                        return
+            else:
+                while self._buffer and self._full(size):
+                    self._drop_oldest()
+
+        entry = [subject, message, size]
+        self._buffer.append(entry)
+        if self.policy == COALESCE:
+            self._subjects[subject] = entry
+        self._bytes += size
+        self._not_empty.set()
+
+    def _coalesce(self, subject: str, message: "Message") -> bool:
+        entry = self._subjects.get(subject)
+        if entry is None:
+            return False
+        merged = self.merge(entry[1], message) if self.merge is not None else message
+        if merged is None:
+            return False
+        size = len(merged.payload())
+        self._bytes += size - entry[2]
+        entry[1] = merged
+        entry[2] = size
+        self.coalesced += 1
+        return True
+
+    async def get(self, timeout: Optional[float] = None) -> Optional["Message"]:
+        """_Wait for the next message_
+
+        Args:
+            timeout (Optional[float], optional): _Seconds to wait, forever if None_. Defaults to None.
+
+        Returns:
+            Optional[Message]: _The next message, None on timeout or if the subscription is closed_
+        """
+        if not self._buffer:
+            try:
+                await asyncio.wait_for(self._wait_not_empty(), timeout)
+            except TimeoutError:
+                return None
+            if not self._buffer:
+                return None
+        subject, message, size = entry = self._buffer.popleft()
+        if self._subjects.get(subject) is entry:
+            del self._subjects[subject]
+        self._bytes -= size
+        self.delivered += 1
+        if self._full_since is not None and len(self._buffer) <= self.maxsize // 2 and (
+            self.max_bytes <= 0 or self._bytes <= self.max_bytes // 2
+        ):
+            self._full_since = None
+        self._not_full.set()
+        return message
+
+    async def _wait_not_empty(self):
+        while not self._buffer and not self._closed:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+
+    def close(self):
+        """_Close the subscription_
+
+        Buffered messages are discarded and waiting consumers and producers return.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._buffer.clear()
+        self._subjects.clear()
+        self._bytes = 0
+        self._not_empty.set()
+        self._not_full.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> "Message":
+        message = await self.get()
+        if message is None:
+            raise StopAsyncIteration
+        return message
@@ -0,0 +1,248 @@
+"""Compressed and chunked transfer of large payloads for EventBroker implementations"""
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+import hashlib
+from logging import Logger
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
+import zlib
+
+
+ENCODING: str = "Digsinet-Encoding"
+TRANSFER: str = "Digsinet-Transfer"
+CHUNK: str = "Digsinet-Chunk"
+DIGEST: str = "Digsinet-Digest"
+ZLIB: str = "zlib"
+TRANSFER_HEADERS: Tuple[str, ...] = (ENCODING, TRANSFER, CHUNK, DIGEST)
+# Compressed payloads are only sent if they save at least this fraction
+_MIN_SAVING: float = 0.1
+
+Frame = Tuple[bytes, Dict[str, str]]
+
+
+@dataclass
+class TransferStats:
+    """
+    Counters of the compressed and chunked transfers of a broker.
+
+    Attributes:
+        compressed (int): number of sent payloads that were compressed
+        chunked (int): number of sent payloads that were split into chunks
+        chunks (int): number of sent chunks
+        saved_bytes (int): number of bytes saved by compression
+        assembled (int): number of received chunked payloads that were reassembled
+        corrupted (int): number of received payloads dropped because of a failed integrity check
+        expired (int): number of received chunked payloads dropped because chunks were missing
+        pending (int): number of chunked payloads being received
+        pending_bytes (int): bytes of the chunks of the payloads being received
+    """
+
+    compressed: int = 0
+    chunked: int = 0
+    chunks: int = 0
+    saved_bytes: int = 0
+    assembled: int = 0
+    corrupted: int = 0
+    expired: int = 0
+    pending: int = 0
+    pending_bytes: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class _Transfer:
+    """Chunks of a payload received so far"""
+
+    __slots__ = ("channel", "count", "chunks", "size", "started", "received")
+
+    def __init__(self, channel: str, count: int, received: float):
+        self.channel: str = channel
+        self.count: int = count
+        self.chunks: Dict[int, bytes] = dict()
+        self.size: int = 0
+        self.started: float = time.monotonic()
+        self.received: float = received
+
+
+class Transfers:
+    """
+    Compresses and splits large payloads on the sending side and reassembles
+    them on the receiving side.
+
+    Payloads of at least `compress_threshold` bytes are compressed with zlib,
+    unless that saves less than 10%. Payloads still larger than `chunk_size`
+    are split into chunks that are published one after another on the same
+    channel. Every chunk carries the ID of the transfer, its number and the
+    SHA-256 digest of the whole payload, so the receiver can reassemble the
+    chunks in any order and verify the payload before it is decoded.
+    Everything else, i.e. almost all messages, takes the fast path and is
+    sent unchanged without any headers.
+
+    Received chunks are buffered per subscription until their payload is
+    complete, so subscriptions of one broker matching the same channel each
+    reassemble their own copy of the payload. Transfers
+    missing chunks for `timeout` seconds are dropped, as are the oldest
+    transfers once the buffered chunks exceed `max_bytes`.
+
+    Queue groups deliver every message to one member only, so the chunks of
+    a payload published to a queue group would end up with different
+    members. Payloads for queue groups are not chunked, see
+    `EventBroker.frames`.
+
+    Attributes:
+        compress_threshold (int): payload size from which on payloads are compressed, 0 disables compression
+        compression_level (int): zlib compression level
+        chunk_size (int): maximum size of a sent payload, larger ones are split, 0 disables chunking
+        timeout (float): seconds a transfer may take to complete
+        max_bytes (int): maximum bytes of buffered chunks
+        stats (TransferStats): counters of sent and received transfers
+    """
+
+    def __init__(
+        self,
+        compress_threshold: int,
+        compression_level: int,
+        chunk_size: int,
+        timeout: float,
+        max_bytes: int,
+        logger: Logger,
+    ):
+        self.compress_threshold: int = compress_threshold
+        self.compression_level: int = compression_level
+        self.chunk_size: int = chunk_size
+        self.timeout: float = timeout
+        self.max_bytes: int = max_bytes
+        self.logger: Logger = logger
+        self.stats: TransferStats = TransferStats()
+        # Smallest payload that does not take the fast path
+        limits = [limit for limit in (compress_threshold, chunk_size + 1 if chunk_size > 0 else 0) if limit > 0]
+        self.threshold: int = min(limits) if limits else 1 << 62
+        # Incomplete transfers by subscription key and transfer ID
+        self._transfers: "OrderedDict[Tuple[str, str], _Transfer]" = OrderedDict()
+
+    def frames(self, payload: bytes, headers: Dict[str, str] | None, chunk: bool = True) -> List[Frame]:
+        """_Split a payload of at least `threshold` bytes into the frames to publish_
+
+        Args:
+            payload (bytes): _The encoded payload_
+            headers (Dict[str, str] | None): _Headers of the message, sent along with every frame_
+            chunk (bool, optional): _Split payloads larger than `chunk_size`, False only compresses_. Defaults to True.
+
+        Returns:
+            List[Frame]: _Payload and headers of every frame in order_
+        """
+        frame_headers: Dict[str, str] = dict(headers or ())
+        data: bytes = payload
+        if 0 < self.compress_threshold <= len(payload):
+            compressed = zlib.compress(payload, self.compression_level)
+            if len(compressed) <= len(payload) * (1 - _MIN_SAVING):
+                self.stats.compressed += 1
+                self.stats.saved_bytes += len(payload) - len(compressed)
+                frame_headers[ENCODING] = ZLIB
+                data = compressed
+        if not chunk or self.chunk_size <= 0 or len(data) <= self.chunk_size:
+            return [(data, frame_headers)]
+
+        count = (len(data) + self.chunk_size - 1) // self.chunk_size
+        frame_headers[TRANSFER] = uuid4().hex
+        frame_headers[DIGEST] = hashlib.sha256(data).hexdigest()
+        self.stats.chunked += 1
+        self.stats.chunks += count
+        view = memoryview(data)
+        return [
+            (bytes(view[index * self.chunk_size:(index + 1) * self.chunk_size]), {**frame_headers, CHUNK: f"{index}/{count}"})
+            for index in range(count)
+        ]
+
+    def receive(
+        self, subscription: str, channel: str, headers: Dict[str, str], payload: bytes, received: float
+    ) -> Optional[Tuple[Dict[str, str], bytes, float]]:
+        """_Take a received frame that does not take the fast path, i.e. has transfer headers_
+
+        Args:
+            subscription (str): _Key of the subscription the frame was received by_
+            channel (str): _The channel the frame was received on_
+            headers (Dict[str, str]): _Headers of the frame_
+            payload (bytes): _Payload of the frame_
+            received (float): _Monotonic time the frame was received_
+
+        Returns:
+            Optional[Tuple[Dict[str, str], bytes, float]]: _Headers without the transfer headers, the
+                decompressed payload and the time the first frame was received, None while chunks are
+                missing or if the payload was dropped_
+        """
+        self._expire()
+        transfer_id = headers.get(TRANSFER)
+        if transfer_id is not None:
+            assembled = self._add_chunk((subscription, transfer_id), channel, headers, payload, received)
+            if assembled is None:
+                return None
+            payload, received = assembled
+            if hashlib.sha256(payload).hexdigest() != headers.get(DIGEST):
+                self.stats.corrupted += 1
+                self.logger.error(f"Dropping message on channel {channel}: integrity check of transfer {transfer_id} failed")
+                return None
+            self.stats.assembled += 1
+        if headers.get(ENCODING) == ZLIB:
+            try:
+                payload = zlib.decompress(payload)
+            except zlib.error as e:
+                self.stats.corrupted += 1
+                self.logger.error(f"Dropping message on channel {channel}: failed to decompress payload: {e}")
+                return None
+        return {key: value for key, value in headers.items() if key not in TRANSFER_HEADERS}, payload, received
+
+    def _add_chunk(
+        self, key: Tuple[str, str], channel: str, headers: Dict[str, str], payload: bytes, received: float
+    ) -> Optional[Tuple[bytes, float]]:
+        try:
+            index, count = (int(part) for part in headers.get(CHUNK, "").split("/"))
+        except ValueError:
+            self.stats.corrupted += 1
+            self.logger.error(f"Dropping chunk of transfer {key[1]} on channel {channel}: malformed chunk header")
+            return None
+        transfer = self._transfers.get(key)
+        if transfer is None:
+            transfer = self._transfers[key] = _Transfer(channel, count, received)
+            self.stats.pending += 1
+        if index in transfer.chunks or not 0 <= index < transfer.count:
+            return None
+        transfer.chunks[index] = payload
+        transfer.size += len(payload)
+        self.stats.pending_bytes += len(payload)
+        if len(transfer.chunks) < transfer.count:
+            self._bound()
+            return None
+        self._remove(key)
+        return b"".join(transfer.chunks[index] for index in range(transfer.count)), transfer.received
+
+    def _remove(self, key: Tuple[str, str]) -> _Transfer:
+        transfer = self._transfers.pop(key)
+        self.stats.pending -= 1
+        self.stats.pending_bytes -= transfer.size
+        return transfer
+
+    def _drop(self, key: Tuple[str, str], reason: str):
+        transfer = self._remove(key)
+        self.stats.expired += 1
+        self.logger.warning(
+            f"Dropping message on channel {transfer.channel} for subscription {key[0]}: {reason}, "
+            f"received {len(transfer.chunks)} of {transfer.count} chunks of transfer {key[1]}"
+        )
+
+    def _expire(self):
+        if not self._transfers:
+            return
+        deadline = time.monotonic() - self.timeout
+        # Transfers are ordered by their start
+        while self._transfers:
+            key, transfer = next(iter(self._transfers.items()))
+            if transfer.started > deadline:
+                break
+            self._drop(key, f"no complete transfer within {self.timeout}s")
+
+    def _bound(self):
+        while self.stats.pending_bytes > self.max_bytes and len(self._transfers) > 1:
+            self._drop(next(iter(self._transfers)), "too many incomplete transfers buffered")
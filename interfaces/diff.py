@@ -0,0 +1,127 @@
+"""Incremental tree diff for node config and state"""
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from state.ops import ADDED, CHANGED, REMOVED
+
+
+@dataclass
+class TreeDelta:
+    """
+    A change between two versions of a tree.
+
+    Added and removed subtrees are reported once at their root, changes of
+    existing leaves per leaf.
+
+    Attributes:
+        op (str): add, change or remove
+        path (Tuple[str, ...]): keys leading to the changed subtree or leaf
+        value (Any): new value, None for removals
+    """
+
+    op: str
+    path: Tuple[str, ...]
+    value: Any = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"op": self.op, "path": list(self.path), "value": self.value}
+
+
+def diff_trees(old: Any, new: Any, prefix: Tuple[str, ...], deltas: List[TreeDelta]) -> Any:
+    """_Append the changes from old to new to deltas_
+
+    Returns a tree equal to new that reuses every unchanged subtree of old, so
+    the retained baseline shares structure with the previous one and
+    unchanged subtrees are never copied.
+
+    Args:
+        old (Any): _Previous tree_
+        new (Any): _Current tree_
+        prefix (Tuple[str, ...]): _Path of the trees_
+        deltas (List[TreeDelta]): _Receives the changes_
+
+    Returns:
+        Any: _The new baseline_
+    """
+    if old is new:
+        return old
+    if isinstance(old, dict) and isinstance(new, dict):
+        # Equal subtrees are skipped by a single comparison in C instead of a walk
+        if old == new:
+            return old
+        shared: Optional[Dict[str, Any]] = None
+        changes = len(deltas)
+        for key, value in new.items():
+            if key in old:
+                previous = old[key]
+                merged = diff_trees(previous, value, prefix + (key,), deltas)
+                unchanged = merged is previous
+            else:
+                deltas.append(TreeDelta(ADDED, prefix + (key,), value))
+                merged = value
+                unchanged = False
+            if shared is None and not unchanged:
+                # First difference, take over the unchanged children handled so far
+                shared = dict()
+                for previous_key in new:
+                    if previous_key == key:
+                        break
+                    shared[previous_key] = old[previous_key]
+            if shared is not None:
+                shared[key] = merged
+        for key in old.keys() - new.keys():
+            deltas.append(TreeDelta(REMOVED, prefix + (key,)))
+        if len(deltas) == changes:
+            return old
+        if shared is None:
+            # Only removals, keep the unchanged children of old
+            shared = {key: old[key] for key in new}
+        return shared
+    if old == new and type(old) is type(new):
+        return old
+    deltas.append(TreeDelta(CHANGED, prefix, new))
+    return new
+
+
+class TreeDiffer:
+    """
+    Keeps the last seen tree per node and path and emits only what changed.
+
+    Re-diffing an unchanged tree costs a single fingerprint comparison if the
+    caller supplies one, e.g. a hash of the raw device response, and a single
+    equality check of the trees otherwise.
+    """
+
+    def __init__(self):
+        self._last: Dict[Tuple[str, str], Tuple[Any, Optional[Hashable]]] = dict()
+
+    def diff(self, node: str, path: str, tree: Any, fingerprint: Optional[Hashable] = None) -> List[TreeDelta]:
+        """_Changes of the tree at path of node since the last call_
+
+        The first call for a node and path reports the whole tree as added.
+
+        Args:
+            node (str): _Name of the node_
+            path (str): _Path the tree was polled at_
+            tree (Any): _The current tree_
+            fingerprint (Optional[Hashable], optional): _Cheap identity of the tree, e.g. a hash of the raw response_. Defaults to None.
+
+        Returns:
+            List[TreeDelta]: _The changes, empty if nothing changed_
+        """
+        key = (node, path)
+        last = self._last.get(key)
+        if last is None:
+            self._last[key] = (tree, fingerprint)
+            return [TreeDelta(ADDED, (), tree)]
+        previous, previous_fingerprint = last
+        if fingerprint is not None and fingerprint == previous_fingerprint:
+            return []
+        deltas: List[TreeDelta] = list()
+        self._last[key] = (diff_trees(previous, tree, (), deltas), fingerprint)
+        return deltas
+
+    def forget(self, node: str, path: Optional[str] = None):
+        """_Drop the baseline of a node, of a single path or of all paths_"""
+        for key in [key for key in self._last if key[0] == node and (path is None or key[1] == path)]:
+            del self._last[key]
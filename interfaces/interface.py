@@ -1,13 +1,29 @@
 """Interface base class for DigSiNet"""
 from abc import ABC, abstractmethod
-from multiprocessing import Queue
+import asyncio
+import re
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
 from config.settings import InterfaceSettings, Settings
+from eventbroker import subjects
 from eventbroker.eventbroker import EventBroker
+from interfaces.diff import TreeDiffer
+from interfaces.paths import format_path, parse_path
+
+
+# Receives the update events of a poll, e.g. to publish them
+UpdatePublisher = Callable[[dict], Awaitable[None]]
 
 
 class Interface(ABC):
     """
     Abstract base class for interfaces.
+
+    Implementations poll a single node in pollNode. The base class polls many
+    nodes concurrently: at most `concurrency` nodes of the interface settings
+    are polled at the same time, every poll has to finish within
+    `node_timeout`, and a node that fails or times out does not affect the
+    others. The duration of polling all nodes is therefore set by the slowest
+    node and not by the sum over all nodes.
     """
 
     logger = None
@@ -16,7 +32,7 @@ class Interface(ABC):
     interface_config = dict()
     topology_interface_config: InterfaceSettings
 
-    def __init__(self, config: Settings, target_topology: str, logger, topology_prefix: str, topology_name: str):
+    def __init__(self, config: Settings, target_topology: str, logger, topology_prefix: str, topology_name: str, interface_name: str = 'gnmi'):
         '''
         Constructor
         '''
@@ -24,22 +40,162 @@ class Interface(ABC):
 
         self.config = config
 
-        self.topology_interface_config = self.getTopologyInterfaceConfig(target_topology)
+        self.interface_name = interface_name
+        self.topology_interface_config = self.getTopologyInterfaceConfig(target_topology, interface_name)
         self.topology_prefix = topology_prefix
         self.topology_name = topology_name
+        self.differ = TreeDiffer()
 
-    def getTopologyInterfaceConfig(self, target: str) -> InterfaceSettings | None:
+        interface_config = self.topology_interface_config
+        self.node_pattern = re.compile(interface_config.nodes) if interface_config is not None else None
+        self.node_timeout = (
+            interface_config.node_timeout
+            if interface_config is not None and interface_config.node_timeout is not None
+            else float(config.sync_interval)
+        )
+        # Bounds the number of nodes polled at the same time
+        self.concurrency = asyncio.Semaphore(max(1, interface_config.concurrency) if interface_config is not None else 1)
+
+    def getTopologyInterfaceConfig(self, target: str, interface_name: str = 'gnmi') -> InterfaceSettings | None:
         if target == "realnet":
-            if self.config.realnet.interfaces.get('gnmi') is not None:
-                return self.config.realnet.interfaces.get('gnmi')
+            if self.config.realnet.interfaces.get(interface_name) is not None:
+                return self.config.realnet.interfaces.get(interface_name)
         else:
-            if self.config.siblings.get(target).interfaces.get('gnmi') is not None:
-                return self.config.siblings.get(target).interfaces.get('gnmi')
+            if self.config.siblings.get(target).interfaces.get(interface_name) is not None:
+                return self.config.siblings.get(target).interfaces.get(interface_name)
+
+    def topologyNodeName(self, node_name: str) -> str:
+        '''
+        Name of a node in the topology, without the container name prefix of
+        containerlab (<prefix>-<topology>-).
+        '''
+        prefix = f"{self.topology_prefix}-{self.topology_name}-"
+        return node_name[len(prefix):] if node_name.startswith(prefix) else node_name
+
+    def matchesNode(self, node_name: str) -> bool:
+        '''
+        Whether the node is one of the nodes of the interface settings.
+        '''
+        return self.node_pattern is not None and self.node_pattern.fullmatch(self.topologyNodeName(node_name)) is not None
 
     @abstractmethod
-    def getNodesUpdate(self, nodes: dict, queues: dict[Queue], broker: EventBroker, diff: bool = False):
+    async def pollNode(self, node_name: str, node: Any, diff: bool = False) -> List[dict]:
+        '''
+        Poll a single node and return its update events, see buildNodeUpdate.
+
+        node_name is the name of the node in the topology, node the entry of the
+        node in the nodes passed to getNodesUpdate, e.g. its ClabNode.
+        '''
         pass
 
+    async def updateNode(
+        self, node_name: str, node: Any, broker: EventBroker, diff: bool = False, publish: UpdatePublisher | None = None
+    ) -> bool:
+        '''
+        Poll a node within its deadline and publish its updates.
+
+        Waiting for one of the `concurrency` slots does not count against the
+        deadline of the node, publishing happens after the slot was released.
+        Updates are passed through filterNodeUpdate and published on the
+        telemetry subject of the node and path unless a publisher is passed.
+
+        Returns whether the node changed. Raises TimeoutError if the node did
+        not answer within `node_timeout` and whatever the poll raised.
+        '''
+        async with self.concurrency:
+            async with asyncio.timeout(self.node_timeout):
+                events = await self.pollNode(self.topologyNodeName(node_name), node, diff)
+        events = [filtered for event in events if (filtered := self.filterNodeUpdate(event)) is not None]
+        for event in events:
+            if publish is not None:
+                await publish(event)
+            else:
+                await self.publishNodeUpdate(broker, event)
+        return bool(events)
+
+    async def getNodesUpdate(
+        self, nodes: dict, broker: EventBroker, diff: bool = False, publish: UpdatePublisher | None = None
+    ) -> Dict[str, str]:
+        '''
+        Poll all nodes matching the interface settings concurrently and publish
+        their updates, see updateNode.
+
+        Returns the nodes that failed or timed out, mapped to the reason.
+        '''
+        matching = [node_name for node_name in nodes if self.matchesNode(node_name)]
+        results = await asyncio.gather(
+            *(self.updateNode(node_name, nodes[node_name], broker, diff, publish) for node_name in matching),
+            return_exceptions=True,
+        )
+        failed: Dict[str, str] = dict()
+        for node_name, result in zip(matching, results):
+            if isinstance(result, TimeoutError):
+                failed[node_name] = f"no response within {self.node_timeout}s"
+            elif isinstance(result, BaseException):
+                failed[node_name] = str(result) or type(result).__name__
+        return failed
+
+    async def publishNodeUpdate(self, broker: EventBroker, event: dict):
+        '''
+        Publish an update event on the telemetry subject of its node and path.
+        '''
+        await broker.publish(
+            subjects.telemetry(self.config.topology_name, event["node"], event["path"]),
+            event,
+            # Only complete trees supersede earlier events, deltas must all be delivered
+            key=f"{event['node']}|{event['path']}" if event["type"] == "telemetry" else None,
+        )
+
+    def filterNodeUpdate(self, event: dict) -> dict | None:
+        '''
+        Apply the compiled paths and strip settings of the interface to an update event.
+
+        Returns None if nothing of the event is below one of the watched paths.
+        Deltas of an event at a path above the watched paths are kept only if
+        they are below one of them. The event is published under its path
+        without the longest matching strip prefix.
+        '''
+        if self.topology_interface_config is None:
+            return event
+        path_filter = self.topology_interface_config.path_filter
+        elements = parse_path(event["path"])
+        if not path_filter.includes(elements):
+            if event["type"] != "telemetry delta":
+                return None
+            deltas = [
+                delta for delta in event["deltas"]
+                if path_filter.includes(elements + parse_path("/".join(str(key) for key in delta["path"])))
+            ]
+            if not deltas:
+                return None
+            event = {**event, "deltas": deltas}
+        stripped = path_filter.stripped(elements)
+        if stripped is not elements:
+            event = {**event, "path": format_path(stripped)}
+        return event
+
+    def buildNodeUpdate(self, node_name: str, path: str, tree: Any, diff: bool = False, fingerprint: Hashable | None = None) -> dict | None:
+        '''
+        Build the update event for a tree polled from a node.
+
+        Without diff the event carries the whole tree. With diff only the added,
+        changed and removed subtrees since the last poll of the node and path are
+        included, and None is returned if nothing changed. Implementations of
+        getNodesUpdate should pass a fingerprint of the raw response, e.g. its hash,
+        so unchanged responses are skipped without looking at the tree.
+        '''
+        if not diff:
+            return {"type": "telemetry", "node": node_name, "path": path, "tree": tree}
+        deltas = self.differ.diff(node_name, path, tree, fingerprint)
+        if not deltas:
+            return None
+        return {
+            "type": "telemetry delta",
+            "node": node_name,
+            "path": path,
+            "deltas": [delta.to_dict() for delta in deltas],
+        }
+
     @abstractmethod
     def setNodeUpdate(self, nodes: dict, node_name: str, path: str, notification_data: dict):
         pass
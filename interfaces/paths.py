@@ -0,0 +1,262 @@
+"""
+Compiled gNMI path matching for the `paths` and `strip` interface settings.
+
+Paths are parsed into elements with a name and optional keys, e.g.
+`openconfig:interfaces/interface[name=Ethernet1]` becomes the elements
+`openconfig:interfaces` and `interface` with the key `name=Ethernet1`. The
+configured paths are compiled into a prefix trie keyed on these elements, so
+checking an update path costs time proportional to its depth instead of the
+number of configured paths.
+
+Patterns support the gNMI wildcards:
+
+    *                   any single element
+    interface[name=*]   any value of the key, same as omitting the key
+    ...                 any number of elements, including none
+"""
+from functools import lru_cache
+from itertools import combinations
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+
+WILDCARD: str = "*"
+MULTI_WILDCARD: str = "..."
+
+Keys = FrozenSet[Tuple[str, str]]
+PathElement = Tuple[str, Keys]
+Path = Tuple[PathElement, ...]
+
+_NO_KEYS: Keys = frozenset()
+
+
+def _parse_element(element: str) -> PathElement:
+    bracket = element.find("[")
+    if bracket < 0:
+        return element, _NO_KEYS
+    name = element[:bracket]
+    keys: List[Tuple[str, str]] = list()
+    rest = element[bracket:]
+    while rest.startswith("["):
+        end = rest.find("]")
+        if end < 0:
+            raise ValueError(f"unterminated key in gNMI path element {element}")
+        key, _, value = rest[1:end].partition("=")
+        keys.append((key, value))
+        rest = rest[end + 1:]
+    if rest:
+        raise ValueError(f"unexpected {rest} after keys in gNMI path element {element}")
+    return name, frozenset(keys)
+
+
+@lru_cache(maxsize=65536)
+def parse_path(path: str) -> Path:
+    """_Parse a gNMI path into its elements_
+
+    Elements are separated by `/`, slashes inside `[key=value]` selectors do not
+    separate elements. Leading and trailing slashes are ignored. Update paths
+    repeat, so parsed paths are cached.
+
+    Args:
+        path (str): _The gNMI path_
+
+    Returns:
+        Path: _Tuple of (name, keys) elements_
+    """
+    elements: List[PathElement] = list()
+    start = 0
+    depth = 0
+    for index, character in enumerate(path):
+        if character == "[":
+            depth += 1
+        elif character == "]":
+            depth -= 1
+        elif character == "/" and depth == 0:
+            if index > start:
+                elements.append(_parse_element(path[start:index]))
+            start = index + 1
+    if len(path) > start:
+        elements.append(_parse_element(path[start:]))
+    return tuple(elements)
+
+
+def format_path(elements: Iterable[PathElement]) -> str:
+    """_Format parsed elements as gNMI path, the inverse of parse_path_"""
+    return "/".join(
+        name + "".join(f"[{key}={value}]" for key, value in sorted(keys)) for name, keys in elements
+    )
+
+
+class _TrieNode:
+    __slots__ = ("children", "any_child", "multi", "loops", "terminal")
+
+    def __init__(self, loops: bool = False):
+        # Children by element name and the keys the pattern requires
+        self.children: Dict[str, Dict[Keys, _TrieNode]] = dict()
+        self.any_child: Optional[_TrieNode] = None
+        # Node for patterns continuing after a `...` element
+        self.multi: Optional[_TrieNode] = None
+        # Reached through a `...` element, which keeps consuming elements
+        self.loops: bool = loops
+        self.terminal: bool = False
+
+
+_ONLY_NO_KEYS: List[Keys] = [_NO_KEYS]
+
+
+def _subsets(keys: Keys) -> List[Keys]:
+    """_All subsets of the keys of an update element, usually one or two_"""
+    if not keys:
+        return _ONLY_NO_KEYS
+    if len(keys) == 1:
+        return [_NO_KEYS, keys]
+    items = sorted(keys)
+    return [frozenset(subset) for size in range(len(items) + 1) for subset in combinations(items, size)]
+
+
+class PathTrie:
+    """
+    Prefix trie of gNMI path patterns.
+
+    A pattern element without keys, or with a wildcard key value, matches
+    elements of the same name with any value of the omitted keys. Lookups visit
+    every key subset of the update element instead of every pattern, which is
+    a constant for the one or two keys gNMI elements usually have.
+
+    Attributes:
+        patterns (Tuple[str, ...]): the compiled patterns
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: Tuple[str, ...] = tuple(patterns)
+        self._root: _TrieNode = _TrieNode()
+        # Whether any pattern contains `...`, otherwise no expansion is needed
+        self._multi: bool = False
+        for pattern in self.patterns:
+            self._insert(parse_path(pattern))
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def _insert(self, elements: Path):
+        node = self._root
+        for name, keys in elements:
+            if name == MULTI_WILDCARD:
+                self._multi = True
+                if node.multi is None:
+                    node.multi = _TrieNode(loops=True)
+                node = node.multi
+                continue
+            required: Keys = frozenset((key, value) for key, value in keys if value != WILDCARD)
+            if name == WILDCARD and not required:
+                if node.any_child is None:
+                    node.any_child = _TrieNode()
+                node = node.any_child
+                continue
+            by_keys = node.children.setdefault(name, dict())
+            child = by_keys.get(required)
+            if child is None:
+                child = by_keys[required] = _TrieNode()
+            node = child
+        node.terminal = True
+
+    def _expand(self, nodes: List[_TrieNode]) -> List[_TrieNode]:
+        """_Add the nodes reachable by letting a `...` element match nothing_"""
+        if not self._multi:
+            return nodes
+        expanded: List[_TrieNode] = list()
+        seen: Set[int] = set()
+        pending = list(nodes)
+        while pending:
+            node = pending.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            expanded.append(node)
+            if node.multi is not None:
+                pending.append(node.multi)
+        return expanded
+
+    def _walk(self, path: Path, longest: bool) -> Optional[int]:
+        matched: Optional[int] = None
+        active: List[_TrieNode] = self._expand([self._root])
+        depth = 0
+        while True:
+            for node in active:
+                if node.terminal:
+                    if not longest:
+                        return depth
+                    matched = depth
+                    break
+            if depth == len(path):
+                return matched
+            name, keys = path[depth]
+            subsets = _subsets(keys)
+            following: List[_TrieNode] = list()
+            for node in active:
+                for candidate in (name, WILDCARD):
+                    by_keys = node.children.get(candidate)
+                    if by_keys is not None:
+                        for required in subsets:
+                            child = by_keys.get(required)
+                            if child is not None:
+                                following.append(child)
+                if node.any_child is not None:
+                    following.append(node.any_child)
+                if node.loops:
+                    following.append(node)
+            if not following:
+                return matched
+            active = self._expand(following)
+            depth += 1
+
+    def match(self, path: Path) -> Optional[int]:
+        """_Length of the shortest prefix of path matching a pattern, None if there is none_"""
+        return self._walk(path, longest=False)
+
+    def longest_match(self, path: Path) -> Optional[int]:
+        """_Length of the longest prefix of path matching a pattern, None if there is none_"""
+        return self._walk(path, longest=True)
+
+
+class PathFilter:
+    """
+    Compiled `paths` and `strip` settings of an interface.
+
+    Attributes:
+        paths (PathTrie): paths to watch, every path is watched if empty
+        strip (PathTrie): prefixes to strip from watched paths
+    """
+
+    def __init__(self, paths: Iterable[str], strip: Iterable[str]):
+        self.paths: PathTrie = PathTrie(paths)
+        self.strip: PathTrie = PathTrie(strip)
+
+    def includes(self, path: str | Path) -> bool:
+        """_Whether an update at path is below one of the watched paths_"""
+        if not len(self.paths):
+            return True
+        elements = parse_path(path) if isinstance(path, str) else path
+        return self.paths.match(elements) is not None
+
+    def stripped(self, path: str | Path) -> Path:
+        """_The path without the longest matching strip prefix_"""
+        elements = parse_path(path) if isinstance(path, str) else path
+        if not len(self.strip):
+            return elements
+        length = self.strip.longest_match(elements)
+        return elements[length:] if length else elements
+
+    def apply(self, path: str) -> Optional[str]:
+        """_The stripped path of an update, None if the path is not watched_"""
+        elements = parse_path(path)
+        if not self.includes(elements):
+            return None
+        stripped = self.stripped(elements)
+        # Only paths that lost a prefix have to be formatted again
+        return path if stripped is elements else format_path(stripped)
+
+
+@lru_cache(maxsize=None)
+def compile_filter(paths: Tuple[str, ...], strip: Tuple[str, ...]) -> PathFilter:
+    """_Compile path settings, equal settings share one compiled filter_"""
+    return PathFilter(paths, strip)
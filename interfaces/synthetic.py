@@ -0,0 +1,304 @@
+"""Synthetic realnet interface generating gNMI-shaped telemetry without devices"""
+import asyncio
+import random
+import time
+from typing import Any, Dict, Iterable, List, Tuple
+
+from builders.containerlab import ClabNode, ClabResult
+from config.settings import Settings
+from config.synthetic import SyntheticSettings
+from interfaces.interface import Interface
+
+
+SYNTHETIC: str = "synthetic"
+# Leaves per container of a generated tree
+CONTAINER_SIZE: int = 16
+
+Keys = Tuple[str, ...]
+
+
+def node_names(settings: SyntheticSettings) -> List[str]:
+    """_Names of the simulated nodes_"""
+    return [settings.node_name.format(index=index) for index in range(1, settings.nodes + 1)]
+
+
+def synthetic_topology(settings: SyntheticSettings, name: str) -> Dict[str, Any]:
+    """_Containerlab-shaped definition of the simulated realnet_
+
+    The nodes are connected in a chain, `eth2` of every node to `eth1` of the
+    next one, so siblings can derive their topologies and adjust links as they
+    would for a containerlab realnet.
+
+    Args:
+        settings (SyntheticSettings): _Settings of the simulated realnet_
+        name (str): _Name of the topology_
+
+    Returns:
+        Dict[str, Any]: _The topology definition_
+    """
+    names = node_names(settings)
+    return {
+        "name": name,
+        "topology": {
+            "nodes": {node: {"kind": settings.kind, "image": settings.image} for node in names},
+            "links": [
+                {"endpoints": [f"{node}:eth2", f"{following}:eth1"]}
+                for node, following in zip(names, names[1:])
+            ],
+        },
+    }
+
+
+def simulated_deployment(topology_file: str, definition: Dict[str, Any]) -> ClabResult:
+    """_Result of a deployment that is skipped because the topology is simulated_
+
+    Every node of the definition is reported as running under its topology name.
+    """
+    nodes = (definition.get("topology") or dict()).get("nodes") or dict()
+    return ClabResult(
+        topology_file,
+        "deploy",
+        0,
+        [ClabNode(name, kind=str(node.get("kind", "")), image=str(node.get("image", "")), state="running")
+         for name, node in nodes.items()],
+        skipped=True,
+    )
+
+
+def _leaf_value(index: int, generator: random.Random) -> Any:
+    kind = index % 3
+    if kind == 0:
+        return generator.randrange(1 << 16)
+    if kind == 1:
+        return f"value-{generator.randrange(1 << 20):05x}"
+    return generator.random() < 0.5
+
+
+def _changed_value(value: Any, generator: random.Random) -> Any:
+    if isinstance(value, bool):
+        return not value
+    if isinstance(value, int):
+        # Counter-like, only ever grows
+        return value + generator.randrange(1, 1000)
+    return f"value-{generator.randrange(1 << 20):05x}"
+
+
+def _merge(tree: Any, update: Any) -> Any:
+    """_New tree with update merged into tree, tree is not modified_"""
+    if not isinstance(tree, dict) or not isinstance(update, dict):
+        return update
+    merged = dict(tree)
+    for key, value in update.items():
+        merged[key] = _merge(tree.get(key), value)
+    return merged
+
+
+def _leaves(tree: Any, prefix: Keys = ()) -> List[Keys]:
+    if not isinstance(tree, dict):
+        return [prefix] if prefix else []
+    leaves: List[Keys] = list()
+    for key, value in tree.items():
+        leaves.extend(_leaves(value, prefix + (key,)))
+    return leaves
+
+
+class SimulatedNode:
+    """
+    Config and state trees of a simulated node.
+
+    Every configured path has a tree of `tree_size` leaves in containers of
+    `CONTAINER_SIZE` leaves, below `config`, `state` or both depending on the
+    datatype. `update_rate` times per second, `change_ratio` of the leaves of
+    every tree change.
+
+    Trees are never modified in place. A change copies only the containers on
+    the way to the changed leaves and shares everything else with the previous
+    version, like a device response decoded anew would not share anything with
+    an earlier one, but at a fraction of the cost.
+
+    Attributes:
+        name (str): name of the node
+        trees (Dict[str, Dict[str, Any]]): current tree by path
+        versions (Dict[str, int]): number of changes of the tree by path
+    """
+
+    def __init__(
+        self,
+        name: str,
+        paths: Iterable[str],
+        datatype: str,
+        settings: SyntheticSettings,
+        generator: random.Random,
+        now: float,
+    ):
+        self.name: str = name
+        self.settings: SyntheticSettings = settings
+        self.trees: Dict[str, Dict[str, Any]] = dict()
+        self.versions: Dict[str, int] = dict()
+        self._generator: random.Random = generator
+        self._leaves: Dict[str, List[Keys]] = dict()
+        sections = ["config", "state"] if datatype == "all" else [datatype if datatype == "state" else "config"]
+        for path in paths:
+            self.trees[path] = self._generate(sections)
+            self.versions[path] = 0
+            self._leaves[path] = _leaves(self.trees[path])
+        # Nodes start at a random point of their update period, so they do not all change at once
+        self._next_update: float = (
+            now + generator.random() / settings.update_rate if settings.update_rate > 0 else float("inf")
+        )
+
+    def _generate(self, sections: List[str]) -> Dict[str, Any]:
+        tree: Dict[str, Any] = {section: dict() for section in sections}
+        for index in range(max(0, self.settings.tree_size)):
+            section = tree[sections[index % len(sections)]]
+            container = section.setdefault(f"container-{index // (CONTAINER_SIZE * len(sections))}", dict())
+            container[f"leaf-{index}"] = _leaf_value(index, self._generator)
+        return tree
+
+    def advance(self, now: float) -> bool:
+        """_Apply the updates due until now, returns whether anything changed_
+
+        Updates missed since the last call, e.g. because the node was polled
+        less often than it changes, are applied at once.
+        """
+        if now < self._next_update:
+            return False
+        rate = self.settings.update_rate
+        updates = int((now - self._next_update) * rate) + 1
+        self._next_update += updates / rate
+        changed = False
+        for path, leaves in self._leaves.items():
+            count = min(len(leaves), updates * max(0, round(len(leaves) * self.settings.change_ratio)))
+            if count:
+                self._change(path, self._generator.sample(leaves, count))
+                changed = True
+        return changed
+
+    def _change(self, path: str, leaves: List[Keys]):
+        root = dict(self.trees[path])
+        # Containers already copied by this change, by their keys
+        copied: Dict[Keys, Dict[str, Any]] = {(): root}
+        for keys in leaves:
+            parent = root
+            for depth in range(1, len(keys)):
+                child = copied.get(keys[:depth])
+                if child is None:
+                    child = copied[keys[:depth]] = dict(parent[keys[depth - 1]])
+                    parent[keys[depth - 1]] = child
+                parent = child
+            parent[keys[-1]] = _changed_value(parent[keys[-1]], self._generator)
+        self.trees[path] = root
+        self.versions[path] += 1
+
+    def update(self, path: str, value: Any, replace: bool = False):
+        """_Merge value into the tree at path, or replace the tree_"""
+        tree = value if replace or path not in self.trees else _merge(self.trees[path], value)
+        self.trees[path] = tree if isinstance(tree, dict) else {"value": tree}
+        self.versions[path] = self.versions.get(path, 0) + 1
+        self._leaves[path] = _leaves(self.trees[path])
+
+    def delete(self, path: str):
+        """_Remove everything below path, the path stays watched_"""
+        self.update(path, dict(), replace=True)
+
+
+class SyntheticInterface(Interface):
+    """
+    Interface to a simulated realnet, used with the topology type `synthetic`.
+
+    Produces config and state updates shaped like gNMI responses for the
+    simulated nodes matching the nodes of the interface settings, so the
+    realnet pipeline and the siblings can be load tested with thousands of
+    nodes and no containers. Updates are diffed and fingerprinted like those
+    of a device interface.
+    """
+
+    def __init__(
+        self,
+        config: Settings,
+        target_topology: str,
+        logger,
+        topology_prefix: str,
+        topology_name: str,
+        interface_name: str = 'gnmi',
+    ):
+        super().__init__(config, target_topology, logger, topology_prefix, topology_name, interface_name)
+        self.settings: SyntheticSettings = config.synthetic or SyntheticSettings()
+        self.simulated: Dict[str, SimulatedNode] = dict()
+        self._failures: random.Random = random.Random(self.settings.seed)
+
+    def simulatedNode(self, node_name: str) -> SimulatedNode | None:
+        '''
+        The simulated node of a node name, created on first use. None if the
+        node does not match the nodes of the interface settings.
+        '''
+        node_name = self.topologyNodeName(node_name)
+        simulated = self.simulated.get(node_name)
+        if simulated is not None:
+            return simulated
+        interface_config = self.topology_interface_config
+        if interface_config is None or not self.matchesNode(node_name):
+            return None
+        seed = self.settings.seed
+        generator = random.Random(f"{seed}:{node_name}") if seed is not None else random.Random()
+        simulated = self.simulated[node_name] = SimulatedNode(
+            node_name,
+            interface_config.paths or [""],
+            interface_config.datatype,
+            self.settings,
+            generator,
+            time.monotonic(),
+        )
+        return simulated
+
+    async def pollNode(self, node_name: str, node: Any, diff: bool = False) -> List[dict]:
+        '''
+        Advance a simulated node and build its update events.
+
+        The poll takes the configured latency and fails with the configured
+        failure ratio, like a device that is slow to answer or unreachable.
+        Without diff every poll reports the complete trees, with diff only what
+        changed since the last poll.
+        '''
+        simulated = self.simulatedNode(node_name)
+        if simulated is None:
+            return []
+        if self.settings.latency > 0:
+            await asyncio.sleep(self.settings.latency * (0.5 + self._failures.random()))
+        if self.settings.failure_ratio > 0 and self._failures.random() < self.settings.failure_ratio:
+            raise ConnectionError(f"simulated failure of node {node_name}")
+        simulated.advance(time.monotonic())
+        events: List[dict] = list()
+        for path, tree in simulated.trees.items():
+            event = self.buildNodeUpdate(node_name, path, tree, diff, fingerprint=simulated.versions[path])
+            if event is not None:
+                events.append(event)
+        return events
+
+    def setNodeUpdate(self, nodes: dict, node_name: str, path: str, notification_data: dict):
+        '''
+        Merge notification data into the tree of a node at path, like a gNMI update.
+        '''
+        simulated = self.simulatedNode(node_name)
+        if simulated is None:
+            self.logger.warning(f"Ignoring update of node {node_name}, it is not simulated by interface {self.interface_name}")
+            return
+        simulated.update(path, notification_data)
+
+    def set(self, nodes: dict, node_name: str, op: str, data: dict):
+        '''
+        Apply a gNMI set operation to a node. data maps paths to values for
+        update and replace, for delete only its keys are used.
+        '''
+        simulated = self.simulatedNode(node_name)
+        if simulated is None:
+            self.logger.warning(f"Ignoring {op} of node {node_name}, it is not simulated by interface {self.interface_name}")
+            return
+        for path, value in data.items():
+            if op == "delete":
+                simulated.delete(path)
+            elif op in ("update", "replace"):
+                simulated.update(path, value, replace=op == "replace")
+            else:
+                self.logger.warning(f"Ignoring unknown set operation {op} for node {node_name}")
+                return
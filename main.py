@@ -1,16 +1,23 @@
 from argparse import ArgumentParser, Namespace
+import asyncio
+import os
 from logging import Logger
 import logging
 from types import ModuleType
 from typing import Any, Dict, Optional
 import yaml
+from builders.containerlab import ClabResult, ContainerlabEngine, sibling_topology_file
+from builders.topology import Topology
 from config import settings
 from config.settings import  ControllerSettings, Settings
+from config.synthetic import SyntheticSettings
 from controllers.controller import Controller
 import importlib
 
 from controllers.realnet import RealnetController
 from controllers.sibling import SiblingController
+from controllers.worker import WorkerController, assign_workers
+from interfaces.synthetic import SYNTHETIC, synthetic_topology
 
 
 logger: Logger = logging.getLogger("digsinet-v2")
@@ -36,6 +43,7 @@ def main():
     parser.add_argument("--stop", help="Stop all siblings and cleanup containers", action="store_true")
     parser.add_argument("--config", help="Path to configuration file, defaults to digsinet.py", type=str, default="digsinet.yml")
     parser.add_argument("--start", help="Start digsinet-v2 with the specified configuration file", action="store_true")
+    parser.add_argument("--worker", help="Join a cluster as worker, only running siblings and no realnet", action="store_true")
 
     arguments: Namespace = parser.parse_args()
     try:
@@ -44,6 +52,12 @@ def main():
         logger.error("Aborting: Failed to read configuration file: %s", e)
         return
 
+    if arguments.worker:
+        if config.cluster is None:
+            logger.error("Aborting: --worker requires a cluster section in the configuration file")
+            return
+        config.cluster.role = "worker"
+
     if arguments.debug:
         logger.setLevel(logging.DEBUG)
         logger.debug("Debug logging enabled")
@@ -59,27 +73,48 @@ def main():
         return
 
 def stop_digsinet(config: Settings):
-    pass
+    """
+    Destroys the realnet and all sibling topologies in parallel.
+    """
+    global logger
+
+    topology_files: list[str] = [config.topology.file]
+    for sibling in config.siblings:
+        sibling_file: str = sibling_topology_file(config, sibling)
+        if os.path.exists(sibling_file):
+            topology_files.append(sibling_file)
+        else:
+            logger.debug(f"No topology definition for sibling {sibling} found at {sibling_file}")
+
+    engine: ContainerlabEngine = ContainerlabEngine(logger, concurrency=len(topology_files))
+    results: dict[str, ClabResult] = asyncio.run(engine.destroy_all(topology_files))
+    for topology_file, result in results.items():
+        if not result.ok:
+            logger.error(f"Failed to destroy topology {topology_file} (exit code {result.returncode})")
 
 def start_digsinet(config: Settings):
     global logger
     
     # Containerlab definition file. See containerlab docs for more info
     containerlab_topology_definition: Any = load_topology(config)
-    topology_name: str = containerlab_topology_definition.get("name")
+    # Parsed once before the controllers fork, all siblings derive their topology from it
+    containerlab_topology: Topology = Topology.from_definition(containerlab_topology_definition)
+    topology_name: str = containerlab_topology.name
     topology_prefix: str = "clab"
     # Contains the Sibling controllers- and the realnet controller modules
     controller_modules: dict[str, ModuleType] = load_controller_modules(config)
 
-    realnet_controller: RealnetController = create_controllers(
+    controllers: list[Controller] = create_controllers(
         digsinet_config=config, 
         containerlab_topology_config=containerlab_topology_definition, 
+        containerlab_topology=containerlab_topology,
         controller_modules=controller_modules, 
         logger=logger
     )
 
-    # The realnet controller terminating means the program ending
-    realnet_controller.join()
+    # The realnet controller terminating means the program ending, for cluster workers the workers terminating
+    for controller in controllers:
+        controller.join()
     
 
 def read_config(config_file: str) -> Settings:
@@ -91,17 +126,24 @@ def read_config(config_file: str) -> Settings:
         data: Any = yaml.safe_load(file)
         config = Settings(**data)
         if settings.validate_config(config):
+            settings.compile_paths(config)
             return config
         else:
-            raise Exception('configuration error: either nats, kafka or rabbitmq settings must be provided')
+            raise Exception('configuration error: exactly one of nats or shm settings must be provided')
 
 
 def load_topology(config: Settings) -> Any:
     """_Load Containerlab topology definition_
 
+    For the synthetic topology type the definition of the simulated realnet is generated instead.
+
     Args:
         config (Settings): _The settings to extract the containerlab definition from_
     """
+    if config.topology.type == SYNTHETIC:
+        synthetic_settings: SyntheticSettings = config.synthetic or SyntheticSettings()
+        logger.info(f"Simulating a realnet of {synthetic_settings.nodes} nodes, no containers are deployed")
+        return synthetic_topology(synthetic_settings, config.topology_name)
     try:
         with open(config.topology.file, "r") as file:
             topology_definition = yaml.safe_load(file)    
@@ -156,21 +198,32 @@ def load_controller_modules(config: Settings) -> dict[str, ModuleType] :
 def create_controllers(
     digsinet_config: Settings,
     containerlab_topology_config: Any,
+    containerlab_topology: Topology,
     controller_modules: dict[str, ModuleType],
     logger: Logger
-) -> RealnetController:
+) -> list[Controller]:
     """_Constructs all configured sibling- and the realnet-controllers_
+
+    Cluster workers only start the sibling workers. The realnet is deployed
+    and its controller run by the primary instance of the cluster alone, so
+    there is exactly one realnet state for the siblings to replicate.
+
+    Returns:
+        list[Controller]: _The controllers whose termination ends the program_
     """
 
     siblings: Dict[str, Dict[str, SiblingController]] = dict()
+    # Siblings are hosted by worker processes instead of a process each
+    pooled: bool = digsinet_config.sibling_workers > 0 or digsinet_config.cluster is not None
 
     for (sibling, sibling_config) in digsinet_config.siblings.items():
         siblings[sibling] = dict()
         if sibling_config.controller:
-            logger.info(f"Starting controller for {sibling}")
+            logger.info(f"{'Creating' if pooled else 'Starting'} controller for {sibling}")
             try:
                 sibling_controller_class: type[SiblingController] = getattr(controller_modules[sibling_config.controller], sibling_config.controller) 
-            except AttributeError as e:
+            except (AttributeError, KeyError) as e:
+                # KeyError if the module of the controller failed to load
                 logger.error(f"Failed to get controller class {sibling_config.controller} from module : {e}. Skipping")
                 continue    
             
@@ -179,14 +232,24 @@ def create_controllers(
                 logger=logger,
                 config=digsinet_config,
                 real_topology_definition=containerlab_topology_config,
-                sibling=sibling
+                real_topology=containerlab_topology,
+                sibling=sibling,
+                start_process=not pooled
             )
 
             siblings[sibling]["controller"] = controller
 
+    workers: list[WorkerController] = list()
+    if pooled:
+        workers = start_workers(digsinet_config, containerlab_topology_config, containerlab_topology, siblings, logger)
+
+    if digsinet_config.cluster is not None and digsinet_config.cluster.role == "worker":
+        logger.info("Running as cluster worker, the realnet is run by the primary instance")
+        return list(workers)
+
     # Start realnet controller
     try:
-        realnet_controller_class: type[RealnetController] = getattr(controller_modules["realnet"], "realnet")
+        realnet_controller_class: type[RealnetController] = getattr(controller_modules["realnet"], "RealnetController")
     except AttributeError as e:
         logger.fatal(f"Failed to get realnet controller class from module : {e}. This is fatal. Exiting")
         exit(1)
@@ -195,10 +258,60 @@ def create_controllers(
         siblings=siblings,
         logger=logger,
         config=digsinet_config,
-        real_topology_definition=containerlab_topology_config
+        real_topology_definition=containerlab_topology_config,
+        real_topology=containerlab_topology
     )
 
-    return realnet_controller
+    return [realnet_controller]
+
+
+def start_workers(
+    digsinet_config: Settings,
+    containerlab_topology_config: Any,
+    containerlab_topology: Topology,
+    siblings: Dict[str, Dict[str, SiblingController]],
+    logger: Logger
+) -> list[WorkerController]:
+    """_Starts the worker processes hosting the sibling controllers_
+
+    Siblings are balanced over the workers by the number of nodes of their topology.
+    In cluster mode every worker hosts all siblings and runs the ones it owns.
+    """
+    workers: list[WorkerController] = list()
+    if digsinet_config.cluster is not None:
+        controllers: list[SiblingController] = [entry["controller"] for entry in siblings.values() if "controller" in entry]
+        for index in range(max(1, digsinet_config.sibling_workers)):
+            logger.info(f"Starting cluster worker {index}")
+            workers.append(WorkerController(
+                logger=logger,
+                config=digsinet_config,
+                real_topology_definition=containerlab_topology_config,
+                index=index,
+                controllers=controllers,
+                real_topology=containerlab_topology
+            ))
+        return workers
+
+    weights: Dict[str, int] = dict()
+    for sibling, entry in siblings.items():
+        if "controller" not in entry:
+            continue
+        try:
+            weights[sibling] = sum(1 for _ in entry["controller"].sibling_topology(sibling).node_names())
+        except Exception:
+            weights[sibling] = sum(1 for _ in containerlab_topology.node_names())
+
+    for index, assigned in enumerate(assign_workers(weights, digsinet_config.sibling_workers)):
+        logger.info(f"Starting worker {index} for siblings {', '.join(assigned)}")
+        workers.append(WorkerController(
+            logger=logger,
+            config=digsinet_config,
+            real_topology_definition=containerlab_topology_config,
+            index=index,
+            controllers=[siblings[sibling]["controller"] for sibling in assigned],
+            real_topology=containerlab_topology
+        ))
+    return workers
     
 
 
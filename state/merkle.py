@@ -0,0 +1,245 @@
+"""Incremental Merkle hashes of node config trees for drift detection"""
+from dataclasses import dataclass
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Container, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+Path = Tuple[str, ...]
+# Fetches the child digests of remote subtrees, None for a subtree that is a leaf or missing
+FetchChildren = Callable[[List[Tuple[str, Path]]], Awaitable[List[Optional[Dict[str, str]]]]]
+
+DIGEST_SIZE: int = 16
+
+
+def leaf_digest(value: Any) -> bytes:
+    """_Digest of a leaf, or of any value that is not a dict_
+
+    Scalars are encoded directly, which is several times faster than JSON,
+    everything else as canonical JSON. The encoding only depends on the
+    decoded value, so both sides of a broker connection get the same digest.
+    """
+    kind = type(value)
+    if kind is str:
+        encoded = b"s" + value.encode()
+    elif kind is bool:
+        encoded = b"t" if value else b"f"
+    elif kind is int:
+        encoded = b"i" + str(value).encode()
+    elif kind is float:
+        encoded = b"d" + repr(value).encode()
+    elif value is None:
+        encoded = b"n"
+    else:
+        encoded = b"j" + json.dumps(value, sort_keys=True, separators=(",", ":"), default=str).encode()
+    return hashlib.blake2b(encoded, digest_size=DIGEST_SIZE).digest()
+
+
+class _HashNode:
+    """Cached digest of a subtree and of its children, None once invalidated"""
+
+    __slots__ = ("digest", "children")
+
+    def __init__(self):
+        self.digest: Optional[bytes] = None
+        self.children: Dict[str, "_HashNode"] = dict()
+
+
+class MerkleIndex:
+    """
+    Merkle hashes of the config trees of all nodes.
+
+    The digest of a leaf is a hash of its type-tagged encoding, see
+    `leaf_digest`: strings, numbers, booleans and None are encoded directly, other
+    values like lists as canonical JSON. The digest of a dict is a hash of its
+    sorted keys and the digests of their values.
+    Two trees are equal if and only if their digests are, and two trees that
+    differ only below some key have equal digests for all other keys.
+
+    Digests are computed on demand and cached per subtree. A change of the
+    trees only invalidates the cached digests on the path to the changed
+    subtree, so after a change only that path is hashed again, at a cost of
+    the depth of the change times the number of children of the dicts on
+    the way, not the size of the tree. The trees themselves are not copied,
+    every change of them has to be reported with `invalidate`.
+
+    Attributes:
+        trees (Dict[str, Dict[str, Any]]): config tree per node, as kept by a StateStore
+    """
+
+    def __init__(self, trees: Dict[str, Dict[str, Any]]):
+        self.trees: Dict[str, Dict[str, Any]] = trees
+        self._nodes: Dict[str, _HashNode] = dict()
+
+    def reset(self, trees: Dict[str, Dict[str, Any]]):
+        """_Drop all cached digests, e.g. after the trees were replaced by a snapshot_"""
+        self.trees = trees
+        self._nodes.clear()
+
+    def invalidate(self, node: str, path: Sequence[str] = ()):
+        """_Report a change of the subtree at path of a node_"""
+        hashed = self._nodes.get(node)
+        if hashed is None:
+            return
+        if not path:
+            del self._nodes[node]
+            return
+        for key in path[:-1]:
+            hashed.digest = None
+            hashed = hashed.children.get(key)
+            if hashed is None:
+                return
+        hashed.digest = None
+        hashed.children.pop(path[-1], None)
+
+    def _digest(self, value: Any, hashed: _HashNode) -> bytes:
+        if hashed.digest is not None:
+            return hashed.digest
+        if not isinstance(value, dict):
+            hashed.children.clear()
+            hashed.digest = leaf_digest(value)
+            return hashed.digest
+        digest = hashlib.blake2b(b"D", digest_size=DIGEST_SIZE)
+        for key in sorted(value):
+            child = hashed.children.get(key)
+            if child is None:
+                child = hashed.children[key] = _HashNode()
+            encoded = key.encode()
+            digest.update(len(encoded).to_bytes(4, "big"))
+            digest.update(encoded)
+            digest.update(self._digest(value[key], child))
+        # Children of removed keys are no longer needed
+        if len(hashed.children) > len(value):
+            for key in hashed.children.keys() - value.keys():
+                del hashed.children[key]
+        hashed.digest = digest.digest()
+        return hashed.digest
+
+    def _lookup(self, node: str, path: Sequence[str]) -> Tuple[Any, Optional[_HashNode]]:
+        if node not in self.trees:
+            return None, None
+        value: Any = self.trees[node]
+        hashed = self._nodes.get(node)
+        if hashed is None:
+            hashed = self._nodes[node] = _HashNode()
+        for key in path:
+            if not isinstance(value, dict) or key not in value:
+                return None, None
+            # Hash the parent first, so the cached children match the tree
+            self._digest(value, hashed)
+            value = value[key]
+            hashed = hashed.children[key]
+        return value, hashed
+
+    def digest(self, node: str, path: Sequence[str] = ()) -> Optional[str]:
+        """_Hex digest of the subtree at path of a node, None if there is no such subtree_"""
+        value, hashed = self._lookup(node, path)
+        if hashed is None:
+            return None
+        return self._digest(value, hashed).hex()
+
+    def roots(self, exclude: Container[str] = ()) -> Dict[str, str]:
+        """_Hex digest of the tree of every node, except the excluded ones_"""
+        return {
+            node: digest for node in self.trees
+            if node not in exclude and (digest := self.digest(node)) is not None
+        }
+
+    def combined(self, exclude: Iterable[str] = ()) -> str:
+        """_Hex digest of the root digests of all nodes, except the excluded ones_"""
+        excluded = set(exclude)
+        digest = hashlib.blake2b(b"R", digest_size=DIGEST_SIZE)
+        for node, root in sorted(self.roots(excluded).items()):
+            encoded = node.encode()
+            digest.update(len(encoded).to_bytes(4, "big"))
+            digest.update(encoded)
+            digest.update(bytes.fromhex(root))
+        return digest.hexdigest()
+
+    def children(self, node: str, path: Sequence[str] = ()) -> Optional[Dict[str, str]]:
+        """_Hex digests of the children of the subtree at path, None if it is a leaf or missing_"""
+        value, hashed = self._lookup(node, path)
+        if hashed is None or not isinstance(value, dict):
+            return None
+        self._digest(value, hashed)
+        return {key: child.digest.hex() for key, child in hashed.children.items() if child.digest is not None}
+
+
+@dataclass
+class Drift:
+    """
+    A subtree that differs between two Merkle indexes.
+
+    Attributes:
+        node (str): name of the node
+        path (Path): keys of the differing subtree, empty if the whole node differs
+        local (Optional[str]): local digest of the subtree, None if it only exists remotely
+        remote (Optional[str]): remote digest of the subtree, None if it only exists locally
+    """
+
+    node: str
+    path: Path
+    local: Optional[str]
+    remote: Optional[str]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"node": self.node, "path": list(self.path), "local": self.local, "remote": self.remote}
+
+
+async def find_drift(
+    local: MerkleIndex,
+    remote_roots: Dict[str, str],
+    fetch_children: FetchChildren,
+    nodes: Optional[Sequence[str]] = None,
+) -> List[Drift]:
+    """_Find the smallest subtrees that differ between a local and a remote index_
+
+    Nodes with equal root digests are done after a single comparison. Below
+    differing roots, the child digests are compared level by level, the
+    remote ones fetched in one batch per level, and only children with
+    differing digests are descended into.
+
+    Args:
+        local (MerkleIndex): _The local index_
+        remote_roots (Dict[str, str]): _Root digests of the remote index by node_
+        fetch_children (FetchChildren): _Fetches remote child digests for a batch of node and path pairs_
+        nodes (Optional[Sequence[str]], optional): _Nodes to compare, all nodes of both sides if None_. Defaults to None.
+
+    Returns:
+        List[Drift]: _The differing subtrees, empty if the indexes are equal_
+    """
+    local_roots = local.roots()
+    if nodes is None:
+        nodes = sorted(local_roots.keys() | remote_roots.keys())
+    else:
+        local_roots = {node: local_roots[node] for node in nodes if node in local_roots}
+    drift: List[Drift] = list()
+    # Differing subtrees to descend into, with their remote digest
+    frontier: List[Tuple[str, Path, str]] = list()
+    for node in nodes:
+        mine, theirs = local_roots.get(node), remote_roots.get(node)
+        if mine == theirs:
+            continue
+        if mine is None or theirs is None:
+            drift.append(Drift(node, (), mine, theirs))
+        else:
+            frontier.append((node, (), theirs))
+
+    while frontier:
+        remote_children = await fetch_children([(node, path) for node, path, _ in frontier])
+        following: List[Tuple[str, Path, str]] = list()
+        for (node, path, remote), theirs in zip(frontier, remote_children):
+            mine = local.children(node, path)
+            if mine is None or theirs is None:
+                # A leaf on at least one side, the subtree differs as a whole
+                drift.append(Drift(node, path, local.digest(node, path), remote))
+                continue
+            for key in sorted(mine.keys() | theirs.keys()):
+                if mine.get(key) == theirs.get(key):
+                    continue
+                if key in mine and key in theirs:
+                    following.append((node, path + (key,), theirs[key]))
+                else:
+                    drift.append(Drift(node, path + (key,), mine.get(key), theirs.get(key)))
+        frontier = following
+    return drift
@@ -0,0 +1,5 @@
+"""Operations of the tree deltas of telemetry delta events"""
+
+ADDED: str = "add"
+CHANGED: str = "change"
+REMOVED: str = "remove"
@@ -0,0 +1,212 @@
+"""Versioned in-memory state store for the realnet node configuration"""
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from state.merkle import MerkleIndex
+
+
+UPDATE: str = "update"
+DELETE: str = "delete"
+
+
+@dataclass
+class Delta:
+    """
+    A single change of the state.
+
+    Attributes:
+        sequence (int): sequence number assigned by the store
+        node (str): name of the node
+        path (Tuple[str, ...]): path of the changed subtree in the config tree of the node
+        op (str): update or delete
+        value (Any): new value of the subtree, None for deletes
+    """
+
+    sequence: int
+    node: str
+    path: Tuple[str, ...]
+    op: str
+    value: Any = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "sequence": self.sequence,
+            "node": self.node,
+            "path": list(self.path),
+            "op": self.op,
+            "value": self.value,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Delta":
+        return cls(data["sequence"], data["node"], tuple(data["path"]), data["op"], data.get("value"))
+
+
+class StateStore:
+    """
+    Per-node config trees with a monotonically increasing sequence number.
+
+    Every change is recorded as a delta, so a client that knows the state at
+    some sequence only has to fetch the deltas after it. The delta log is
+    bounded by `max_deltas`: `compact` drops deltas superseded by a later
+    change of the same path and then the oldest ones. Clients that fall behind
+    the oldest retained delta have to start over from a snapshot.
+
+    The same class is used as replica on the sibling side, by loading a
+    snapshot and applying the received deltas.
+
+    Both sides keep Merkle hashes of the trees, so a replica can verify that
+    it matches the realnet by comparing digests instead of trees.
+
+    Stored values are never mutated. A change copies the dicts along its path
+    and replaces them, so values passed in stay shared with the caller, e.g.
+    the baseline of the tree differ, and deltas in the log and snapshots
+    keep the values they were created with.
+
+    Attributes:
+        sequence (int): sequence number of the latest change
+        trees (Dict[str, Dict[str, Any]]): config tree per node
+        max_deltas (int): number of deltas retained by compaction
+        merkle (MerkleIndex): Merkle hashes of the trees, updated with every change
+    """
+
+    def __init__(self, max_deltas: int = 10000):
+        self.sequence: int = 0
+        self.trees: Dict[str, Dict[str, Any]] = dict()
+        self.max_deltas: int = max_deltas
+        self._log: Deque[Delta] = deque()
+        # Deltas after this sequence are available from the log
+        self._base_sequence: int = 0
+        self.merkle: MerkleIndex = MerkleIndex(self.trees)
+
+    def update(self, node: str, path: Sequence[str], value: Any) -> int:
+        """_Set the subtree at path of a node_
+
+        Returns:
+            int: _The sequence number of the change_
+        """
+        return self._record(Delta(self.sequence + 1, node, tuple(path), UPDATE, value))
+
+    def delete(self, node: str, path: Sequence[str] = ()) -> int:
+        """_Remove the subtree at path of a node, the whole node if path is empty_
+
+        Returns:
+            int: _The sequence number of the change_
+        """
+        return self._record(Delta(self.sequence + 1, node, tuple(path), DELETE))
+
+    def _record(self, delta: Delta) -> int:
+        self._apply(delta)
+        self.sequence = delta.sequence
+        self._log.append(delta)
+        if len(self._log) > 2 * self.max_deltas:
+            self.compact()
+        return delta.sequence
+
+    def _apply(self, delta: Delta):
+        self.merkle.invalidate(delta.node, delta.path)
+        if not delta.path:
+            if delta.op == DELETE:
+                self.trees.pop(delta.node, None)
+            else:
+                self.trees[delta.node] = delta.value
+            return
+
+        # Copy on write, the dicts along the path may be shared with earlier deltas and the caller
+        existing = self.trees.get(delta.node)
+        root: Dict[str, Any] = dict(existing) if isinstance(existing, dict) else dict()
+        tree: Dict[str, Any] = root
+        for key in delta.path[:-1]:
+            child = tree.get(key)
+            if not isinstance(child, dict):
+                if delta.op == DELETE:
+                    return
+                child = dict()
+            child = dict(child)
+            tree[key] = child
+            tree = child
+        if delta.op == DELETE:
+            if delta.path[-1] not in tree:
+                return
+            del tree[delta.path[-1]]
+        else:
+            tree[delta.path[-1]] = delta.value
+        self.trees[delta.node] = root
+
+    def snapshot(self) -> Dict[str, Any]:
+        """_The complete state and its sequence number_
+
+        The trees are not copied, encode the snapshot before the store changes.
+        """
+        return {"sequence": self.sequence, "nodes": self.trees}
+
+    def subtree(self, node: str, path: Sequence[str] = ()) -> Tuple[bool, Any]:
+        """_Whether the subtree at path of a node exists, and its value_"""
+        if node not in self.trees:
+            return False, None
+        value: Any = self.trees[node]
+        for key in path:
+            if not isinstance(value, dict) or key not in value:
+                return False, None
+            value = value[key]
+        return True, value
+
+    def deltas_since(self, sequence: int) -> Optional[List[Delta]]:
+        """_All deltas after sequence_
+
+        Args:
+            sequence (int): _Sequence number the client is at_
+
+        Returns:
+            Optional[List[Delta]]: _The deltas in order, None if they were compacted and a snapshot is required_
+        """
+        if sequence < self._base_sequence or sequence > self.sequence:
+            return None
+        if sequence == self.sequence:
+            return []
+        # The log is ordered, skip from the end since clients are usually close to the head
+        deltas: List[Delta] = list()
+        for delta in reversed(self._log):
+            if delta.sequence <= sequence:
+                break
+            deltas.append(delta)
+        deltas.reverse()
+        return deltas
+
+    def compact(self):
+        """_Bound the delta log_
+
+        Drops deltas that are superseded by a later delta of the same node and
+        path, then the oldest deltas beyond `max_deltas`.
+        """
+        latest: Dict[Tuple[str, Tuple[str, ...]], int] = dict()
+        for delta in self._log:
+            latest[(delta.node, delta.path)] = delta.sequence
+        if len(latest) < len(self._log):
+            self._log = deque(delta for delta in self._log if latest[(delta.node, delta.path)] == delta.sequence)
+        while len(self._log) > self.max_deltas:
+            self._base_sequence = self._log.popleft().sequence
+
+    def load(self, snapshot: Dict[str, Any]):
+        """_Replace the state with a snapshot received from another store_"""
+        self.trees = snapshot["nodes"]
+        self.sequence = snapshot["sequence"]
+        self.merkle.reset(self.trees)
+        self._log.clear()
+        self._base_sequence = self.sequence
+
+    def restore(self, node: str, path: Sequence[str], value: Any = None, exists: bool = True):
+        """_Overwrite a subtree with its value in the source store, without recording a change_
+
+        Used by replicas to repair subtrees that drifted from the source. The
+        sequence number stays the same, deltas received later apply on top.
+        """
+        self._apply(Delta(self.sequence, node, tuple(path), UPDATE if exists else DELETE, value))
+
+    def apply_deltas(self, deltas: Iterable[Delta]):
+        """_Apply deltas received from another store, keeping their sequence numbers_"""
+        for delta in deltas:
+            if delta.sequence <= self.sequence:
+                continue
+            self._record(delta)
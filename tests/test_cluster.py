@@ -0,0 +1,144 @@
+"""Failover of siblings between cluster workers on the shared-memory broker"""
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Tuple
+
+import pytest
+
+from config.settings import Settings
+from controllers.membership import rendezvous_score
+from controllers.sibling import SiblingController
+from controllers.worker import WorkerController
+from eventbroker.shm import ShmClient
+
+
+HEARTBEAT_INTERVAL: float = 0.2
+MEMBER_TIMEOUT: float = 1.0
+SIBLINGS = ["s1", "s2", "s3", "s4", "s5", "s6"]
+MEMBERS = ["m0", "m1", "m2"]
+REAL_TOPOLOGY = {"name": "lab", "topology": {"nodes": {"a": {"kind": "linux"}, "b": {"kind": "linux"}}}}
+
+
+class ProbeSibling(SiblingController):
+    """Announces which process runs the sibling instead of replicating the realnet"""
+
+    @property
+    def name(self) -> str:
+        return self.siblings[0]
+
+    @name.setter
+    def name(self, name: str):
+        self._name = name
+
+    def channels(self):
+        return [*super().channels(), probe_channel(self.config)]
+
+    async def async_run(self):
+        assert self.broker
+        while True:
+            await self.broker.publish(probe_channel(self.config), {"sibling": self.name, "pid": os.getpid()})
+            await asyncio.sleep(0.05)
+
+
+def probe_channel(config: Settings) -> str:
+    return f"digsinet.{config.topology_name}.probe"
+
+
+def settings(path: str, member_id: str) -> Settings:
+    return Settings(**{
+        "name": "cluster-test",
+        "topology": {"type": "containerlab", "file": os.path.join(path, "lab.clab.yml")},
+        "interval": 1,
+        "create_sibling_timeout": 5,
+        "realnet": {"apps": [], "interfaces": {}},
+        "siblings": {
+            sibling: {"topology-adjustments": None, "interfaces": {}, "controller": "probe", "autostart": False}
+            for sibling in SIBLINGS
+        },
+        "controllers": {},
+        "builders": {},
+        "interfaces": {},
+        "apps": {},
+        "shm": {"path": os.path.join(path, "broker"), "poll_interval": 100.0},
+        "cluster": {"member_id": member_id, "heartbeat_interval": HEARTBEAT_INTERVAL, "member_timeout": MEMBER_TIMEOUT},
+    })
+
+
+def start_member(path: str, member_id: str) -> WorkerController:
+    config = settings(path, member_id)
+    logger = logging.getLogger(f"test-cluster-{member_id}")
+    controllers = [ProbeSibling(logger, config, REAL_TOPOLOGY, sibling, start_process=False) for sibling in SIBLINGS]
+    return WorkerController(logger, config, REAL_TOPOLOGY, 0, controllers)
+
+
+def owner(members, sibling: str) -> str:
+    return max(members, key=lambda member: rendezvous_score(f"{member}-0", sibling))
+
+
+async def observe(config: Settings, until, timeout: float) -> Dict[str, Tuple[int, float]]:
+    """_Collect the process and time of the last announcement of every sibling until `until` holds_"""
+    broker = await ShmClient.create(config.shm, [probe_channel(config)], logging.getLogger("test-cluster-probe"))
+    running: Dict[str, Tuple[int, float]] = dict()
+
+    async def announced(message):
+        data = message.value()
+        running[data["sibling"]] = (data["pid"], time.monotonic())
+
+    try:
+        await broker.listen(probe_channel(config), announced)
+        deadline = time.monotonic() + timeout
+        while not until(running):
+            if time.monotonic() > deadline:
+                pytest.fail(f"Siblings were not run as expected within {timeout}s: {running}")
+            await asyncio.sleep(0.02)
+    finally:
+        await broker.close()
+    return running
+
+
+@pytest.fixture
+def members(tmp_path):
+    workers = {member: start_member(str(tmp_path), member) for member in MEMBERS}
+    yield workers
+    for worker in workers.values():
+        assert worker.process is not None
+        worker.process.kill()
+        worker.process.join()
+
+
+def test_siblings_of_failed_member_are_taken_over(tmp_path, members):
+    config = settings(str(tmp_path), "observer")
+    pids = {member: worker.process.pid for member, worker in members.items()}
+
+    def placed(running):
+        # Every sibling was announced recently by its owner
+        now = time.monotonic()
+        return all(
+            sibling in running and running[sibling][0] == pids[owner(MEMBERS, sibling)] and now - running[sibling][1] < 0.2
+            for sibling in SIBLINGS
+        )
+
+    # Ownership settles once all members heard each other's heartbeats
+    asyncio.run(observe(config, placed, timeout=10 * MEMBER_TIMEOUT))
+
+    failed = next(member for member in MEMBERS if any(owner(MEMBERS, sibling) == member for sibling in SIBLINGS))
+    lost = [sibling for sibling in SIBLINGS if owner(MEMBERS, sibling) == failed]
+    survivors = [member for member in MEMBERS if member != failed]
+    members[failed].process.kill()
+    members[failed].process.join()
+    killed = time.monotonic()
+
+    def taken_over(running):
+        return all(
+            sibling in running and running[sibling][1] > killed and running[sibling][0] == pids[owner(survivors, sibling)]
+            for sibling in lost
+        )
+
+    running = asyncio.run(observe(config, taken_over, timeout=5 * MEMBER_TIMEOUT))
+    takeover = max(running[sibling][1] for sibling in lost) - killed
+    # The failure is noticed at the first heartbeat check after member_timeout
+    assert takeover < MEMBER_TIMEOUT + 2 * HEARTBEAT_INTERVAL + 0.3
+    # Siblings of the surviving members stay where they are
+    assert all(running[sibling][0] == pids[owner(MEMBERS, sibling)] for sibling in SIBLINGS if sibling not in lost)
@@ -0,0 +1,220 @@
+"""ContainerlabEngine against a stub clab executable on PATH"""
+import asyncio
+import json
+import logging
+import os
+import stat
+import sys
+import time
+
+import pytest
+import yaml
+
+from builders.containerlab import STREAM_LIMIT, ContainerlabEngine
+
+
+# Mimics the clab operations the engine runs. The containers of the lab are kept in a state
+# file, every invocation is appended to a log file. Environment variables make it fail an
+# operation, sleep or print an overlong inventory line.
+STUB = """#!{python}
+import json, os, sys, time
+import yaml
+
+arguments = sys.argv[1:]
+operation = "veth" if arguments[:2] == ["tools", "veth"] else arguments[0]
+with open(os.environ["CLAB_STUB_LOG"], "a") as log:
+    log.write(json.dumps({{"arguments": arguments, "pid": os.getpid(), "started": time.time()}}) + "\\n")
+
+state_file = os.environ["CLAB_STUB_STATE"]
+running = json.load(open(state_file)) if os.path.exists(state_file) else dict()
+
+def option(name):
+    return arguments[arguments.index(name) + 1] if name in arguments else None
+
+def containers(topology_file):
+    definition = yaml.safe_load(open(topology_file))
+    nodes = definition["topology"]["nodes"]
+    return {{f"clab-{{definition['name']}}-{{node}}": node for node in nodes}}, nodes
+
+def inventory():
+    image = "x" * int(os.environ.get("CLAB_STUB_IMAGE_LENGTH", "0"))
+    print(json.dumps([{{"name": name, "kind": "linux", "image": image, "state": "running"}} for name in sorted(running)]))
+
+print(f"INFO Running {{operation}}", file=sys.stderr, flush=True)
+time.sleep(float(os.environ.get("CLAB_STUB_SLEEP", "0")))
+if operation in os.environ.get("CLAB_STUB_FAIL", "").split(","):
+    print(f"ERRO {{operation}} failed", file=sys.stderr)
+    sys.exit(1)
+
+node_filter = option("--node-filter")
+selected = set(node_filter.split(",")) if node_filter else None
+if operation == "deploy":
+    names, _ = containers(option("-t"))
+    print("Creating lab")
+    running.update({{name: node for name, node in names.items() if selected is None or node in selected}})
+    inventory()
+elif operation == "destroy":
+    names, _ = containers(option("-t"))
+    for name, node in names.items():
+        if selected is None or node in selected:
+            running.pop(name, None)
+elif operation == "inspect":
+    inventory()
+json.dump(running, open(state_file, "w"))
+"""
+
+
+def definition(image: str = "alpine") -> dict:
+    return {
+        "name": "lab",
+        "topology": {
+            "nodes": {"a": {"kind": "linux", "image": image}, "b": {"kind": "linux", "image": "alpine"}},
+            "links": [{"endpoints": ["a:eth1", "b:eth1"]}],
+        },
+    }
+
+
+@pytest.fixture
+def clab(tmp_path, monkeypatch):
+    executable = tmp_path / "bin" / "clab"
+    executable.parent.mkdir()
+    executable.write_text(STUB.format(python=sys.executable))
+    executable.chmod(executable.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{executable.parent}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("CLAB_STUB_LOG", str(tmp_path / "invocations.log"))
+    monkeypatch.setenv("CLAB_STUB_STATE", str(tmp_path / "running.json"))
+    return tmp_path
+
+
+def invocations(directory) -> list:
+    path = directory / "invocations.log"
+    if not path.exists():
+        return []
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def topology_file(directory, name: str = "lab.clab.yml", image: str = "alpine") -> str:
+    path = directory / name
+    path.write_text(yaml.safe_dump(definition(image)))
+    return str(path)
+
+
+def engine(concurrency: int = 4) -> ContainerlabEngine:
+    return ContainerlabEngine(logging.getLogger("test-containerlab"), concurrency=concurrency)
+
+
+def test_deploy_streams_output_and_parses_inventory(clab, caplog):
+    caplog.set_level(logging.INFO)
+    result = asyncio.run(engine().deploy(topology_file(clab)))
+
+    assert result.ok and result.operation == "deploy"
+    assert [node.name for node in result.nodes] == ["clab-lab-a", "clab-lab-b"]
+    assert all(node.state == "running" for node in result.nodes)
+    # Human readable lines of both streams are logged, the inventory is not
+    assert any("Creating lab" in message for message in caplog.messages)
+    assert any("INFO Running deploy" in message for message in caplog.messages)
+    assert not any('"name"' in message for message in caplog.messages)
+
+
+def test_failed_operation_returns_exit_code(clab, monkeypatch):
+    monkeypatch.setenv("CLAB_STUB_FAIL", "deploy")
+    result = asyncio.run(engine().deploy(topology_file(clab)))
+
+    assert result.returncode == 1 and not result.ok
+    assert result.nodes == []
+
+
+def test_missing_executable(clab):
+    result = asyncio.run(ContainerlabEngine(logging.getLogger("test-containerlab"), executable="no-such-clab").inspect("lab.clab.yml"))
+
+    assert result.returncode == 127
+
+
+def test_inventory_longer_than_stream_limit(clab, monkeypatch):
+    monkeypatch.setenv("CLAB_STUB_IMAGE_LENGTH", str(STREAM_LIMIT))
+    result = asyncio.run(engine().deploy(topology_file(clab)))
+
+    assert result.ok
+    assert [len(node.image) for node in result.nodes] == [STREAM_LIMIT, STREAM_LIMIT]
+
+
+def test_reconcile_skips_up_to_date_lab(clab):
+    file = topology_file(clab)
+
+    async def reconcile_twice():
+        first = await engine().reconcile(file, definition())
+        second = await engine().reconcile(file, definition())
+        return first, second
+
+    first, second = asyncio.run(reconcile_twice())
+
+    assert first.ok and not first.skipped
+    assert second.ok and second.skipped
+    assert [call["arguments"][0] for call in invocations(clab)] == ["deploy", "inspect"]
+
+
+def test_reconcile_updates_changed_node_in_place(clab):
+    file = topology_file(clab)
+
+    async def reconcile_changed():
+        await engine().reconcile(file, definition())
+        return await engine().reconcile(file, definition(image="alpine:edge"))
+
+    result = asyncio.run(reconcile_changed())
+
+    assert result.ok and not result.skipped
+    calls = [call["arguments"] for call in invocations(clab)]
+    assert [call[0] for call in calls] == ["deploy", "inspect", "destroy", "deploy", "tools", "inspect"]
+    destroy, deploy, veth = calls[2], calls[3], calls[4]
+    # Changed nodes are destroyed through the previously deployed definition
+    assert os.path.basename(destroy[destroy.index("-t") + 1]).startswith(".previous-")
+    assert destroy[destroy.index("--node-filter") + 1] == "a"
+    assert deploy[deploy.index("--node-filter") + 1] == "a"
+    assert "--reconfigure" not in deploy
+    assert veth[veth.index("-a") + 1] == "clab-lab-a:eth1"
+    assert veth[veth.index("-b") + 1] == "clab-lab-b:eth1"
+    assert yaml.safe_load(open(file)) == definition(image="alpine:edge")
+
+
+def test_reconcile_redeploys_after_failed_partial_update(clab, monkeypatch):
+    file = topology_file(clab)
+    asyncio.run(engine().reconcile(file, definition()))
+    monkeypatch.setenv("CLAB_STUB_FAIL", "veth")
+
+    result = asyncio.run(engine().reconcile(file, definition(image="alpine:edge")))
+
+    assert result.ok
+    last = invocations(clab)[-1]["arguments"]
+    assert last[0] == "deploy" and "--reconfigure" in last and "--node-filter" not in last
+
+
+def test_destroy_all_runs_in_parallel(clab, monkeypatch):
+    files = [topology_file(clab, f"lab{index}.clab.yml") for index in range(3)]
+    monkeypatch.setenv("CLAB_STUB_SLEEP", "1")
+
+    started = time.monotonic()
+    results = asyncio.run(engine(concurrency=3).destroy_all(files))
+    duration = time.monotonic() - started
+
+    assert list(results) == files and all(result.ok for result in results.values())
+    assert duration < 2.5
+    starts = sorted(call["started"] for call in invocations(clab))
+    assert starts[-1] - starts[0] < 1
+
+
+def test_cancelled_operation_terminates_clab(clab, monkeypatch):
+    monkeypatch.setenv("CLAB_STUB_SLEEP", "30")
+
+    async def cancel_deploy():
+        task = asyncio.get_running_loop().create_task(engine().deploy(topology_file(clab)))
+        while not invocations(clab):
+            await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(asyncio.wait_for(cancel_deploy(), 10))
+
+    pid = invocations(clab)[0]["pid"]
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)